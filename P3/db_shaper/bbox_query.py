@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Builds a grid index over the shaped nodes and queries it by bounding box:
+#   bbox_query.py build
+#   bbox_query.py query MIN_LAT MIN_LON MAX_LAT MAX_LON
+import argparse
+import json
+import time
+
+import execute
+from main import spatial
+
+GRID_INDEX_DIR = execute.WRITE_DIR + 'grid_index'
+
+
+def build(nodes_path=execute.NODES_PATH, node_tags_path=execute.NODE_TAGS_PATH,
+          index_dir=GRID_INDEX_DIR, cell_size=spatial.CELL_SIZE):
+    return spatial.build_grid_index(nodes_path, node_tags_path, index_dir, cell_size)
+
+
+def query(min_lat, min_lon, max_lat, max_lon, index_dir=GRID_INDEX_DIR):
+    return spatial.GridIndex(index_dir).query(min_lat, min_lon, max_lat, max_lon)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Bounding box lookups over the shaped nodes.')
+    arg_parser.add_argument('--index-dir', default=GRID_INDEX_DIR)
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='index NODES_PATH and NODE_TAGS_PATH')
+    build_parser.add_argument('--nodes', default=execute.NODES_PATH)
+    build_parser.add_argument('--node-tags', default=execute.NODE_TAGS_PATH)
+    build_parser.add_argument('--cell-size', type=float, default=spatial.CELL_SIZE,
+                              help='grid cell size in degrees')
+    query_parser = commands.add_parser('query', help='print the nodes in a bbox as json lines')
+    for name in ('min_lat', 'min_lon', 'max_lat', 'max_lon'):
+        query_parser.add_argument(name, type=float)
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'build':
+        index = build(args.nodes, args.node_tags, args.index_dir, args.cell_size)
+        print('indexed {0} nodes in {1:.2f}s'.format(len(index), time.perf_counter() - start))
+    else:
+        nodes = query(args.min_lat, args.min_lon, args.max_lat, args.max_lon, args.index_dir)
+        for node in nodes:
+            print(json.dumps(node, ensure_ascii=False))
+        print('{0} nodes in {1:.1f}ms'.format(len(nodes), (time.perf_counter() - start) * 1000))
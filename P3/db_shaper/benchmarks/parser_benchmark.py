@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Compares the parser backends in main.runner.PARSERS (parse + shape, no
+# writing) on sample.osm and on a copy of it scaled up SCALE times.
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import inputs
+from main import parallel
+from main import runner
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', '..', 'db', 'sample.osm')
+SCALE = 20
+
+
+# Writes the body of osm_file scale times over into a single document.
+def scale_up(osm_file, scale, file_out):
+    start, end = parallel.find_shard_boundaries(osm_file, 1)[0]
+    with open(osm_file, 'rb') as f:
+        f.seek(start)
+        body = f.read(end - start)
+    with open(file_out, 'wb') as out:
+        out.write(parallel.SHARD_HEADER)
+        for _ in range(scale):
+            out.write(body)
+        out.write(parallel.SHARD_FOOTER)
+
+
+def _consume(osm_file, parser):
+    count = 0
+    for _ in runner.PARSERS[parser](osm_file, ('node', 'way')):
+        count += 1
+    return count
+
+
+def bench(osm_file, parser):
+    start = time.perf_counter()
+    count = _consume(osm_file, parser)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    _consume(osm_file, parser)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def report(label, osm_file):
+    print('{0} ({1:.1f} MB)'.format(label, os.path.getsize(osm_file) / 1e6))
+    for parser in sorted(runner.PARSERS):
+        if (parser == 'pbf') != inputs.is_pbf(osm_file):
+            continue
+        count, elapsed, peak = bench(osm_file, parser)
+        print('  {0:<10} {1:>9} elements {2:>8.2f} s {3:>10.0f} elements/s '
+              '{4:>8.2f} MB peak'.format(parser, count, elapsed, count / elapsed, peak / 1e6))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark the osm parser backends.')
+    arg_parser.add_argument('--osm', default=SAMPLE_PATH)
+    arg_parser.add_argument('--scale', type=int, default=SCALE)
+    args = arg_parser.parse_args()
+
+    report(os.path.basename(args.osm), args.osm)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scaled_path = os.path.join(tmp_dir, 'scaled.osm')
+        scale_up(args.osm, args.scale, scaled_path)
+        report('{0} x{1}'.format(os.path.basename(args.osm), args.scale), scaled_path)
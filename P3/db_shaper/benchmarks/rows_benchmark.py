@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Compares dict rows (CsvSink) with tuple rows (CsvTupleSink) end to end:
+# parse + shape + write the five csv files, on sample.osm scaled up SCALE
+# times.
+import argparse
+import gc as garbage
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import global_constants as gc
+from main import runner
+from main import sinks
+from parser_benchmark import SAMPLE_PATH, SCALE, scale_up
+
+ROW_SINKS = {'dict': sinks.CsvSink, 'tuple': sinks.CsvTupleSink}
+
+
+class _CountingSink(object):
+    def __init__(self, sink):
+        self.sink = sink
+        self.rows = 0
+
+    def write(self, elem):
+        for rows in elem.values():
+            self.rows += 1 if isinstance(rows, (dict, tuple)) else len(rows)
+        self.sink.write(elem)
+
+
+# Keeps every shaped element instead of writing it, so that the blocks its
+# rows hold can be counted.
+class _KeepingSink(object):
+    def __init__(self):
+        self.elems = []
+
+    def write(self, elem):
+        self.elems.append(elem)
+
+
+def _run(osm_file, parser, rows, out_dir, buffer_size=sinks.WRITE_BUFFER):
+    paths = {name: os.path.join(out_dir, name + '.csv') for name in gc.OUTPUT_FIELDS}
+    if rows == 'tuple':
+        sink = sinks.CsvTupleSink(paths, buffer_size=buffer_size)
+    else:
+        sink = ROW_SINKS[rows](paths)
+    with sink:
+        counter = _CountingSink(sink)
+        count = runner.shape_stream(osm_file, counter, parser=parser, rows=rows)
+    return count, counter.rows
+
+
+def _peak(osm_file, parser, rows, out_dir, buffer_size=sinks.WRITE_BUFFER):
+    tracemalloc.start()
+    _run(osm_file, parser, rows, out_dir, buffer_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+# Memory blocks (sys.getallocatedblocks) the rows of one element hold when
+# they reach the sink. The writers' own per-row objects, e.g.
+# UnicodeDictWriter's dict of str values, are freed before the next row and
+# so do not show here; the elements/s do include them.
+def _blocks_per_element(osm_file, parser, rows):
+    keeper = _KeepingSink()
+    garbage.collect()
+    before = sys.getallocatedblocks()
+    count = runner.shape_stream(osm_file, keeper, parser=parser, rows=rows)
+    garbage.collect()
+    blocks = sys.getallocatedblocks() - before
+    del keeper
+    return blocks / count
+
+
+# Returns elements, rows, seconds, blocks per element and the tracemalloc
+# peak, for tuple rows also with io's default buffer instead of
+# WRITE_BUFFER (dict rows always use the default).
+def bench(osm_file, parser, rows):
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        count, row_count = _run(osm_file, parser, rows, out_dir)
+        elapsed = time.perf_counter() - start
+        peak = _peak(osm_file, parser, rows, out_dir)
+        if rows == 'tuple':
+            default_peak = _peak(osm_file, parser, rows, out_dir, io.DEFAULT_BUFFER_SIZE)
+        else:
+            default_peak = peak
+    return (count, row_count, elapsed, _blocks_per_element(osm_file, parser, rows), peak,
+            default_peak)
+
+
+def report(label, osm_file, parsers=('iterparse', 'expat')):
+    print('{0} ({1:.1f} MB)'.format(label, os.path.getsize(osm_file) / 1e6))
+    print('  {0:<10} {1:<6} {2:>10} {3:>12} {4:>12} {5:>14} {6:>10} {7:>23}'.format(
+        'parser', 'rows', 'seconds', 'elements/s', 'rows/element', 'blocks/element', 'MB peak',
+        'MB peak, default buffer'))
+    for parser in parsers:
+        for rows in sorted(ROW_SINKS):
+            count, row_count, elapsed, blocks, peak, default_peak = bench(osm_file, parser, rows)
+            print('  {0:<10} {1:<6} {2:>10.2f} {3:>12.0f} {4:>12.2f} {5:>14.1f} {6:>10.2f} '
+                  '{7:>23.2f}'.format(parser, rows, elapsed, count / elapsed, row_count / count,
+                                      blocks, peak / 1e6, default_peak / 1e6))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark dict rows against tuple rows.')
+    arg_parser.add_argument('--osm', default=SAMPLE_PATH)
+    arg_parser.add_argument('--scale', type=int, default=SCALE)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scaled_path = os.path.join(tmp_dir, 'scaled.osm')
+        scale_up(args.osm, args.scale, scaled_path)
+        report('{0} x{1}'.format(os.path.basename(args.osm), args.scale), scaled_path)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Runs process_map end to end on a synthetic osm file (see synthetic_osm.py)
+# for a fixed set of configurations, with per-stage timings, and compares
+# elements/s and peak memory against the stored baselines.json. Exits with
+# status 1 when a configuration regressed by more than TOLERANCES.
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import tempfile
+import traceback
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+
+import execute
+import synthetic_osm
+from main import instrument
+
+BASELINES_PATH = os.path.join(BENCHMARK_DIR, 'baselines.json')
+ELEMENTS = 200000
+# Configuration name -> process_map keyword arguments.
+CASES = [('iterparse-dict-csv', {}),
+         ('expat-dict-csv', {'parser': 'expat'}),
+         ('expat-tuple-csv', {'parser': 'expat', 'rows': 'tuple'}),
+         ('expat-tuple-sqlite', {'parser': 'expat', 'rows': 'tuple', 'sink': 'sqlite'}),
+         ('iterparse-dict-csv-validate', {'validate': True}),
+         ('iterparse-dict-csv-2-workers', {'workers': 2})]
+# Largest accepted relative change against the baseline; elements/s may
+# not drop and peak RSS may not grow by more than this.
+TOLERANCES = {'elements_per_sec': 0.15, 'peak_rss_bytes': 0.25}
+# Seconds between checks that a case's process is still alive.
+POLL_INTERVAL = 1.0
+
+
+# Puts (summary, None) on results, or (None, traceback) if the case raised.
+def _run_case(osm_file, out_dir, options, results):
+    try:
+        options = dict(options)
+        validate = options.pop('validate', False)
+        if options.get('sink') == 'sqlite':
+            out = os.path.join(out_dir, 'osm.db')
+        else:
+            out = {name: os.path.join(out_dir, name + '.csv') for name in execute.OUTPUT_PATHS}
+        stats = instrument.Stats(progress_every=0)
+        execute.process_map(osm_file, validate, out=out, stats=stats, **options)
+        summary = stats.summary()
+        summary['peak_rss_bytes'] = max(summary['peak_rss_bytes'] or 0,
+                                        summary['peak_rss_children_bytes'] or 0) or None
+    except Exception:
+        results.put((None, traceback.format_exc()))
+    else:
+        results.put((summary, None))
+
+
+# Every case runs in a fresh process, so its peak RSS is its own. Raises
+# RuntimeError if the case raised or its process died without a result.
+def run_case(osm_file, options):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as out_dir:
+        process = context.Process(target=_run_case, args=(osm_file, out_dir, options, results))
+        process.start()
+        try:
+            while True:
+                try:
+                    summary, error = results.get(timeout=POLL_INTERVAL)
+                    break
+                except queue.Empty:
+                    if not process.is_alive():
+                        # It may have put its result just before exiting.
+                        try:
+                            summary, error = results.get(timeout=POLL_INTERVAL)
+                            break
+                        except queue.Empty:
+                            raise RuntimeError('case process exited with code {0} '
+                                               'without a result'.format(process.exitcode))
+        finally:
+            process.join()
+    if error is not None:
+        raise RuntimeError('case failed in its process:\n' + error)
+    return summary
+
+
+def machine():
+    return {'platform': platform.platform(), 'python': platform.python_version(),
+            'cpus': os.cpu_count()}
+
+
+# Returns the regression messages for one case.
+def compare(name, summary, baseline):
+    regressions = []
+    old = baseline.get(name)
+    if not old:
+        return regressions
+    for metric, tolerance in TOLERANCES.items():
+        if not old.get(metric) or not summary.get(metric):
+            continue
+        change = summary[metric] / old[metric] - 1
+        if metric == 'elements_per_sec' and change < -tolerance or \
+                metric == 'peak_rss_bytes' and change > tolerance:
+            regressions.append('{0}: {1} {2:+.0%} ({3:.0f} -> {4:.0f})'.format(
+                name, metric, change, old[metric], summary[metric]))
+    return regressions
+
+
+def report(name, summary, baseline):
+    timers = ' '.join('{0}={1:.2f}s'.format(stage, seconds)
+                      for stage, seconds in sorted(summary['timers'].items()) if seconds)
+    old = baseline.get(name, {})
+    print('{0:<30} {1:>9.0f} elements/s{2} {3:>7.1f} MB peak  {4}'.format(
+        name, summary['elements_per_sec'],
+        ' ({0:+.0%})'.format(summary['elements_per_sec'] / old['elements_per_sec'] - 1)
+        if old.get('elements_per_sec') else '',
+        (summary['peak_rss_bytes'] or 0) / 1e6, timers))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Run the db_shaper benchmark suite.')
+    arg_parser.add_argument('--elements', type=int, default=ELEMENTS,
+                            help='size of the synthetic input')
+    arg_parser.add_argument('--osm', default=synthetic_osm.SAMPLE_PATH,
+                            help='file to take the synthetic profile from')
+    arg_parser.add_argument('--cases', nargs='+', choices=[name for name, _ in CASES],
+                            help='only run these configurations')
+    arg_parser.add_argument('--baselines', default=BASELINES_PATH)
+    arg_parser.add_argument('--save-baseline', action='store_true',
+                            help='store this run as the new baseline')
+    args = arg_parser.parse_args()
+
+    stored = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            stored = json.load(f)
+    baseline = stored.get('results', {}) if stored.get('elements') == args.elements else {}
+    if stored and not baseline:
+        print('baseline was recorded for {0} elements; not comparing'.format(
+            stored.get('elements')))
+    elif stored and stored.get('machine') != machine():
+        print('note: baseline was recorded on {0}'.format(stored['machine']))
+
+    results = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        osm_file = os.path.join(tmp_dir, 'synthetic.osm')
+        synthetic_osm.generate(synthetic_osm.build_profile(args.osm), args.elements, osm_file)
+        print('{0} elements, {1:.1f} MB'.format(args.elements, os.path.getsize(osm_file) / 1e6))
+        for name, options in CASES:
+            if args.cases and name not in args.cases:
+                continue
+            try:
+                results[name] = run_case(osm_file, options)
+            except RuntimeError as e:
+                print('{0:<30} FAILED\n{1}'.format(name, e))
+                regressions.append('{0}: failed'.format(name))
+                continue
+            report(name, results[name], baseline)
+            regressions.extend(compare(name, results[name], baseline))
+
+    # Cases that were not run keep their stored baseline.
+    if args.save_baseline:
+        baseline.update((name, {'elements_per_sec': summary['elements_per_sec'],
+                                'peak_rss_bytes': summary['peak_rss_bytes'],
+                                'timers': summary['timers']})
+                        for name, summary in results.items())
+        with open(args.baselines, 'w') as f:
+            json.dump({'elements': args.elements, 'machine': machine(), 'results': baseline},
+                      f, indent=2, sort_keys=True)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# Generates synthetic osm files of any size with the statistical profile of
+# a real extract (sample.osm by default): node/way mix, tags per element,
+# tag key frequencies and values, nds per way, coordinates and metadata.
+import argparse
+import bisect
+import calendar
+import collections
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from xml.sax.saxutils import quoteattr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main.helper import functions as hf
+from parser_benchmark import SAMPLE_PATH
+
+# Most frequent values kept per tag key; rarer values are drawn from these.
+VALUES_PER_KEY = 50
+USERS = 500
+ELEMENTS = 1000000
+SEED = 1
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _top(counter, n=None):
+    return [[value, count] for value, count in counter.most_common(n)]
+
+
+# Reads osm_file once and returns its profile as a json-serializable dict.
+def build_profile(osm_file):
+    counts = collections.Counter()
+    tags_per = {'node': collections.Counter(), 'way': collections.Counter()}
+    keys = {'node': collections.Counter(), 'way': collections.Counter()}
+    values = collections.defaultdict(collections.Counter)
+    nds_per_way = collections.Counter()
+    users = collections.Counter()
+    versions = collections.Counter()
+    lats, lons, timestamps, changesets = [], [], [], []
+    for elem in hf.get_element(osm_file, tags=('node', 'way')):
+        kind = elem.tag
+        counts[kind] += 1
+        n_tags = 0
+        for tag in elem.iter('tag'):
+            keys[kind][tag.attrib['k']] += 1
+            values[tag.attrib['k']][tag.attrib['v']] += 1
+            n_tags += 1
+        tags_per[kind][n_tags] += 1
+        if kind == 'node':
+            lats.append(float(elem.attrib['lat']))
+            lons.append(float(elem.attrib['lon']))
+        else:
+            nds_per_way[sum(1 for _ in elem.iter('nd'))] += 1
+        users[(elem.attrib['uid'], elem.attrib['user'])] += 1
+        versions[int(elem.attrib['version'])] += 1
+        changesets.append(int(elem.attrib['changeset']))
+        timestamps.append(calendar.timegm(time.strptime(elem.attrib['timestamp'],
+                                                        TIMESTAMP_FORMAT)))
+    return {'source': os.path.basename(osm_file),
+            'counts': dict(counts),
+            'tags_per': {kind: _top(counter) for kind, counter in tags_per.items()},
+            'keys': {kind: _top(counter) for kind, counter in keys.items()},
+            'values': {key: _top(counter, VALUES_PER_KEY) for key, counter in values.items()},
+            'nds_per_way': _top(nds_per_way),
+            'users': [list(user) + [count] for user, count in users.most_common(USERS)],
+            'versions': _top(versions),
+            'bbox': [min(lats), min(lons), max(lats), max(lons)],
+            'changesets': [min(changesets), max(changesets)],
+            'timestamps': [min(timestamps), max(timestamps)]}
+
+
+# Draws from a [[value, weight], ...] list; precomputes the cumulative
+# weights once instead of on every draw.
+class _Sampler(object):
+    def __init__(self, weighted, rng):
+        self.values = [value for value, _ in weighted]
+        self.cum_weights = list(itertools.accumulate(weight for _, weight in weighted))
+        self.rng = rng
+
+    def __call__(self):
+        return self.values[bisect.bisect(self.cum_weights,
+                                         self.rng.random() * self.cum_weights[-1])]
+
+    def sample(self, n):
+        return self.rng.choices(self.values, cum_weights=self.cum_weights, k=n)
+
+
+def _attrs(rng, profile, users, versions, elem_id):
+    uid, user = users()
+    return 'changeset="{0}" id="{1}" timestamp="{2}" uid="{3}" user={4} version="{5}"'.format(
+        rng.randint(*profile['changesets']), elem_id,
+        time.strftime(TIMESTAMP_FORMAT, time.gmtime(rng.uniform(*profile['timestamps']))),
+        uid, quoteattr(user), versions())
+
+
+# Keys are drawn until n_tags distinct ones are found (or too many draws
+# repeat), since an element never has the same key twice.
+def _tags(out, kind, n_tags, key_samplers, value_samplers):
+    keys = {}
+    for _ in range(n_tags * 10):
+        keys[key_samplers[kind]()] = None
+        if len(keys) == n_tags:
+            break
+    for key in keys:
+        out.append('\t\t<tag k={0} v={1} />\n'.format(quoteattr(key),
+                                                     quoteattr(value_samplers[key]())))
+
+
+# Writes an osm file of about n_elements nodes and ways (nodes first, with
+# the profile's node/way ratio) to file_out. Ways only reference generated
+# nodes, mostly in runs of consecutive ids like real streets.
+def generate(profile, n_elements, file_out, seed=SEED):
+    rng = random.Random(seed)
+    counts = profile['counts']
+    n_nodes = max(1, int(n_elements * counts['node'] / (counts['node'] + counts.get('way', 0))))
+    n_ways = max(0, n_elements - n_nodes)
+    users = _Sampler([[tuple(user[:2]), user[2]] for user in profile['users']], rng)
+    versions = _Sampler(profile['versions'], rng)
+    tags_per = {kind: _Sampler(weighted, rng) for kind, weighted in profile['tags_per'].items()}
+    key_samplers = {kind: _Sampler(weighted, rng) for kind, weighted in profile['keys'].items()
+                    if weighted}
+    value_samplers = {key: _Sampler(weighted, rng) for key, weighted in profile['values'].items()}
+    nds_per_way = _Sampler(profile['nds_per_way'], rng)
+    min_lat, min_lon, max_lat, max_lon = profile['bbox']
+    first_id = 1000000
+
+    with open(file_out, 'w', encoding='utf8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm>\n')
+        for n in range(n_nodes):
+            out = []
+            n_tags = tags_per['node']() if 'node' in key_samplers else 0
+            attrs = _attrs(rng, profile, users, versions, first_id + n)
+            coords = 'lat="{0:.7f}" lon="{1:.7f}"'.format(rng.uniform(min_lat, max_lat),
+                                                          rng.uniform(min_lon, max_lon))
+            if n_tags:
+                out.append('\t<node {0} {1}>\n'.format(attrs, coords))
+                _tags(out, 'node', n_tags, key_samplers, value_samplers)
+                out.append('\t</node>\n')
+            else:
+                out.append('\t<node {0} {1} />\n'.format(attrs, coords))
+            f.write(''.join(out))
+        for n in range(n_ways):
+            out = ['\t<way {0}>\n'.format(_attrs(rng, profile, users, versions,
+                                                 first_id + n_nodes + n))]
+            n_nds = nds_per_way()
+            start = rng.randrange(n_nodes)
+            for position in range(n_nds):
+                ref = first_id + (start + position) % n_nodes
+                out.append('\t\t<nd ref="{0}" />\n'.format(ref))
+            if 'way' in key_samplers:
+                _tags(out, 'way', tags_per['way'](), key_samplers, value_samplers)
+            out.append('\t</way>\n')
+            f.write(''.join(out))
+        f.write('</osm>\n')
+    return n_nodes + n_ways
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Generate a synthetic osm file.')
+    arg_parser.add_argument('out', help='osm file to write')
+    arg_parser.add_argument('--elements', type=int, default=ELEMENTS)
+    arg_parser.add_argument('--osm', default=SAMPLE_PATH, help='file to take the profile from')
+    arg_parser.add_argument('--profile', help='json profile to use instead of --osm')
+    arg_parser.add_argument('--save-profile', help='also write the profile to this json file')
+    arg_parser.add_argument('--seed', type=int, default=SEED)
+    args = arg_parser.parse_args()
+
+    if args.profile:
+        with open(args.profile) as f:
+            profile = json.load(f)
+    else:
+        profile = build_profile(args.osm)
+    if args.save_profile:
+        with open(args.save_profile, 'w') as f:
+            json.dump(profile, f)
+    start = time.perf_counter()
+    count = generate(profile, args.elements, args.out, args.seed)
+    print('wrote {0} elements ({1:.1f} MB) in {2:.1f}s'.format(
+        count, os.path.getsize(args.out) / 1e6, time.perf_counter() - start))
@@ -1,59 +1,175 @@
-#!/usr/bin/env python3
-import cerberus
-import io
-
-from main import global_constants as gc
-from main import shaper_functions as sf
-from main.helper import functions as hf
-
-OSM_FILE_NAME = 'new-york_new-york.osm'
-DB = 'sql'
-VALIDATE = False
-
-READ_DIR = 'Q:\\Program Files\\Programming Applications\\Projects\\Udacity\\Data Analysis Nanodegree\\P3\\db\\'
-WRITE_DIR = READ_DIR + DB + '\\'
-OSM_PATH = READ_DIR + OSM_FILE_NAME
-NODES_PATH = WRITE_DIR + 'nodes.csv'
-NODE_TAGS_PATH = WRITE_DIR + 'nodes_tags.csv'
-WAYS_PATH = WRITE_DIR + 'ways.csv'
-WAY_NODES_PATH = WRITE_DIR + 'ways_nodes.csv'
-WAY_TAGS_PATH = WRITE_DIR + 'ways_tags.csv'
-
-
-def process_map(file_in, validate):
-    with io.open(NODES_PATH, 'w', encoding='utf8') as nodes_file, \
-            io.open(NODE_TAGS_PATH, 'w', encoding='utf8') as nodes_tags_file, \
-            io.open(WAYS_PATH, 'w', encoding='utf8') as ways_file, \
-            io.open(WAY_NODES_PATH, 'w', encoding='utf8') as way_nodes_file, \
-            io.open(WAY_TAGS_PATH, 'w', encoding='utf8') as way_tags_file:
-
-        nodes_writer = hf.UnicodeDictWriter(nodes_file, gc.NODE_FIELDS)
-        node_tags_writer = hf.UnicodeDictWriter(nodes_tags_file, gc.NODE_TAGS_FIELDS)
-        ways_writer = hf.UnicodeDictWriter(ways_file, gc.WAY_FIELDS)
-        way_nodes_writer = hf.UnicodeDictWriter(way_nodes_file, gc.WAY_NODES_FIELDS)
-        way_tags_writer = hf.UnicodeDictWriter(way_tags_file, gc.WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in hf.get_element(file_in, tags=('node', 'way')):
-            elem = sf.shape_element(element)
-            if elem:
-                if validate is True:
-                    hf.validate_element(elem, validator)
-
-                if element.tag == 'node':
-                    nodes_writer.writerow(elem['node'])
-                    node_tags_writer.writerows(elem['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(elem['way'])
-                    way_nodes_writer.writerows(elem['way_nodes'])
-                    way_tags_writer.writerows(elem['way_tags'])
-
-if __name__ == '__main__':
-    process_map(OSM_PATH, validate=VALIDATE)
+#!/usr/bin/env python3
+import argparse
+import os
+
+from main import audit
+from main import changes
+from main import checkpoint as cp
+from main import global_constants as gc
+from main import inputs
+from main import instrument
+from main import parallel
+from main import pipeline
+from main import runner
+from main import sinks
+from main.geometry import GeometrySink
+
+# May also be a .osm.bz2, .osm.gz or .osm.pbf file.
+OSM_FILE_NAME = 'new-york_new-york.osm'
+DB = 'sql'
+VALIDATE = False
+VALIDATOR = 'compiled'
+# Extra json rule sets (token -> replacement) on top of gc.CORRECTOR_MAPPING.
+RULE_FILES = []
+WORKERS = 1
+PARSER = 'iterparse'
+SINK = 'csv'
+# 'tuple' shapes rows into tuples for plain csv.writer / executemany sinks.
+ROWS = 'dict'
+# Also write ways_geometry (bounding box, length, centroid per way).
+GEOMETRY = False
+
+READ_DIR = 'Q:\\Program Files\\Programming Applications\\Projects\\Udacity\\Data Analysis Nanodegree\\P3\\db\\'
+WRITE_DIR = READ_DIR + DB + '\\'
+OSM_PATH = READ_DIR + OSM_FILE_NAME
+NODES_PATH = WRITE_DIR + 'nodes.csv'
+NODE_TAGS_PATH = WRITE_DIR + 'nodes_tags.csv'
+WAYS_PATH = WRITE_DIR + 'ways.csv'
+WAY_NODES_PATH = WRITE_DIR + 'ways_nodes.csv'
+WAY_TAGS_PATH = WRITE_DIR + 'ways_tags.csv'
+RELATIONS_PATH = WRITE_DIR + 'relations.csv'
+RELATION_MEMBERS_PATH = WRITE_DIR + 'relations_members.csv'
+RELATION_TAGS_PATH = WRITE_DIR + 'relations_tags.csv'
+OUTPUT_PATHS = {'node': NODES_PATH,
+                'node_tags': NODE_TAGS_PATH,
+                'way': WAYS_PATH,
+                'way_nodes': WAY_NODES_PATH,
+                'way_tags': WAY_TAGS_PATH,
+                'relation': RELATIONS_PATH,
+                'relation_members': RELATION_MEMBERS_PATH,
+                'relation_tags': RELATION_TAGS_PATH}
+WAY_GEOMETRY_NAME = 'ways_geometry.csv'
+WAY_GEOMETRY_PATH = WRITE_DIR + WAY_GEOMETRY_NAME
+NODE_INDEX_DIR = WRITE_DIR + 'node_index'
+SQLITE_PATH = WRITE_DIR + 'osm.db'
+CHECKPOINT_PATH = WRITE_DIR + 'checkpoint.json'
+OUTPUTS = {'csv': OUTPUT_PATHS, 'sqlite': SQLITE_PATH}
+
+
+def process_map(file_in, validate, workers=WORKERS, parser=PARSER, sink=SINK, out=None,
+                validator=VALIDATOR, rule_files=RULE_FILES, geometry=GEOMETRY,
+                node_index_dir=NODE_INDEX_DIR, rows=ROWS, stats=None, profile=None,
+                tag_audit=None, checkpoint=None, resume=False, pipelined=False):
+    out = out or OUTPUTS[sink]
+    fields = dict(gc.OUTPUT_FIELDS)
+    if inputs.is_pbf(file_in):
+        parser = 'pbf'
+    # Relations are only shaped when there is a csv file to take them.
+    tags = ('node', 'way', 'relation') if sink != 'csv' or 'relation' in out else ('node', 'way')
+    shape_options = {'validate': validate, 'parser': parser, 'validator': validator,
+                     'rule_files': rule_files, 'rows': rows, 'tags': tags}
+    if geometry:
+        if rows != 'dict':
+            raise ValueError('geometry needs dict rows')
+        if workers > 1 and not inputs.compression(file_in):
+            raise ValueError('geometry resolves ways against every node of the file, '
+                             'so it needs workers=1')
+        fields['way_geometry'] = gc.WAY_GEOMETRY_FIELDS
+        # Unless out names it, ways_geometry.csv goes next to the ways.
+        if sink == 'csv' and 'way_geometry' not in out:
+            if out['way'] == WAYS_PATH:
+                out = dict(out, way_geometry=WAY_GEOMETRY_PATH)
+            else:
+                out = dict(out, way_geometry=os.path.join(os.path.dirname(out['way']),
+                                                          WAY_GEOMETRY_NAME))
+    # checkpoint is the checkpoint file path (see checkpoint.py).
+    if checkpoint and (workers > 1 or sink != 'csv' or geometry or inputs.compression(file_in)):
+        raise ValueError('checkpoints need workers=1, csv output, no geometry and '
+                         'uncompressed input')
+    if pipelined and (geometry or checkpoint or tag_audit is not None):
+        raise ValueError('the pipelined mode has no geometry, checkpoints or tag audit')
+
+    # Compressed input cannot be split into shards; its workers decompress.
+    with instrument.profiled(profile):
+        if pipelined:
+            pipeline.process_map_pipelined(file_in, sink, out, workers, fields, stats=stats,
+                                           **shape_options)
+        elif checkpoint:
+            cp.process_map_checkpointed(file_in, out, checkpoint, resume, fields, stats=stats,
+                                        tag_audit=tag_audit, **shape_options)
+        elif workers > 1 and not inputs.compression(file_in):
+            parallel.process_map_parallel(file_in, sink, out, workers, stats=stats,
+                                          tag_audit=tag_audit, **shape_options)
+        else:
+            sink_class = (sinks.TUPLE_SINKS if rows == 'tuple' else sinks.SINKS)[sink]
+            with inputs.open_osm(file_in, workers) as osm_file, \
+                    sink_class(out, fields=fields) as sink_:
+                if geometry:
+                    with GeometrySink(sink_, node_index_dir) as geometry_sink:
+                        runner.shape_stream(osm_file, geometry_sink, stats=stats,
+                                            tag_audit=tag_audit, **shape_options)
+                else:
+                    runner.shape_stream(osm_file, sink_, stats=stats, tag_audit=tag_audit,
+                                        **shape_options)
+    if stats is not None:
+        stats.record_outputs(out)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Shape an OSM file into csv files.')
+    arg_parser.add_argument('--workers', type=int, default=WORKERS,
+                            help='number of worker processes; more than 1 shards the input')
+    arg_parser.add_argument('--parser', choices=sorted(runner.PARSERS), default=PARSER,
+                            help="'expat' shapes straight from parser callbacks without building elements")
+    arg_parser.add_argument('--sink', choices=sorted(sinks.SINKS), default=SINK,
+                            help="'sqlite' loads straight into SQLITE_PATH instead of writing csv files")
+    arg_parser.add_argument('--rows', choices=sorted(runner.ROW_FORMATS), default=ROWS,
+                            help="'tuple' skips the per-row dicts on the way to the writers")
+    arg_parser.add_argument('--validate', action='store_true', default=VALIDATE,
+                            help='validate every shaped element against helper/schema.py')
+    arg_parser.add_argument('--validator', choices=sorted(runner.VALIDATORS), default=VALIDATOR,
+                            help="'compiled' checks the schema without going through cerberus")
+    arg_parser.add_argument('--rules', action='append', default=RULE_FILES, metavar='JSON_FILE',
+                            help='extra tag value corrections (token -> replacement); repeatable')
+    arg_parser.add_argument('--geometry', action='store_true', default=GEOMETRY,
+                            help='also write ways_geometry from a node index kept in NODE_INDEX_DIR')
+    arg_parser.add_argument('--stats', action='store_true',
+                            help='time and count every stage, with a progress line on stderr')
+    arg_parser.add_argument('--progress', type=int, default=instrument.PROGRESS_EVERY, metavar='N',
+                            help='with --stats, elements between progress lines (0: none)')
+    arg_parser.add_argument('--summary', metavar='JSON_FILE',
+                            help='write the --stats summary to a json file (implies --stats)')
+    arg_parser.add_argument('--profile', metavar='PROF_FILE',
+                            help='run under cProfile and dump the stats here (or set {0})'.format(
+                                instrument.PROFILE_ENV))
+    arg_parser.add_argument('--audit', metavar='JSON_FILE',
+                            help='also audit the raw tag keys and values, in the same pass, '
+                                 'into a json report')
+    arg_parser.add_argument('--pipeline', action='store_true',
+                            help='read, shape (in --workers processes) and write (one thread per '
+                                 'output) side by side')
+    arg_parser.add_argument('--checkpoint', action='store_true',
+                            help='record a checkpoint in CHECKPOINT_PATH every {0} MB of input'.format(
+                                cp.CHECKPOINT_EVERY >> 20))
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='cut the outputs back to the last checkpoint and continue from it '
+                                 '(implies --checkpoint)')
+    arg_parser.add_argument('--changes', metavar='OSC_FILE',
+                            help='apply an osmChange file to the existing --sink output instead')
+    args = arg_parser.parse_args()
+    if args.changes:
+        changes.APPLIERS[args.sink](args.changes, OUTPUTS[args.sink])
+    else:
+        stats = instrument.Stats(args.progress) if args.stats or args.summary else None
+        tag_audit = audit.TagAudit() if args.audit else None
+        process_map(OSM_PATH, validate=args.validate, workers=args.workers, parser=args.parser,
+                    sink=args.sink, validator=args.validator, rule_files=args.rules,
+                    geometry=args.geometry, rows=args.rows, stats=stats, profile=args.profile,
+                    tag_audit=tag_audit,
+                    checkpoint=CHECKPOINT_PATH if args.checkpoint or args.resume else None,
+                    resume=args.resume, pipelined=args.pipeline)
+        if tag_audit is not None:
+            tag_audit.write_report(args.audit)
+        if stats is not None:
+            stats.progress('done')
+            if args.summary:
+                stats.write_summary(args.summary)
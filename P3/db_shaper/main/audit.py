@@ -0,0 +1,170 @@
+import collections
+import hashlib
+import json
+import math
+
+from main import shaper_functions as sf
+
+# Values tracked per key; keys with fewer distinct values are counted
+# exactly, the others keep their most frequent values (Space-Saving).
+TOP_VALUES = 64
+# 2 ** HLL_BITS registers per key for the distinct value estimate
+# (about 3% standard error at 10 bits).
+HLL_BITS = 10
+REPORT_VALUES = 20
+
+
+# Space-Saving top-k summary: at most capacity counters; a new value
+# replaces the smallest one and inherits its count as its error bound.
+# Summaries of separate shards merge into one with the same guarantee.
+class TopValues(object):
+    def __init__(self, capacity=TOP_VALUES):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, value, count=1):
+        counts = self.counts
+        if value in counts:
+            counts[value] += count
+        elif len(counts) < self.capacity:
+            counts[value] = count
+            self.errors[value] = 0
+        else:
+            smallest = min(counts, key=counts.get)
+            floor = counts.pop(smallest)
+            del self.errors[smallest]
+            counts[value] = floor + count
+            self.errors[value] = floor
+
+    # A value missing from a full summary may have been counted up to its
+    # smallest count, so that much is added to it, as count and as error.
+    def merge(self, other):
+        floor = min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+        other_floor = min(other.counts.values()) if len(other.counts) >= other.capacity else 0
+        counts, errors = {}, {}
+        for value in set(self.counts).union(other.counts):
+            counts[value] = self.counts.get(value, floor) + other.counts.get(value, other_floor)
+            errors[value] = self.errors.get(value, floor) + other.errors.get(value, other_floor)
+        keep = sorted(counts, key=counts.get, reverse=True)[:self.capacity]
+        self.counts = {value: counts[value] for value in keep}
+        self.errors = {value: errors[value] for value in keep}
+
+    # [[value, count, max overcount], ...], most frequent first.
+    def top(self, n=None):
+        values = sorted(self.counts, key=lambda value: (-self.counts[value], value))[:n]
+        return [[value, self.counts[value], self.errors[value]] for value in values]
+
+
+# HyperLogLog distinct count estimate. Values are hashed with blake2b, not
+# hash(), so that registers from different processes can be merged.
+class DistinctCount(object):
+    def __init__(self, bits=HLL_BITS):
+        self.bits = bits
+        self.registers = bytearray(1 << bits)
+
+    def add(self, value):
+        digest = int.from_bytes(hashlib.blake2b(value.encode('utf8'), digest_size=8).digest(),
+                                'big')
+        index = digest >> (64 - self.bits)
+        rest = digest & ((1 << (64 - self.bits)) - 1)
+        rank = 64 - self.bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+
+class _KeyStats(object):
+    def __init__(self, capacity, bits):
+        self.count = 0
+        self.values = TopValues(capacity)
+        self.distinct = DistinctCount(bits)
+
+
+# Audit of the raw tags (before shaping) of one streaming pass: problematic
+# and colon keys (sf.PROBLEMATIC_RE / sf.COLON_RE), per-key value
+# frequencies and distinct counts in bounded memory, and how often each
+# tag value correction rule fired. Pass it to runner.shape_stream (or
+# install it with sf.set_audit); audits of parallel shards merge().
+class TagAudit(object):
+    def __init__(self, top_values=TOP_VALUES, hll_bits=HLL_BITS):
+        self.top_values = top_values
+        self.hll_bits = hll_bits
+        self.tags = 0
+        self.problematic = collections.Counter()
+        self.colon_types = collections.Counter()
+        self.keys = {}
+        self.corrections = collections.Counter()
+        # Rule token -> replacement, for the rules that fired; kept here
+        # since extra rule sets may only be loaded in the shard workers.
+        self.replacements = {}
+
+    def add(self, key, value):
+        self.tags += 1
+        problematic = sf.PROBLEMATIC_RE.search(key)
+        if problematic:
+            self.problematic[key] += 1
+        elif sf.COLON_RE.match(key):
+            self.colon_types[key.partition(':')[0]] += 1
+        stats = self.keys.get(key)
+        if stats is None:
+            stats = self.keys[key] = _KeyStats(self.top_values, self.hll_bits)
+        stats.count += 1
+        # A value still tracked by the top values is already in the
+        # distinct count, which saves most of the hashing.
+        if value not in stats.values.counts:
+            stats.distinct.add(value)
+        stats.values.add(value)
+        # Tags with a problematic key are dropped before their value is
+        # corrected.
+        if problematic:
+            return
+        for token in sf.NORMALIZER.fired(value):
+            if token not in self.corrections:
+                self.replacements[token] = sf.NORMALIZER.mapping[token]
+            self.corrections[token] += 1
+
+    def merge(self, other):
+        self.tags += other.tags
+        self.problematic.update(other.problematic)
+        self.colon_types.update(other.colon_types)
+        self.corrections.update(other.corrections)
+        self.replacements.update(other.replacements)
+        for key, other_stats in other.keys.items():
+            stats = self.keys.get(key)
+            if stats is None:
+                self.keys[key] = other_stats
+            else:
+                stats.count += other_stats.count
+                stats.values.merge(other_stats.values)
+                stats.distinct.merge(other_stats.distinct)
+
+    def report(self, top=REPORT_VALUES):
+        return {'tags': self.tags,
+                'distinct_keys': len(self.keys),
+                'problematic_keys': {'tags': sum(self.problematic.values()),
+                                     'keys': dict(self.problematic.most_common())},
+                'colon_keys': {'tags': sum(self.colon_types.values()),
+                               'types': dict(self.colon_types.most_common())},
+                'corrections': {token: {'replacement': self.replacements[token], 'fired': count}
+                                for token, count in self.corrections.most_common()},
+                'keys': {key: {'tags': stats.count,
+                               'distinct_values': stats.distinct.estimate(),
+                               'top_values': stats.values.top(top)}
+                         for key, stats in sorted(self.keys.items(),
+                                                  key=lambda item: -item[1].count)}}
+
+    def write_report(self, path, top=REPORT_VALUES):
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump(self.report(top), f, indent=2, ensure_ascii=False)
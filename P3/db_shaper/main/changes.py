@@ -0,0 +1,142 @@
+import csv
+import io
+import os
+import xml.etree.cElementTree as ET
+
+from main import global_constants as gc
+from main import shaper_functions as sf
+from main.helper import functions as hf
+from main.sinks import SqliteSink
+
+ACTIONS = ('create', 'modify', 'delete')
+# Element kind -> outputs holding its rows; every output is keyed on 'id'.
+KIND_OUTPUTS = {'node': ['node', 'node_tags'],
+                'way': ['way', 'way_nodes', 'way_tags'],
+                'relation': ['relation', 'relation_members', 'relation_tags']}
+# Keep the journal on: unlike a full load, a failed update cannot simply be
+# rerun from scratch.
+CHANGE_PRAGMAS = ['PRAGMA synchronous = NORMAL',
+                  'PRAGMA temp_store = MEMORY']
+
+
+# Reads an osmChange (.osc) file into {(kind, id): (action, version, shaped)}.
+# Only the newest version of each element is kept; shaped is the
+# shape_element result, or None for deletes.
+def read_changes(osc_file, kinds=('node', 'way', 'relation')):
+    changes = {}
+    action = None
+    context = ET.iterparse(osc_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if elem.tag in ACTIONS:
+            action = elem.tag if event == 'start' else None
+        elif event == 'end' and elem.tag in kinds and action is not None:
+            key = (elem.tag, int(elem.attrib['id']))
+            version = int(elem.attrib['version'])
+            if key not in changes or changes[key][1] <= version:
+                shaped = sf.shape_element(elem) if action != 'delete' else None
+                changes[key] = (action, version, shaped)
+            root.clear()
+    return changes
+
+
+# Keeps the changes that are newer than what the output already holds.
+# existing_versions maps (kind, id) -> version for elements present there.
+def _applicable(changes, existing_versions):
+    applicable = {}
+    for key, (action, version, shaped) in changes.items():
+        existing = existing_versions.get(key)
+        if existing is not None and existing >= version:
+            continue
+        if existing is None and action == 'delete':
+            continue
+        applicable[key] = (action, version, shaped)
+    return applicable
+
+
+def _existing_csv_versions(paths, changes):
+    versions = {}
+    for kind in KIND_OUTPUTS:
+        wanted = {elem_id for change_kind, elem_id in changes if change_kind == kind}
+        if not wanted:
+            continue
+        with io.open(paths[kind], encoding='utf8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            id_col, version_col = header.index('id'), header.index('version')
+            for row in reader:
+                elem_id = int(row[id_col])
+                if elem_id in wanted:
+                    versions[(kind, elem_id)] = int(row[version_col])
+    return versions
+
+
+# Rewrites one csv output without the rows of replaced/deleted elements,
+# then appends the rows of created/modified ones.
+def _rewrite_csv(path, fields, removed_ids, new_rows):
+    tmp_path = path + '.tmp'
+    with io.open(path, encoding='utf8', newline='') as in_file, \
+            io.open(tmp_path, 'w', encoding='utf8') as out_file:
+        reader = csv.reader(in_file)
+        writer = csv.writer(out_file)
+        writer.writerow(next(reader))
+        for row in reader:
+            if int(row[0]) not in removed_ids:
+                writer.writerow(row)
+        hf.UnicodeDictWriter(out_file, fields).writerows(new_rows)
+    os.replace(tmp_path, path)
+
+
+# Applies an .osc file to the csv outputs of a previous run. Only files of
+# the element kinds present in the change file are rewritten.
+def apply_to_csv(osc_file, paths, fields=gc.OUTPUT_FIELDS):
+    changes = read_changes(osc_file)
+    applicable = _applicable(changes, _existing_csv_versions(paths, changes))
+    for kind, names in KIND_OUTPUTS.items():
+        kind_changes = {elem_id: shaped for (change_kind, elem_id), (_, _, shaped)
+                        in applicable.items() if change_kind == kind}
+        if not kind_changes:
+            continue
+        for name in names:
+            new_rows = []
+            for shaped in kind_changes.values():
+                if shaped is not None:
+                    rows = shaped[name]
+                    new_rows.extend([rows] if isinstance(rows, dict) else rows)
+            _rewrite_csv(paths[name], fields[name], set(kind_changes), new_rows)
+    return applicable
+
+
+def _existing_sqlite_versions(conn, changes, tables=gc.TABLE_NAMES):
+    versions = {}
+    for kind, elem_id in changes:
+        row = conn.execute('SELECT version FROM {0} WHERE id = ?'.format(tables[kind]),
+                           (elem_id,)).fetchone()
+        if row is not None:
+            versions[(kind, elem_id)] = int(row[0])
+    return versions
+
+
+# Applies an .osc file to a database written by SqliteSink: the rows of
+# every changed element are deleted by id and re-inserted, in one
+# transaction.
+def apply_to_sqlite(osc_file, db_path, tables=gc.TABLE_NAMES):
+    changes = read_changes(osc_file)
+    sink = SqliteSink(db_path, create_tables=False, build_indexes=False, pragmas=CHANGE_PRAGMAS,
+                      transaction_size=float('inf'))
+    try:
+        applicable = _applicable(changes, _existing_sqlite_versions(sink.conn, changes, tables))
+        for (kind, elem_id), (_, _, shaped) in applicable.items():
+            for name in KIND_OUTPUTS[kind]:
+                sink.conn.execute('DELETE FROM {0} WHERE id = ?'.format(tables[name]), (elem_id,))
+            if shaped is not None:
+                sink.write(shaped)
+    except Exception:
+        sink.conn.execute('ROLLBACK')
+        sink.conn.close()
+        raise
+    sink.close()
+    return applicable
+
+
+APPLIERS = {'csv': apply_to_csv, 'sqlite': apply_to_sqlite}
@@ -0,0 +1,103 @@
+import json
+import os
+
+from main import global_constants as gc
+from main import parallel
+from main import pbf
+from main import runner
+from main.sinks import CsvSink, CsvTupleSink
+
+# Input bytes between checkpoints.
+CHECKPOINT_EVERY = 1 << 26
+
+
+# Writes the checkpoint to a temporary file first, so a crash while saving
+# leaves the previous one in place.
+def save(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _input_id(file_in):
+    return {'path': os.path.abspath(file_in), 'size': os.path.getsize(file_in),
+            'mtime': os.path.getmtime(file_in)}
+
+
+# Cuts every output back to its size at the checkpoint, dropping whatever
+# was written after it.
+def truncate_outputs(out, sizes):
+    for name, path in out.items():
+        if name not in sizes:
+            raise ValueError('checkpoint has no size for output {0!r}'.format(name))
+        if os.path.getsize(path) < sizes[name]:
+            raise ValueError('{0} is shorter than at the checkpoint'.format(path))
+        os.truncate(path, sizes[name])
+
+
+# (start, end) byte ranges of about every bytes from offset on, each
+# starting at an element (xml) or blob (pbf) boundary.
+def segments(file_in, parser, offset=0, every=CHECKPOINT_EVERY):
+    n_segments = max(1, os.path.getsize(file_in) // every)
+    if parser == 'pbf':
+        boundaries = pbf.find_shard_boundaries(file_in, n_segments)
+    else:
+        boundaries = parallel.find_shard_boundaries(file_in, n_segments)
+    if not boundaries:
+        return []
+    if offset <= boundaries[0][0]:
+        return boundaries
+    later = [(start, end) for start, end in boundaries if start >= offset]
+    end = later[0][0] if later else boundaries[-1][1]
+    return ([(offset, end)] if offset < end else []) + later
+
+
+def _checkpoint(sink, out, state, checkpoint_path):
+    sink.flush()
+    state['outputs'] = {name: os.path.getsize(path) for name, path in out.items()}
+    save(checkpoint_path, state)
+
+
+# Shapes file_in into the csv files of out segment by segment. After every
+# segment all outputs are flushed to disk and the checkpoint records the
+# input offset reached, the element count and every output's size, so the
+# outputs are always consistent with each other as of the checkpoint.
+# With resume, the outputs are cut back to the last checkpoint and shaping
+# continues from its offset; without one, it starts from scratch. stats and
+# tag_audit then only cover the resumed part.
+def process_map_checkpointed(file_in, out, checkpoint_path, resume=False, fields=gc.OUTPUT_FIELDS,
+                             every=CHECKPOINT_EVERY, stats=None, tag_audit=None, **shape_options):
+    # Options that change what is written; a resumed run must use the same.
+    options = {'rule_files': list(shape_options.get('rule_files', ())),
+               'tags': list(shape_options.get('tags', ()))}
+    state = load(checkpoint_path) if resume and os.path.exists(checkpoint_path) else None
+    if state is not None:
+        if state['input'] != _input_id(file_in):
+            raise ValueError('{0} was written for another input: {1}'.format(
+                checkpoint_path, state['input']['path']))
+        if state['options'] != options:
+            raise ValueError('{0} was written with other options: {1}'.format(
+                checkpoint_path, state['options']))
+        truncate_outputs(out, state['outputs'])
+    sink_class = CsvTupleSink if shape_options.get('rows') == 'tuple' else CsvSink
+    parser = shape_options.get('parser')
+    with sink_class(out, fields, append=state is not None) as sink:
+        if state is None:
+            state = {'input': _input_id(file_in), 'options': options, 'offset': 0,
+                     'elements': 0}
+            _checkpoint(sink, out, state, checkpoint_path)
+        for start, end in segments(file_in, parser, state['offset'], every):
+            with parallel.open_shard(file_in, start, end, parser) as reader:
+                state['elements'] += runner.shape_stream(reader, sink, stats=stats,
+                                                         tag_audit=tag_audit, **shape_options)
+            state['offset'] = end
+            _checkpoint(sink, out, state, checkpoint_path)
+    return state
@@ -0,0 +1,140 @@
+import operator
+import xml.parsers.expat
+
+from main import global_constants as gc
+from main import shaper_functions as sf
+
+READ_SIZE = 1 << 16
+
+
+# Builds expat start/end callbacks that shape nodes, ways and relations as
+# their tags go by, without building an ElementTree. Finished elements are
+# appended to shaped in the same form shape_element returns; relation
+# members go out sf.MEMBER_BATCH at a time ahead of their relation, like
+# sf.StreamingShaper. The handlers are closures over local state because
+# expat calls them once per tag, nd, member and element.
+def _make_handlers(shaped, tags, node_attr_fields, way_attr_fields, default_tag_type,
+                   relation_attr_fields=gc.RELATION_FIELDS, member_batch=sf.MEMBER_BATCH):
+    attr_fields = {name: fields for name, fields in
+                   (('node', node_attr_fields), ('way', way_attr_fields),
+                    ('relation', relation_attr_fields)) if name in tags}
+    shape_tag = sf.shape_tag
+    append_shaped = shaped.append
+    state = {'current': None}
+
+    def start(name, attrs):
+        current = state['current']
+        if current is None:
+            if name in attr_fields:
+                elem_id = attrs['id']
+                state.update(current=name, id=elem_id, tags=[], way_nodes=[],
+                             attribs={field: attrs[field] for field in attr_fields[name]})
+                if name == 'relation':
+                    state.update(members=[], position=0)
+        elif name == 'tag':
+            tmp_dict = shape_tag(state['id'], attrs['k'], attrs['v'], default_tag_type)
+            if tmp_dict:
+                state['tags'].append(tmp_dict)
+        elif name == 'nd':
+            way_nodes = state['way_nodes']
+            way_nodes.append({'id': state['id'], 'node_id': attrs['ref'],
+                              'position': len(way_nodes)})
+        elif name == 'member':
+            members = state['members']
+            members.append({'id': state['id'], 'member_id': attrs['ref'],
+                            'member_type': attrs['type'], 'role': attrs.get('role', ''),
+                            'position': state['position']})
+            state['position'] += 1
+            if len(members) >= member_batch:
+                append_shaped({'relation_members': members})
+                state['members'] = []
+
+    def end(name):
+        if name == state['current']:
+            if name == 'node':
+                append_shaped({'node': state['attribs'], 'node_tags': state['tags']})
+            elif name == 'way':
+                append_shaped({'way': state['attribs'], 'way_nodes': state['way_nodes'],
+                               'way_tags': state['tags']})
+            else:
+                append_shaped({'relation': state['attribs'], 'relation_members': state['members'],
+                               'relation_tags': state['tags']})
+            state['current'] = None
+
+    return start, end
+
+
+# Same as _make_handlers, but shaping into tuple rows like
+# sf.shape_element_tuples.
+def _make_tuple_handlers(shaped, tags, node_attr_fields, way_attr_fields, default_tag_type,
+                         relation_attr_fields=gc.RELATION_FIELDS, member_batch=sf.MEMBER_BATCH):
+    attr_getters = {name: operator.itemgetter(*fields) for name, fields in
+                    (('node', node_attr_fields), ('way', way_attr_fields),
+                     ('relation', relation_attr_fields)) if name in tags}
+    shape_tag_tuple = sf.shape_tag_tuple
+    append_shaped = shaped.append
+    state = {'current': None}
+
+    def start(name, attrs):
+        current = state['current']
+        if current is None:
+            if name in attr_getters:
+                state.update(current=name, id=attrs['id'], tags=[], way_nodes=[],
+                             attribs=attr_getters[name](attrs))
+                if name == 'relation':
+                    state.update(members=[], position=0)
+        elif name == 'tag':
+            row = shape_tag_tuple(state['id'], attrs['k'], attrs['v'], default_tag_type)
+            if row:
+                state['tags'].append(row)
+        elif name == 'nd':
+            way_nodes = state['way_nodes']
+            way_nodes.append((state['id'], attrs['ref'], len(way_nodes)))
+        elif name == 'member':
+            members = state['members']
+            members.append((state['id'], attrs['ref'], attrs['type'], attrs.get('role', ''),
+                            state['position']))
+            state['position'] += 1
+            if len(members) >= member_batch:
+                append_shaped({'relation_members': members})
+                state['members'] = []
+
+    def end(name):
+        if name == state['current']:
+            if name == 'node':
+                append_shaped({'node': state['attribs'], 'node_tags': state['tags']})
+            elif name == 'way':
+                append_shaped({'way': state['attribs'], 'way_nodes': state['way_nodes'],
+                               'way_tags': state['tags']})
+            else:
+                append_shaped({'relation': state['attribs'], 'relation_members': state['members'],
+                               'relation_tags': state['tags']})
+            state['current'] = None
+
+    return start, end
+
+
+# Drop-in alternative to get_element + shape_element: yields shaped
+# elements straight from expat callbacks. osm_file may be a path or a
+# binary file object. With tuples=True rows are tuples in field order.
+def iter_shaped(osm_file, tags=('node', 'way', 'relation'), node_attr_fields=gc.NODE_FIELDS,
+                way_attr_fields=gc.WAY_FIELDS, default_tag_type='regular', tuples=False):
+    shaped = []
+    parser = xml.parsers.expat.ParserCreate()
+    make_handlers = _make_tuple_handlers if tuples else _make_handlers
+    parser.StartElementHandler, parser.EndElementHandler = make_handlers(
+        shaped, tags, node_attr_fields, way_attr_fields, default_tag_type)
+
+    file_ = osm_file if hasattr(osm_file, 'read') else open(osm_file, 'rb')
+    try:
+        while True:
+            data = file_.read(READ_SIZE)
+            parser.Parse(data, not data)
+            for elem in shaped:
+                yield elem
+            del shaped[:]
+            if not data:
+                break
+    finally:
+        if file_ is not osm_file:
+            file_.close()
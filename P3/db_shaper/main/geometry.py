@@ -0,0 +1,158 @@
+import array
+import os
+
+import numpy as np
+
+IDS_FILE = 'node_ids.npy'
+COORDS_FILE = 'node_coords.npy'
+EARTH_RADIUS = 6371008.8
+WAY_BATCH = 10000
+
+
+# Collects node id -> (lat, lon) during the node pass in flat typed arrays
+# (8 bytes of id + 2 x 4 bytes of float32 per node).
+class NodeIndexBuilder(object):
+    def __init__(self):
+        self.ids = array.array('q')
+        self.coords = array.array('f')
+
+    def add(self, node):
+        self.ids.append(int(node['id']))
+        self.coords.append(float(node['lat']))
+        self.coords.append(float(node['lon']))
+
+    # Writes the index sorted by id to index_dir and returns it memory-mapped.
+    def save(self, index_dir):
+        ids = np.frombuffer(self.ids, dtype=np.int64)
+        coords = np.frombuffer(self.coords, dtype=np.float32).reshape(-1, 2)
+        if len(ids) and not np.all(ids[1:] > ids[:-1]):
+            order = np.argsort(ids, kind='stable')
+            ids, coords = ids[order], coords[order]
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, IDS_FILE), ids)
+        np.save(os.path.join(index_dir, COORDS_FILE), coords)
+        del ids, coords
+        self.ids = array.array('q')
+        self.coords = array.array('f')
+        return NodeIndex(index_dir)
+
+
+# Sorted node ids with their float32 (lat, lon), memory-mapped from the
+# files NodeIndexBuilder.save writes.
+class NodeIndex(object):
+    def __init__(self, index_dir, mmap_mode='r'):
+        self.ids = np.load(os.path.join(index_dir, IDS_FILE), mmap_mode=mmap_mode)
+        self.coords = np.load(os.path.join(index_dir, COORDS_FILE), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Returns float64 (lat, lon) for node_ids, NaN where a node is unknown.
+    def lookup(self, node_ids):
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        coords = np.full((len(node_ids), 2), np.nan)
+        if len(self.ids):
+            pos = np.minimum(np.searchsorted(self.ids, node_ids), len(self.ids) - 1)
+            found = self.ids[pos] == node_ids
+            coords[found] = self.coords[pos[found]]
+        return coords
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+# Computes one 'way_geometry' row per way in a single vectorized pass:
+# bounding box, length in metres along the resolved nodes, centroid (mean of
+# the resolved nodes) and how many node refs were not in the index. Ways
+# without any resolved node get no row.
+def way_geometry_rows(index, way_ids, node_refs):
+    counts = np.array([len(refs) for refs in node_refs], dtype=np.int64)
+    if not counts.sum():
+        return []
+    coords = index.lookup(np.fromiter((ref for refs in node_refs for ref in refs),
+                                      dtype=np.int64, count=counts.sum()))
+    lat, lon = coords[:, 0], coords[:, 1]
+    way_of = np.repeat(np.arange(len(counts)), counts)
+    known = ~np.isnan(lat)
+    found = np.bincount(way_of, weights=known, minlength=len(counts))
+
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    nonempty = counts > 0
+    bounds = {}
+    for name, ufunc, values in (('min_lat', np.fmin, lat), ('min_lon', np.fmin, lon),
+                                ('max_lat', np.fmax, lat), ('max_lon', np.fmax, lon)):
+        bounds[name] = np.full(len(counts), np.nan)
+        bounds[name][nonempty] = ufunc.reduceat(values, starts[nonempty])
+
+    # Segments between consecutive refs of the same way with both ends known.
+    segment = (way_of[1:] == way_of[:-1]) & known[1:] & known[:-1]
+    lengths = np.zeros(len(lat) - 1)
+    lengths[segment] = _haversine(lat[:-1][segment], lon[:-1][segment],
+                                  lat[1:][segment], lon[1:][segment])
+    length = np.bincount(way_of[1:], weights=lengths, minlength=len(counts))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centroid_lat = np.bincount(way_of, weights=np.where(known, lat, 0), minlength=len(counts)) / found
+        centroid_lon = np.bincount(way_of, weights=np.where(known, lon, 0), minlength=len(counts)) / found
+
+    rows = []
+    for n in np.flatnonzero(found):
+        rows.append({'id': way_ids[n],
+                     'min_lat': round(float(bounds['min_lat'][n]), 7),
+                     'min_lon': round(float(bounds['min_lon'][n]), 7),
+                     'max_lat': round(float(bounds['max_lat'][n]), 7),
+                     'max_lon': round(float(bounds['max_lon'][n]), 7),
+                     'length': round(float(length[n]), 2),
+                     'centroid_lat': round(float(centroid_lat[n]), 7),
+                     'centroid_lon': round(float(centroid_lon[n]), 7),
+                     'missing_nodes': int(counts[n] - found[n])})
+    return rows
+
+
+# Sink wrapper that builds the node index from the node rows going by and,
+# once the ways start, writes a 'way_geometry' row for every way to the
+# wrapped sink, WAY_BATCH ways at a time. Relies on the usual osm file
+# order of all nodes before all ways.
+class GeometrySink(object):
+    def __init__(self, sink, index_dir, way_batch=WAY_BATCH):
+        self.sink = sink
+        self.index_dir = index_dir
+        self.way_batch = way_batch
+        self.builder = NodeIndexBuilder()
+        self.index = None
+        self.way_ids = []
+        self.node_refs = []
+
+    def write(self, elem):
+        if 'node' in elem:
+            self.builder.add(elem['node'])
+        elif 'way' in elem:
+            if self.index is None:
+                self.index = self.builder.save(self.index_dir)
+            self.way_ids.append(elem['way']['id'])
+            self.node_refs.append([int(row['node_id']) for row in elem['way_nodes']])
+            if len(self.way_ids) >= self.way_batch:
+                self._flush()
+        self.sink.write(elem)
+
+    def _flush(self):
+        if self.way_ids:
+            self.sink.write({'way_geometry': way_geometry_rows(self.index, self.way_ids,
+                                                               self.node_refs)})
+        self.way_ids = []
+        self.node_refs = []
+
+    def close(self):
+        if self.index is None:
+            self.index = self.builder.save(self.index_dir)
+        self._flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
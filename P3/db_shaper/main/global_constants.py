@@ -1,23 +1,58 @@
-NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
-NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
-WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_NODES_FIELDS = ['id', 'node_id', 'position']
-
-CORRECTOR_MAPPING = {'Ave': 'Avenue',
-                     'Ave.': 'Avenue',
-                     'Broadwat': 'Broadway',
-                     'Broadway.': 'Broadway',
-                     'Bvld': 'Boulevard',
-                     'Bvld.': 'Boulevard',
-                     'Bvl.': 'Boulevard',
-                     'St.': 'Street',
-                     'St': 'Street',
-                     'N': 'North',
-                     'N.': 'North',
-                     'E': 'East',
-                     'E.': 'East',
-                     'S': 'South',
-                     'S.': 'South',
-                     'W': 'West',
-                     'W.': 'West'}
\ No newline at end of file
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'member_type', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_GEOMETRY_FIELDS = ['id', 'min_lat', 'min_lon', 'max_lat', 'max_lon', 'length',
+                       'centroid_lat', 'centroid_lon', 'missing_nodes']
+
+CORRECTOR_MAPPING = {'Ave': 'Avenue',
+                     'Ave.': 'Avenue',
+                     'Broadwat': 'Broadway',
+                     'Broadway.': 'Broadway',
+                     'Bvld': 'Boulevard',
+                     'Bvld.': 'Boulevard',
+                     'Bvl.': 'Boulevard',
+                     'St.': 'Street',
+                     'St': 'Street',
+                     'N': 'North',
+                     'N.': 'North',
+                     'E': 'East',
+                     'E.': 'East',
+                     'S': 'South',
+                     'S.': 'South',
+                     'W': 'West',
+                     'W.': 'West'}
+
+# Output name -> csv columns, in the order the output files are written.
+OUTPUT_FIELDS = {'node': NODE_FIELDS,
+                 'node_tags': NODE_TAGS_FIELDS,
+                 'way': WAY_FIELDS,
+                 'way_nodes': WAY_NODES_FIELDS,
+                 'way_tags': WAY_TAGS_FIELDS,
+                 'relation': RELATION_FIELDS,
+                 'relation_members': RELATION_MEMBERS_FIELDS,
+                 'relation_tags': RELATION_TAGS_FIELDS}
+# Outputs that are only written when asked for.
+EXTRA_OUTPUT_FIELDS = {'way_geometry': WAY_GEOMETRY_FIELDS}
+
+# Output name -> SQLite table, named after the csv files so the P3 queries
+# run unchanged against either.
+TABLE_NAMES = {'node': 'nodes',
+               'node_tags': 'nodes_tags',
+               'way': 'ways',
+               'way_nodes': 'ways_nodes',
+               'way_tags': 'ways_tags',
+               'relation': 'relations',
+               'relation_members': 'relations_members',
+               'relation_tags': 'relations_tags',
+               'way_geometry': 'ways_geometry'}
+PRIMARY_KEYS = {'node': 'id', 'way': 'id', 'relation': 'id', 'way_geometry': 'id'}
+TABLE_INDEXES = {'node_tags': ['id', 'key'],
+                 'way_nodes': ['id', 'node_id'],
+                 'way_tags': ['id', 'key'],
+                 'relation_members': ['id', 'member_id'],
+                 'relation_tags': ['id', 'key']}
@@ -1 +1 @@
-__all__ = ['functions', 'schema']
+__all__ = ['compiled_validator', 'functions', 'schema']
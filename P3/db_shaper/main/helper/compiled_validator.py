@@ -0,0 +1,242 @@
+from collections.abc import Mapping, Sequence
+from itertools import repeat
+from operator import eq, itemgetter, methodcaller
+
+from . import schema as s
+
+# Cerberus error codes; cerberus lists a field's messages in code order.
+NOT_NULLABLE = 0x22
+BAD_TYPE = 0x24
+COERCION_FAILED = 0x61
+
+# Same definitions as cerberus' built-in types.
+TYPES = {'integer': ((int,), ()),
+         'float': ((float, int), ()),
+         'string': ((str,), ()),
+         'dict': ((Mapping,), ()),
+         'list': ((Sequence,), (str,))}
+# Coercions whose result always has the declared type, so the type check
+# can be skipped on the fast path.
+EXACT_COERCIONS = {('integer', int), ('float', float)}
+
+
+class _FastPathMiss(Exception):
+    pass
+
+
+def _type_check(type_name):
+    included, excluded = TYPES[type_name]
+
+    def check(value):
+        return isinstance(value, included) and not isinstance(value, excluded)
+    return check
+
+
+def _sorted_messages(messages):
+    return [message for _, message in sorted(messages, key=itemgetter(0))]
+
+
+# Compiles one field's rules (required/type/coerce/nullable/schema) into
+# check(value) -> (normalized value, cerberus style error list or None).
+def _compile_rules(field, rules):
+    coerce = rules.get('coerce')
+    type_name = rules.get('type')
+    type_check = _type_check(type_name) if type_name else None
+    nullable = rules.get('nullable', False)
+    sub_check = None
+    if 'schema' in rules:
+        if type_name == 'dict':
+            sub_check = _compile_mapping(rules['schema'])
+        elif type_name == 'list':
+            sub_check = _compile_sequence(rules['schema'])
+
+    def check(value):
+        messages = []
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except Exception as e:
+                messages.append((COERCION_FAILED,
+                                 "field '{0}' cannot be coerced: {1}".format(field, e)))
+        if value is None:
+            if not nullable:
+                messages.append((NOT_NULLABLE, 'null value not allowed'))
+            return value, _sorted_messages(messages) or None
+        if type_check is not None and not type_check(value):
+            messages.append((BAD_TYPE, 'must be of {0} type'.format(type_name)))
+            return value, _sorted_messages(messages)
+        errors = _sorted_messages(messages)
+        if sub_check is not None:
+            value, sub_errors = sub_check(value)
+            if sub_errors:
+                errors.append(sub_errors)
+        return value, errors or None
+    return check
+
+
+def _compile_sequence(item_rules):
+    item_check = _compile_rules(None, item_rules)
+
+    def check(items):
+        normalized = []
+        errors = {}
+        for index, item in enumerate(items):
+            item, item_errors = item_check(item)
+            normalized.append(item)
+            if item_errors:
+                errors[index] = item_errors
+        return normalized, errors or None
+    return check
+
+
+# Returns (keys, coercions, type checks) for schemas made only of required,
+# non-nullable scalar fields, or None when the fast path does not apply.
+def _fast_path_plan(schema):
+    coercions = []
+    type_checks = []
+    for field, rules in schema.items():
+        type_name = rules.get('type')
+        if (not rules.get('required') or rules.get('nullable') or 'schema' in rules or
+                type_name not in ('integer', 'float', 'string')):
+            return None
+        if 'coerce' in rules:
+            coercions.append((field, rules['coerce']))
+        if (type_name, rules.get('coerce')) not in EXACT_COERCIONS:
+            type_checks.append((field, _type_check(type_name)))
+    return frozenset(schema), coercions, type_checks
+
+
+def _compile_fast_path(schema):
+    plan = _fast_path_plan(schema)
+    if plan is None:
+        return None
+    keys, coercions, type_checks = plan
+
+    def fast(doc):
+        if doc.keys() != keys:
+            raise _FastPathMiss
+        normalized = dict(doc)
+        for field, coerce in coercions:
+            normalized[field] = coerce(normalized[field])
+        for field, type_check in type_checks:
+            if not type_check(normalized[field]):
+                raise _FastPathMiss
+        return normalized
+    return fast
+
+
+# Compiles a mapping schema into check(doc) -> (normalized doc, errors or
+# None). Documents that pass go through a straight-line fast path; anything
+# else is re-checked rule by rule to build the same errors cerberus would.
+def _compile_mapping(schema):
+    field_checks = {field: _compile_rules(field, rules) for field, rules in schema.items()}
+    required = frozenset(field for field, rules in schema.items() if rules.get('required'))
+    fast = _compile_fast_path(schema)
+
+    def check(doc):
+        if fast is not None:
+            try:
+                return fast(doc), None
+            except Exception:
+                pass
+        normalized = {}
+        errors = {}
+        for field, value in doc.items():
+            if field in field_checks:
+                value, field_errors = field_checks[field](value)
+                if field_errors:
+                    errors[field] = field_errors
+            else:
+                errors[field] = ['unknown field']
+            normalized[field] = value
+        for field in required.difference(doc):
+            errors[field] = ['required field']
+        if errors:
+            return normalized, {field: errors[field] for field in sorted(errors)}
+        return normalized, None
+    return check
+
+
+# Column-wise check of many rows against one scalar mapping schema: every
+# coercion runs as a single map() over the column.
+def _compile_batch(schema):
+    plan = _fast_path_plan(schema)
+    if plan is None:
+        return None
+    keys, coercions, type_checks = plan
+
+    def batch(rows):
+        if not all(map(isinstance, rows, repeat(dict))):
+            return False
+        if not all(map(eq, map(methodcaller('keys'), rows), repeat(keys))):
+            return False
+        try:
+            for field, coerce in coercions:
+                for _ in map(coerce, map(itemgetter(field), rows)):
+                    pass
+        except Exception:
+            return False
+        for field, type_check in type_checks:
+            if not all(map(type_check, map(itemgetter(field), rows))):
+                return False
+        return True
+    return batch
+
+
+def _row_schema(rules):
+    if rules.get('type') == 'list':
+        rules = rules['schema']
+    return rules['schema']
+
+
+# Drop-in replacement for cerberus.Validator on the db_shaper schemas. The
+# schema is compiled once into plain Python checks; validate() sets
+# .errors and .document exactly like cerberus does.
+class CompiledValidator(object):
+    def __init__(self, schema=s.schema):
+        self.schema = schema
+        self._check = _compile_mapping(schema)
+        self._batches = {name: _compile_batch(_row_schema(rules)) for name, rules in schema.items()}
+        self.errors = {}
+        self.document = None
+
+    def validate(self, document, schema=None):
+        if schema is not None and schema is not self.schema:
+            self.__init__(schema)
+        self.document, errors = self._check(document)
+        self.errors = errors or {}
+        return errors is None
+
+    # Validates many rows of one output (e.g. 'node_tags') at once. Returns
+    # True if they all pass; otherwise sets .errors as for {name: rows}.
+    def validate_rows(self, name, rows):
+        batch = self._batches.get(name)
+        if batch is not None and batch(rows):
+            self.errors = {}
+            return True
+        if self.schema[name]['type'] == 'list':
+            return self.validate({name: rows})
+        for row in rows:
+            if not self.validate({name: row}):
+                return False
+        return True
+
+    # Validates many shaped elements at once, output by output. Returns True
+    # if they all pass; the caller re-checks one by one to report errors.
+    def validate_batch(self, documents):
+        rows = {}
+        for document in documents:
+            for name, value in document.items():
+                if self._batches.get(name) is None:
+                    return False
+                if self.schema[name]['type'] == 'dict' and isinstance(value, dict):
+                    rows.setdefault(name, []).append(value)
+                elif self.schema[name]['type'] == 'list' and isinstance(value, list):
+                    rows.setdefault(name, []).extend(value)
+                else:
+                    return False
+        for name, name_rows in rows.items():
+            if not self._batches[name](name_rows):
+                return False
+        self.errors = {}
+        return True
@@ -1,32 +1,86 @@
-import csv
-import pprint
-import xml.etree.cElementTree as ET
-
-from . import schema as s
-
-
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
-
-
-def validate_element(element, validator, schema=s.schema):
-    if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
-        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
-        error_string = pprint.pformat(errors)
-
-        raise Exception(message_string.format(field, error_string))
-
-
-class UnicodeDictWriter(csv.DictWriter, object):
-    def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({k: str(v) for k, v in row.items()})
-
-    def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+import csv
+import pprint
+import xml.etree.cElementTree as ET
+
+from main import inputs
+from . import schema as s
+
+# Elements directly under <osm>; the ones not asked for are dropped as
+# they end instead of piling up under the root.
+TOP_LEVEL = ('node', 'way', 'relation')
+
+
+# osm_file may be a path (plain, .bz2 or .gz) or a binary file object.
+def get_element(osm_file, tags=('node', 'way', 'relation')):
+    file_ = osm_file if hasattr(osm_file, 'read') else inputs.open_osm(osm_file)
+    try:
+        context = ET.iterparse(file_, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end':
+                if elem.tag in tags:
+                    yield elem
+                    root.clear()
+                elif elem.tag in TOP_LEVEL:
+                    root.clear()
+    finally:
+        if file_ is not osm_file:
+            file_.close()
+
+
+# Same as get_element, but every <member> of a wanted relation is also
+# yielded, as (member, relation), as soon as it ends, and then dropped from
+# the tree; the relation itself follows as (relation, None) without them.
+# Huge relations (multipolygons with thousands of members) thus never
+# build up in memory. Other elements come as (element, None).
+def get_element_members(osm_file, tags=('node', 'way', 'relation')):
+    file_ = osm_file if hasattr(osm_file, 'read') else inputs.open_osm(osm_file)
+    stream_members = 'relation' in tags
+    try:
+        context = ET.iterparse(file_, events=('start', 'end'))
+        _, root = next(context)
+        relation = None
+        for event, elem in context:
+            if event == 'start':
+                if elem.tag == 'relation' and stream_members:
+                    relation = elem
+            elif elem.tag == 'member' and relation is not None:
+                yield elem, relation
+                relation.remove(elem)
+            elif elem.tag in tags:
+                relation = None
+                yield elem, None
+                root.clear()
+            elif elem.tag in TOP_LEVEL:
+                root.clear()
+    finally:
+        if file_ is not osm_file:
+            file_.close()
+
+
+def validate_element(element, validator, schema=s.schema):
+    if validator.validate(element, schema) is not True:
+        field, errors = next(iter(validator.errors.items()))
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_string = pprint.pformat(errors)
+
+        raise Exception(message_string.format(field, error_string))
+
+
+# Validates a batch of shaped elements. Validators with a batch fast path
+# check them all at once; on failure, or without one, the elements are
+# validated one by one so the first bad element is reported as usual.
+def validate_elements(elements, validator, schema=s.schema):
+    if hasattr(validator, 'validate_batch') and validator.validate_batch(elements):
+        return
+    for element in elements:
+        validate_element(element, validator, schema)
+
+
+class UnicodeDictWriter(csv.DictWriter, object):
+    def writerow(self, row):
+        super(UnicodeDictWriter, self).writerow({k: str(v) for k, v in row.items()})
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
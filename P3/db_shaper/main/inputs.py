@@ -0,0 +1,248 @@
+import bz2
+import collections
+import functools
+import gzip
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import zlib
+
+# Every stream of a multi-stream file (pbzip2/lbzip2 .bz2, concatenated
+# gzip members) starts with these bytes, on a byte boundary.
+STREAM_START_RES = {'.bz2': re.compile(br'BZh[1-9]1AY&SY'),
+                    '.gz': re.compile(b'\x1f\x8b\x08')}
+# Unlike bz2/gzip.decompress, these make it possible to reject trailing
+# garbage instead of silently dropping it.
+DECOMPRESSORS = {'.bz2': bz2.BZ2Decompressor,
+                 '.gz': functools.partial(zlib.decompressobj, 16 + zlib.MAX_WBITS)}
+OPENERS = {'.bz2': bz2.open, '.gz': gzip.open}
+DECOMPRESSION_ERRORS = (EOFError, OSError, ValueError, zlib.error)
+PBF_SUFFIX = '.pbf'
+# Compressed bytes per decompression task; whole streams are grouped up to
+# this size.
+CHUNK_SIZE = 1 << 22
+# Files with a stream bigger than this are decompressed as a single stream,
+# so no worker has to hold a huge stream in memory.
+MAX_STREAM_SIZE = 1 << 26
+SCAN_SIZE = 1 << 20
+READ_SIZE = 1 << 20
+TASKS_PER_WORKER = 2
+READ_AHEAD = 8
+
+
+def compression(path):
+    ext = os.path.splitext(path)[1].lower()
+    return ext if ext in OPENERS else None
+
+
+def is_pbf(path):
+    return path.lower().endswith(PBF_SUFFIX)
+
+
+def _stream_starts(path, pattern):
+    starts = []
+    with open(path, 'rb') as f:
+        offset, carry = 0, b''
+        while True:
+            data = f.read(SCAN_SIZE)
+            if not data:
+                break
+            chunk = carry + data
+            base = offset - len(carry)
+            for match in pattern.finditer(chunk):
+                if not starts or base + match.start() > starts[-1]:
+                    starts.append(base + match.start())
+            offset += len(data)
+            carry = chunk[-16:]
+    return starts
+
+
+# Groups the streams of a multi-stream file into (start, end) ranges of
+# about CHUNK_SIZE compressed bytes. Returns None for single-stream files.
+def find_chunks(path, ext, chunk_size=CHUNK_SIZE):
+    size = os.path.getsize(path)
+    starts = _stream_starts(path, STREAM_START_RES[ext])
+    if len(starts) < 2 or starts[0] != 0:
+        return None
+    ends = starts[1:] + [size]
+    if max(end - start for start, end in zip(starts, ends)) > MAX_STREAM_SIZE:
+        return None
+    chunks = []
+    chunk_start = 0
+    for end in ends:
+        if end - chunk_start >= chunk_size or end == size:
+            chunks.append((chunk_start, end))
+            chunk_start = end
+    return chunks
+
+
+def _decompress_streams(data, ext):
+    parts = []
+    while data:
+        decompressor = DECOMPRESSORS[ext]()
+        parts.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise EOFError('stream ended early')
+        data = decompressor.unused_data
+    return b''.join(parts)
+
+
+# Returns the decompressed bytes of path[start:end], or None if the range
+# does not hold whole streams (a stream start pattern inside compressed data).
+def _decompress_range(args):
+    path, ext, start, end = args
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    try:
+        return _decompress_streams(data, ext)
+    except DECOMPRESSION_ERRORS:
+        return None
+
+
+# Binary file object over a multi-stream file whose chunks are decompressed
+# by a pool of workers, at most TASKS_PER_WORKER chunks per worker ahead of
+# the reader. A chunk that fails (because one of its boundaries was a false
+# stream start) is decompressed again here, joined with its neighbours.
+class ParallelDecompressor(object):
+    def __init__(self, path, ext, chunks, workers):
+        self.path = path
+        self.ext = ext
+        self.size = os.path.getsize(path)
+        self.todo = collections.deque(chunks)
+        self.running = collections.deque()
+        self.pending_start = None
+        self.ready = collections.deque()
+        self.pool = multiprocessing.Pool(workers)
+        for _ in range(workers * TASKS_PER_WORKER):
+            self._submit()
+        self.buffer = b''
+        self.pos = 0
+
+    def _submit(self):
+        if self.todo:
+            start, end = self.todo.popleft()
+            self.running.append((start, self.pool.apply_async(
+                _decompress_range, ((self.path, self.ext, start, end),))))
+
+    def _join_pending(self, end):
+        data = _decompress_range((self.path, self.ext, self.pending_start, end))
+        if data is None:
+            raise EOFError('{0}: corrupt compressed data at byte {1}'.format(
+                self.path, self.pending_start))
+        self.pending_start = None
+        self.ready.append(data)
+
+    def _next_chunk(self):
+        while not self.ready:
+            if not self.running:
+                if self.pending_start is None:
+                    return b''
+                self._join_pending(self.size)
+                break
+            start, result = self.running.popleft()
+            data = result.get()
+            self._submit()
+            if data is None:
+                if self.pending_start is None:
+                    self.pending_start = start
+                continue
+            if self.pending_start is not None:
+                self._join_pending(start)
+            self.ready.append(data)
+        return self.ready.popleft()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = READ_SIZE
+        while self.pos >= len(self.buffer):
+            self.buffer, self.pos = self._next_chunk(), 0
+            if not self.buffer:
+                return b''
+        ret = self.buffer[self.pos:self.pos + size]
+        self.pos += len(ret)
+        return ret
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Binary file object that reads file_ in a background thread, READ_AHEAD
+# blocks ahead. bz2 and zlib release the GIL, so a single-stream file is
+# decompressed while the parser works on the previous block.
+class ReadAheadReader(object):
+    def __init__(self, file_, read_size=READ_SIZE):
+        self.file = file_
+        self.read_size = read_size
+        self.blocks = queue.Queue(READ_AHEAD)
+        self.closed = False
+        self.eof = False
+        self.buffer = b''
+        self.pos = 0
+        self.thread = threading.Thread(target=self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self):
+        try:
+            while not self.closed:
+                data = self.file.read(self.read_size)
+                self.blocks.put(data)
+                if not data:
+                    break
+        except Exception as e:
+            self.blocks.put(e)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.read_size
+        while self.pos >= len(self.buffer):
+            if self.eof:
+                return b''
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            self.buffer, self.pos = block, 0
+            self.eof = not block
+        ret = self.buffer[self.pos:self.pos + size]
+        self.pos += len(ret)
+        return ret
+
+    def close(self):
+        self.closed = True
+        while self.thread.is_alive():
+            try:
+                self.blocks.get_nowait()
+            except queue.Empty:
+                self.thread.join(0.01)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Opens an osm input for reading as a binary file object. .bz2 and .gz
+# files are decompressed on the fly: multi-stream files by a pool of
+# workers, single-stream ones in a read-ahead thread when workers > 1.
+def open_osm(path, workers=1):
+    ext = compression(path)
+    if ext is None:
+        return open(path, 'rb')
+    if workers > 1:
+        chunks = find_chunks(path, ext)
+        if chunks is not None and len(chunks) > 1:
+            return ParallelDecompressor(path, ext, chunks, workers)
+        return ReadAheadReader(OPENERS[ext](path, 'rb'))
+    return OPENERS[ext](path, 'rb')
@@ -0,0 +1,147 @@
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then reported as None.
+    resource = None
+
+PROGRESS_EVERY = 100000
+# 'parse_shape' is used by the backends that shape inside the parser
+# callbacks (expat, pbf), where the two cannot be timed apart.
+STAGES = ('parse', 'shape', 'parse_shape', 'validate', 'write', 'merge')
+COUNTERS = ('node', 'way', 'relation', 'tags', 'nds', 'members')
+PROFILE_ENV = 'DB_SHAPER_PROFILE'
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss(who='self'):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else
+                               resource.RUSAGE_CHILDREN)
+    return usage.ru_maxrss * RSS_UNIT
+
+
+# Per-stage cumulative timers and element/tag/nd counters for one run.
+# Prints a progress line every progress_every elements (0 turns it off).
+class Stats(object):
+    def __init__(self, progress_every=PROGRESS_EVERY, stream=sys.stderr):
+        self.timers = dict.fromkeys(STAGES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.elements = 0
+        self.output_bytes = {}
+        self.progress_every = progress_every
+        self.stream = stream
+        self.start = time.perf_counter()
+
+    # Yields from iterable, adding the time spent in each next() to stage.
+    def timed(self, stage, iterable):
+        iterator = iter(iterable)
+        timers = self.timers
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                timers[stage] += clock() - start
+                return
+            timers[stage] += clock() - start
+            yield item
+
+    # Batches of relation members written ahead of their relation (see
+    # sf.StreamingShaper) are counted, but not as elements.
+    def count(self, elem):
+        counters = self.counters
+        element = False
+        for name, rows in elem.items():
+            if name in ('node', 'way', 'relation'):
+                counters[name] += 1
+                element = True
+            elif name in ('node_tags', 'way_tags', 'relation_tags'):
+                counters['tags'] += len(rows)
+            elif name == 'way_nodes':
+                counters['nds'] += len(rows)
+            elif name == 'relation_members':
+                counters['members'] += len(rows)
+        if element:
+            self.elements += 1
+            if self.progress_every and not self.elements % self.progress_every:
+                self.progress()
+
+    def progress(self, label=None):
+        elapsed = time.perf_counter() - self.start
+        rss = peak_rss()
+        self.stream.write('{0}{1} elements in {2:.1f}s ({3:.0f}/s){4}\n'.format(
+            label + ': ' if label else '', self.elements, elapsed,
+            self.elements / elapsed if elapsed else 0,
+            ', peak rss {0:.0f} MB'.format(rss / 1e6) if rss is not None else ''))
+        self.stream.flush()
+
+    # Adds the timers and counters of another run, e.g. a parallel shard.
+    def merge(self, summary):
+        for stage, seconds in summary['timers'].items():
+            self.timers[stage] += seconds
+        for name, value in summary['counters'].items():
+            self.counters[name] += value
+        self.elements += summary['elements']
+
+    # out is the csv path dict or the database path of the run.
+    def record_outputs(self, out):
+        paths = out if isinstance(out, dict) else {'sqlite': out}
+        self.output_bytes = {name: os.path.getsize(path) for name, path in paths.items()
+                             if os.path.exists(path)}
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        return {'elapsed': elapsed,
+                'elements': self.elements,
+                'elements_per_sec': self.elements / elapsed if elapsed else 0,
+                'timers': self.timers,
+                'counters': self.counters,
+                'peak_rss_bytes': peak_rss(),
+                'peak_rss_children_bytes': peak_rss('children'),
+                'output_bytes': self.output_bytes}
+
+    def write_summary(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+
+# Sink wrapper that times the wrapped sink's writes and counts what goes
+# through it.
+class InstrumentedSink(object):
+    def __init__(self, sink, stats):
+        self.sink = sink
+        self.stats = stats
+
+    def write(self, elem):
+        start = time.perf_counter()
+        self.sink.write(elem)
+        self.stats.timers['write'] += time.perf_counter() - start
+        self.stats.count(elem)
+
+
+# Runs the block under cProfile and dumps the stats to path; does nothing
+# when path is empty. Falls back to the DB_SHAPER_PROFILE environment
+# variable, so a run can be profiled without changing any code.
+@contextlib.contextmanager
+def profiled(path=None):
+    path = path or os.environ.get(PROFILE_ENV)
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,62 @@
+import functools
+import json
+import re
+
+from main import global_constants as gc
+
+CACHE_SIZE = 1 << 16
+
+
+# Loads an extra rule set: a json object mapping token -> replacement.
+def load_rules(path):
+    with open(path, encoding='utf8') as f:
+        return json.load(f)
+
+
+# Replaces every space-separated token of a tag value that is a key of the
+# rule mappings, like the original split/lookup/join _corrector. Results
+# go through a bounded LRU cache first, since the same values repeat across
+# the whole file. On a miss, all rules are tried at once as one compiled
+# regex, and values without a correctable token are returned untouched.
+class TagNormalizer(object):
+    def __init__(self, mapping=gc.CORRECTOR_MAPPING, extra_rules=(), cache_size=CACHE_SIZE):
+        self.mapping = dict(mapping)
+        for rules in extra_rules:
+            self.mapping.update(rules)
+        for token in self.mapping:
+            if not token or ' ' in token:
+                raise ValueError('rule keys must be single tokens: {0!r}'.format(token))
+        # A token is delimited by single spaces or the ends of the value.
+        tokens = sorted(self.mapping, key=len, reverse=True)
+        self.matcher = re.compile(r'(?<![^ ])(?:{0})(?![^ ])'.format(
+            '|'.join(re.escape(token) for token in tokens)) if tokens else r'(?!)')
+        self.skipped = 0
+        self.corrected = 0
+        # Bound directly on the instance to save a call per value.
+        self.normalize = functools.lru_cache(maxsize=cache_size)(self._normalize_uncached)
+        self.fired = functools.lru_cache(maxsize=cache_size)(self._fired_uncached)
+
+    @classmethod
+    def from_files(cls, rule_paths, mapping=gc.CORRECTOR_MAPPING, cache_size=CACHE_SIZE):
+        return cls(mapping, [load_rules(path) for path in rule_paths], cache_size)
+
+    def _replace(self, match):
+        return self.mapping[match.group()]
+
+    def _normalize_uncached(self, value):
+        if self.matcher.search(value) is None:
+            self.skipped += 1
+            return value
+        self.corrected += 1
+        return self.matcher.sub(self._replace, value)
+
+    # The rule tokens that correct value, once per occurrence (see
+    # audit.TagAudit).
+    def _fired_uncached(self, value):
+        return tuple(self.matcher.findall(value))
+
+    # hits/misses are cache lookups; skipped/corrected split the misses.
+    def stats(self):
+        info = self.normalize.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'cached': info.currsize,
+                'skipped': self.skipped, 'corrected': self.corrected}
@@ -0,0 +1,194 @@
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from main import audit
+from main import instrument
+from main import pbf
+from main import runner
+from main.sinks import CsvSink, CsvTupleSink, SqliteSink
+
+# Nodes, ways and relations never nest, and '<' is always escaped inside
+# attribute values, so any match is the start of a top-level element.
+ELEMENT_START_RE = re.compile(br'<(?:node|way|relation)[\s/>]')
+OSM_END = b'</osm>'
+SHARD_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<osm>\n'
+SHARD_FOOTER = b'\n</osm>\n'
+SCAN_SIZE = 1 << 16
+READ_SIZE = 1 << 20
+SHARDS_PER_WORKER = 4
+
+
+# Returns the offset of the first element starting at or after offset,
+# or limit if there is none before it.
+def _next_element_start(f, offset, limit):
+    f.seek(offset)
+    carry = b''
+    while offset < limit:
+        chunk = carry + f.read(min(SCAN_SIZE, limit - offset))
+        if len(chunk) == len(carry):
+            break
+        match = ELEMENT_START_RE.search(chunk)
+        if match:
+            return offset - len(carry) + match.start()
+        offset += len(chunk) - len(carry)
+        carry = chunk[-16:]
+    return limit
+
+
+def _body_end(f, size):
+    f.seek(max(0, size - SCAN_SIZE))
+    tail = f.read()
+    index = tail.rfind(OSM_END)
+    if index == -1:
+        return size
+    return size - len(tail) + index
+
+
+# Splits osm_file into at most n_shards (start, end) byte ranges, each
+# beginning at an element boundary.
+def find_shard_boundaries(osm_file, n_shards):
+    size = os.path.getsize(osm_file)
+    with open(osm_file, 'rb') as f:
+        body_end = _body_end(f, size)
+        body_start = _next_element_start(f, 0, body_end)
+        starts = [body_start]
+        step = max(1, (body_end - body_start) // n_shards)
+        for n in range(1, n_shards):
+            start = _next_element_start(f, max(body_start + n * step, starts[-1] + 1), body_end)
+            if start >= body_end:
+                break
+            starts.append(start)
+    return list(zip(starts, starts[1:] + [body_end]))
+
+
+# Minimal binary file object exposing osm_file[start:end] as a standalone
+# osm document, so the shard can be handed to the regular parser.
+class ShardReader(object):
+    def __init__(self, osm_file, start, end, header=SHARD_HEADER, footer=SHARD_FOOTER):
+        self.file = open(osm_file, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+        self.header = header
+        self.footer = footer
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = READ_SIZE
+        if self.header:
+            ret, self.header = self.header, b''
+            return ret
+        if self.remaining > 0:
+            ret = self.file.read(min(size, self.remaining))
+            self.remaining -= len(ret)
+            if ret:
+                return ret
+            self.remaining = 0
+        ret, self.footer = self.footer, b''
+        return ret
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _shard_target(sink, tmp_dir, index, out):
+    if sink == 'csv':
+        return {name: os.path.join(tmp_dir, '{0:05d}.{1}.csv'.format(index, name))
+                for name in out}
+    return os.path.join(tmp_dir, '{0:05d}.db'.format(index))
+
+
+# Shards are written without csv headers or SQLite indexes; those are
+# added once, when the shards are merged.
+def _open_shard_sink(sink, target, rows):
+    if sink == 'csv':
+        return (CsvTupleSink if rows == 'tuple' else CsvSink)(target, write_header=False)
+    return SqliteSink(target, build_indexes=False)
+
+
+# Opens osm_file[start:end] for the parser. PBF shards are whole blobs,
+# which need no framing.
+def open_shard(osm_file, start, end, parser):
+    if parser == 'pbf':
+        return ShardReader(osm_file, start, end, header=b'', footer=b'')
+    return ShardReader(osm_file, start, end)
+
+
+# Returns the shard's output and, when instrumented / audited, its stats
+# summary and tag audit.
+def _shape_shard(args):
+    osm_file, start, end, sink, target, shape_options, instrumented, audited = args
+    stats = instrument.Stats(progress_every=0) if instrumented else None
+    tag_audit = audit.TagAudit() if audited else None
+    with open_shard(osm_file, start, end, shape_options.get('parser')) as reader, \
+            _open_shard_sink(sink, target, shape_options.get('rows')) as sink_:
+        runner.shape_stream(reader, sink_, stats=stats, tag_audit=tag_audit, **shape_options)
+    return target, stats.summary() if stats is not None else None, tag_audit
+
+
+# Concatenates the shard files in shard order behind a single header, which
+# reproduces the serial output byte for byte.
+def _merge_shards(out_paths, shard_paths):
+    CsvSink(out_paths).close()
+    for name, path in out_paths.items():
+        with open(path, 'ab') as out_file:
+            for paths in shard_paths:
+                with open(paths[name], 'rb') as shard_file:
+                    shutil.copyfileobj(shard_file, out_file, READ_SIZE)
+
+
+def _merge_sqlite(db_path, shard_paths):
+    with SqliteSink(db_path) as sink:
+        for path in shard_paths:
+            sink.load_from(path)
+
+
+# out is the csv path dict for sink 'csv' and the database path for 'sqlite'.
+# shape_options are passed on to runner.shape_stream in every worker. With
+# an instrument.Stats, the workers' stats are merged into it shard by shard,
+# and likewise their tag audits into an audit.TagAudit.
+def process_map_parallel(file_in, sink, out, workers, n_shards=None, stats=None,
+                         tag_audit=None, **shape_options):
+    n_shards = n_shards or workers * SHARDS_PER_WORKER
+    if shape_options.get('parser') == 'pbf':
+        boundaries = pbf.find_shard_boundaries(file_in, n_shards)
+    else:
+        boundaries = find_shard_boundaries(file_in, n_shards)
+    out_dir = os.path.dirname(os.path.abspath(out['node'] if sink == 'csv' else out))
+    tmp_dir = tempfile.mkdtemp(dir=out_dir)
+    try:
+        tasks = [(file_in, start, end, sink, _shard_target(sink, tmp_dir, n, out), shape_options,
+                  stats is not None, tag_audit is not None)
+                 for n, (start, end) in enumerate(boundaries)]
+        pool = multiprocessing.Pool(workers)
+        try:
+            shard_targets = []
+            for n, (target, summary, shard_audit) in enumerate(pool.imap(_shape_shard, tasks)):
+                shard_targets.append(target)
+                if tag_audit is not None:
+                    tag_audit.merge(shard_audit)
+                if stats is not None:
+                    stats.merge(summary)
+                    if stats.progress_every:
+                        stats.progress('shard {0}/{1}'.format(n + 1, len(tasks)))
+        finally:
+            pool.close()
+            pool.join()
+        start = time.perf_counter()
+        if sink == 'csv':
+            _merge_shards(out, shard_targets)
+        else:
+            _merge_sqlite(out, shard_targets)
+        if stats is not None:
+            stats.timers['merge'] += time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,393 @@
+import itertools
+import os
+import struct
+import time
+import zlib
+
+from main import global_constants as gc
+from main import shaper_functions as sf
+
+BLOB_HEADER_SIZE = struct.Struct('>I')
+MAX_BLOB_HEADER_SIZE = 64 * 1024
+MAX_BLOB_SIZE = 32 * 1024 * 1024
+REQUIRED_FEATURES = {'OsmSchema-V0.6', 'DenseNodes'}
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+INT64 = 1 << 64
+# Relation.MemberType values.
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+
+def _varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+# Yields (field number, value) for every field of a message; value is an
+# int for varints and bytes for length-delimited fields.
+def _fields(buf):
+    pos, end = 0, len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            size, pos = _varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError('unsupported protobuf wire type {0}'.format(wire_type))
+        yield key >> 3, value
+
+
+def _packed(buf):
+    values = []
+    append = values.append
+    pos, end = 0, len(buf)
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        if byte < 0x80:
+            append(byte)
+            continue
+        result, shift = byte & 0x7f, 7
+        while True:
+            byte = buf[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        append(result)
+    return values
+
+
+def _signed(value):
+    return value - INT64 if value >= INT64 >> 1 else value
+
+
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _packed_sint(buf):
+    return [(value >> 1) ^ -(value & 1) for value in _packed(buf)]
+
+
+def _delta(buf):
+    return list(itertools.accumulate(_packed_sint(buf)))
+
+
+# Reads the next (blob type, blob, raw bytes of the whole blob) from a
+# binary file object, or returns None at the end of the file.
+def _read_raw_blob(file_):
+    size = file_.read(BLOB_HEADER_SIZE.size)
+    if not size:
+        return None
+    header_size, = BLOB_HEADER_SIZE.unpack(size)
+    if header_size > MAX_BLOB_HEADER_SIZE:
+        raise ValueError('pbf blob header too large: {0}'.format(header_size))
+    header = file_.read(header_size)
+    blob_type, data_size = _blob_header(header)
+    if data_size > MAX_BLOB_SIZE:
+        raise ValueError('pbf blob too large: {0}'.format(data_size))
+    data = file_.read(data_size)
+    return blob_type, data, size + header + data
+
+
+# Reads the next (blob type, blob) pair, or returns None at the end.
+def _read_blob(file_):
+    blob = _read_raw_blob(file_)
+    return blob[:2] if blob is not None else None
+
+
+# Yields the raw bytes of every OSMData blob, to be shaped elsewhere (by
+# iter_shaped over them); the OSMHeader block is checked here.
+def iter_raw_blobs(file_):
+    while True:
+        blob = _read_raw_blob(file_)
+        if blob is None:
+            return
+        blob_type, data, raw = blob
+        if blob_type == 'OSMHeader':
+            _check_header(_blob_data(data))
+        elif blob_type == 'OSMData':
+            yield raw
+
+
+def _blob_header(buf):
+    blob_type, data_size = None, 0
+    for number, value in _fields(buf):
+        if number == 1:
+            blob_type = value.decode('utf8')
+        elif number == 3:
+            data_size = value
+    return blob_type, data_size
+
+
+def _blob_data(blob):
+    for number, value in _fields(blob):
+        if number == 1:
+            return value
+        if number == 3:
+            return zlib.decompress(value)
+        if number in (4, 5, 6, 7):
+            raise ValueError('unsupported pbf blob compression (field {0})'.format(number))
+    return b''
+
+
+def _check_header(block):
+    for number, value in _fields(block):
+        if number == 4:
+            feature = value.decode('utf8')
+            if feature not in REQUIRED_FEATURES:
+                raise ValueError('unsupported pbf feature: {0}'.format(feature))
+
+
+# Returns [(start, end)] byte ranges of the file's OSMData blobs, grouped
+# into at most n_shards ranges of whole blobs. Only the blob headers are
+# read, apart from the OSMHeader block.
+def find_shard_boundaries(pbf_file, n_shards):
+    blobs = []
+    size = os.path.getsize(pbf_file)
+    with open(pbf_file, 'rb') as f:
+        offset = 0
+        while offset < size:
+            header_size, = BLOB_HEADER_SIZE.unpack(f.read(BLOB_HEADER_SIZE.size))
+            blob_type, data_size = _blob_header(f.read(header_size))
+            end = offset + BLOB_HEADER_SIZE.size + header_size + data_size
+            if blob_type == 'OSMData':
+                blobs.append((offset, end))
+            elif blob_type == 'OSMHeader':
+                _check_header(_blob_data(f.read(data_size)))
+            offset = end
+            f.seek(offset)
+    if not blobs:
+        return []
+    step = max(1, -(-len(blobs) // n_shards))
+    return [(blobs[n][0], blobs[min(n + step, len(blobs)) - 1][1])
+            for n in range(0, len(blobs), step)]
+
+
+class _Block(object):
+    def __init__(self, buf):
+        self.strings = []
+        self.groups = []
+        self.granularity = 100
+        self.date_granularity = 1000
+        self.lat_offset = self.lon_offset = 0
+        for number, value in _fields(buf):
+            if number == 1:
+                self.strings = [s.decode('utf8') for n, s in _fields(value) if n == 1]
+            elif number == 2:
+                self.groups.append(value)
+            elif number == 17:
+                self.granularity = value
+            elif number == 18:
+                self.date_granularity = value
+            elif number == 19:
+                self.lat_offset = _signed(value)
+            elif number == 20:
+                self.lon_offset = _signed(value)
+
+    # Formats a coordinate the way the osm xml does: 7 decimals, trailing
+    # zeros dropped.
+    def coordinate(self, offset, value):
+        text = '{0:.7f}'.format((offset + self.granularity * value) / 1e9)
+        return text.rstrip('0').rstrip('.')
+
+    def timestamp(self, value):
+        return time.strftime(TIMESTAMP_FORMAT,
+                             time.gmtime(value * self.date_granularity // 1000))
+
+
+def _info(block, buf):
+    info = {'version': 0, 'timestamp': 0, 'changeset': 0, 'uid': 0, 'user_sid': 0}
+    for number, value in _fields(buf):
+        if number == 1:
+            info['version'] = value
+        elif number == 2:
+            info['timestamp'] = _signed(value)
+        elif number == 3:
+            info['changeset'] = _signed(value)
+        elif number == 4:
+            info['uid'] = _signed(value)
+        elif number == 5:
+            info['user_sid'] = value
+    return {'version': str(info['version']), 'timestamp': block.timestamp(info['timestamp']),
+            'changeset': str(info['changeset']), 'uid': str(info['uid']),
+            'user': block.strings[info['user_sid']]}
+
+
+def _dense_info(block, buf, count):
+    columns = {}
+    for number, value in _fields(buf):
+        if number == 1:
+            columns['version'] = _packed(value)
+        elif number in (2, 3, 4, 5):
+            columns[number] = _delta(value)
+    missing = [0] * count
+    strings = block.strings
+    return [{'version': str(version), 'timestamp': block.timestamp(timestamp),
+             'changeset': str(changeset), 'uid': str(uid), 'user': strings[user_sid]}
+            for version, timestamp, changeset, uid, user_sid in zip(
+                columns.get('version', missing), columns.get(2, missing),
+                columns.get(3, missing), columns.get(4, missing), columns.get(5, missing))]
+
+
+def _shape_tags(block, elem_id, keys, vals, default_tag_type):
+    tags = []
+    strings = block.strings
+    for key, val in zip(keys, vals):
+        tmp_dict = sf.shape_tag(elem_id, strings[key], strings[val], default_tag_type)
+        if tmp_dict:
+            tags.append(tmp_dict)
+    return tags
+
+
+def _shape_dense(block, buf, fields, default_tag_type):
+    ids = lats = lons = keys_vals = ()
+    info_buf = None
+    for number, value in _fields(buf):
+        if number == 1:
+            ids = _delta(value)
+        elif number == 5:
+            info_buf = value
+        elif number == 8:
+            lats = _delta(value)
+        elif number == 9:
+            lons = _delta(value)
+        elif number == 10:
+            keys_vals = _packed(value)
+    infos = _dense_info(block, info_buf or b'', len(ids))
+    strings = block.strings
+    kv_pos = 0
+    for elem_id, lat, lon, info in zip(ids, lats, lons, infos):
+        elem_id = str(elem_id)
+        tags = []
+        # keys_vals holds key, value string ids per node, each node's list
+        # ending with a 0.
+        while kv_pos < len(keys_vals) and keys_vals[kv_pos] != 0:
+            tmp_dict = sf.shape_tag(elem_id, strings[keys_vals[kv_pos]],
+                                    strings[keys_vals[kv_pos + 1]], default_tag_type)
+            if tmp_dict:
+                tags.append(tmp_dict)
+            kv_pos += 2
+        kv_pos += 1
+        info.update(id=elem_id, lat=block.coordinate(block.lat_offset, lat),
+                    lon=block.coordinate(block.lon_offset, lon))
+        yield {'node': {field: info[field] for field in fields}, 'node_tags': tags}
+
+
+def _parts(block, buf):
+    elem_id, keys, vals, info, extra = 0, [], [], None, {}
+    for number, value in _fields(buf):
+        if number == 1:
+            elem_id = value
+        elif number == 2:
+            keys = _packed(value)
+        elif number == 3:
+            vals = _packed(value)
+        elif number == 4:
+            info = _info(block, value)
+        else:
+            extra[number] = value
+    return elem_id, keys, vals, info or _info(block, b''), extra
+
+
+def _shape_node(block, buf, fields, default_tag_type):
+    elem_id, keys, vals, info, extra = _parts(block, buf)
+    elem_id = str(_zigzag(elem_id))
+    info.update(id=elem_id, lat=block.coordinate(block.lat_offset, _zigzag(extra.get(8, 0))),
+                lon=block.coordinate(block.lon_offset, _zigzag(extra.get(9, 0))))
+    return {'node': {field: info[field] for field in fields},
+            'node_tags': _shape_tags(block, elem_id, keys, vals, default_tag_type)}
+
+
+def _shape_way(block, buf, fields, default_tag_type):
+    elem_id, keys, vals, info, extra = _parts(block, buf)
+    elem_id = str(_signed(elem_id))
+    info['id'] = elem_id
+    refs = _delta(extra[8]) if 8 in extra else []
+    return {'way': {field: info[field] for field in fields},
+            'way_nodes': [{'id': elem_id, 'node_id': str(ref), 'position': position}
+                          for position, ref in enumerate(refs)],
+            'way_tags': _shape_tags(block, elem_id, keys, vals, default_tag_type)}
+
+
+# Relation members are already bounded by the block size, but still go out
+# sf.MEMBER_BATCH at a time ahead of their relation, like the xml backends.
+def _shape_relation(block, buf, fields, default_tag_type, member_batch=sf.MEMBER_BATCH):
+    elem_id, keys, vals, info, extra = _parts(block, buf)
+    elem_id = str(_signed(elem_id))
+    info['id'] = elem_id
+    strings = block.strings
+    roles = _packed(extra[8]) if 8 in extra else []
+    member_ids = _delta(extra[9]) if 9 in extra else []
+    types = _packed(extra[10]) if 10 in extra else []
+    members = []
+    for position, (role, member_id, member_type) in enumerate(zip(roles, member_ids, types)):
+        members.append({'id': elem_id, 'member_id': str(member_id),
+                        'member_type': MEMBER_TYPES[member_type], 'role': strings[role],
+                        'position': position})
+        if len(members) >= member_batch:
+            yield {'relation_members': members}
+            members = []
+    yield {'relation': {field: info[field] for field in fields}, 'relation_members': members,
+           'relation_tags': _shape_tags(block, elem_id, keys, vals, default_tag_type)}
+
+
+# Yields the shaped nodes, ways and relations of one decompressed
+# PrimitiveBlock, in the form shape_element returns.
+def shape_block(buf, tags=('node', 'way', 'relation'), node_attr_fields=gc.NODE_FIELDS,
+                way_attr_fields=gc.WAY_FIELDS, default_tag_type='regular',
+                relation_attr_fields=gc.RELATION_FIELDS):
+    block = _Block(buf)
+    for group in block.groups:
+        for number, value in _fields(group):
+            if number == 2 and 'node' in tags:
+                for elem in _shape_dense(block, value, node_attr_fields, default_tag_type):
+                    yield elem
+            elif number == 1 and 'node' in tags:
+                yield _shape_node(block, value, node_attr_fields, default_tag_type)
+            elif number == 3 and 'way' in tags:
+                yield _shape_way(block, value, way_attr_fields, default_tag_type)
+            elif number == 4 and 'relation' in tags:
+                for elem in _shape_relation(block, value, relation_attr_fields,
+                                            default_tag_type):
+                    yield elem
+
+
+# Parser backend for OSM PBF files: yields the same shaped elements as the
+# xml parsers. osm_file may be a path or a binary file object positioned at
+# a blob boundary (e.g. a parallel.ShardReader over whole blobs).
+def iter_shaped(osm_file, tags=('node', 'way', 'relation'), node_attr_fields=gc.NODE_FIELDS,
+                way_attr_fields=gc.WAY_FIELDS, default_tag_type='regular'):
+    file_ = osm_file if hasattr(osm_file, 'read') else open(osm_file, 'rb')
+    try:
+        while True:
+            blob = _read_blob(file_)
+            if blob is None:
+                break
+            blob_type, data = blob
+            if blob_type == 'OSMHeader':
+                _check_header(_blob_data(data))
+            elif blob_type == 'OSMData':
+                for elem in shape_block(_blob_data(data), tags, node_attr_fields,
+                                        way_attr_fields, default_tag_type):
+                    yield elem
+    finally:
+        if file_ is not osm_file:
+            file_.close()
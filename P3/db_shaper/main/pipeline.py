@@ -0,0 +1,230 @@
+import collections
+import functools
+import io
+import multiprocessing
+import queue
+import threading
+import time
+
+from main import global_constants as gc
+from main import inputs
+from main import instrument
+from main import parallel
+from main import pbf
+from main import runner
+from main import shaper_functions as sf
+from main.normalizer import TagNormalizer
+from main.sinks import SINKS, TUPLE_SINKS
+
+# Input bytes per batch of raw elements handed to a shaper worker.
+BATCH_SIZE = 1 << 20
+# Batches per shaper worker being shaped or waiting for it.
+TASKS_PER_WORKER = 2
+# Batches of rows waiting per writer; a full queue stops the feeding.
+QUEUE_SIZE = 8
+SCAN_SIZE = 1 << 16
+
+
+# Offset of the last element start in data, or 0 if there is none.
+def _last_element_start(data):
+    window = SCAN_SIZE
+    while True:
+        start = max(0, len(data) - window)
+        last = None
+        for last in parallel.ELEMENT_START_RE.finditer(data, start):
+            pass
+        if last is not None:
+            return last.start()
+        if start == 0:
+            return 0
+        window *= 4
+
+
+# Splits an osm xml stream into batches of whole top-level elements of
+# about batch_size bytes, without parsing them. An element bigger than
+# batch_size makes a batch of its own.
+def _xml_batches(file_, batch_size=BATCH_SIZE):
+    buffer = b''
+    started = False
+    while True:
+        data = file_.read(batch_size)
+        if not data:
+            break
+        buffer += data
+        if not started:
+            match = parallel.ELEMENT_START_RE.search(buffer)
+            if match is None:
+                continue
+            buffer = buffer[match.start():]
+            started = True
+        cut = _last_element_start(buffer)
+        if cut:
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    end = buffer.rfind(parallel.OSM_END)
+    if end != -1:
+        buffer = buffer[:end]
+    if started and buffer.strip():
+        yield buffer
+
+
+def _pbf_batches(file_, batch_size=BATCH_SIZE):
+    batch = []
+    size = 0
+    for blob in pbf.iter_raw_blobs(file_):
+        batch.append(blob)
+        size += len(blob)
+        if size >= batch_size:
+            yield b''.join(batch)
+            batch = []
+            size = 0
+    if batch:
+        yield b''.join(batch)
+
+
+# Sink that keeps the rows of one batch per output, for the writers.
+class _RowCollector(object):
+    def __init__(self):
+        self.outputs = {}
+
+    def write(self, elem):
+        for name, rows in elem.items():
+            output = self.outputs.get(name)
+            if output is None:
+                output = self.outputs[name] = []
+            if isinstance(rows, list):
+                output.extend(rows)
+            else:
+                output.append(rows)
+
+
+def _init_worker(rule_files):
+    if rule_files:
+        sf.set_normalizer(TagNormalizer.from_files(rule_files))
+
+
+# Parses and shapes one batch of raw elements in a worker. Returns the rows
+# per output and, when instrumented, the batch's stats summary.
+def _shape_batch(args):
+    data, shape_options, instrumented = args
+    stats = instrument.Stats(progress_every=0) if instrumented else None
+    if shape_options.get('parser') != 'pbf':
+        data = parallel.SHARD_HEADER + data + parallel.SHARD_FOOTER
+    rows = _RowCollector()
+    runner.shape_stream(io.BytesIO(data), rows, stats=stats, **shape_options)
+    return rows.outputs, stats.summary() if stats is not None else None
+
+
+# Drains a bounded queue of elements into a sink in its own thread. The
+# sink is opened (by open_sink()) and closed in that thread too, since
+# SQLite connections cannot change threads. An error in the sink is raised
+# again by the next write() or by close().
+class _Writer(object):
+    def __init__(self, open_sink, queue_size=QUEUE_SIZE):
+        self.open_sink = open_sink
+        self.queue = queue.Queue(queue_size)
+        self.error = None
+        self.seconds = 0.0
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        sink = None
+        try:
+            sink = self.open_sink()
+        except Exception as e:
+            self.error = e
+        while True:
+            elem = self.queue.get()
+            if elem is None:
+                break
+            if self.error is None:
+                start = time.perf_counter()
+                try:
+                    sink.write(elem)
+                except Exception as e:
+                    self.error = e
+                self.seconds += time.perf_counter() - start
+        if sink is not None:
+            try:
+                sink.close()
+            except Exception as e:
+                self.error = self.error or e
+
+    def write(self, elem):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(elem)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+# One writer per csv file; SQLite takes all tables through one connection.
+def _open_writers(sink, out, fields, rows):
+    sink_class = (TUPLE_SINKS if rows == 'tuple' else SINKS)[sink]
+    if sink == 'csv':
+        return {name: _Writer(functools.partial(sink_class, {name: path}, fields))
+                for name, path in out.items()}
+    return {None: _Writer(functools.partial(sink_class, out, fields))}
+
+
+def _dispatch(result, writers, stats):
+    outputs, summary = result
+    if None in writers:
+        writers[None].write(outputs)
+    else:
+        for name, rows in outputs.items():
+            writers[name].write({name: rows})
+    if stats is not None:
+        before = stats.elements
+        stats.merge(summary)
+        if stats.progress_every and \
+                stats.elements // stats.progress_every > before // stats.progress_every:
+            stats.progress()
+
+
+# Runs the parse/shape/write stages of process_map side by side: this
+# process reads the input and cuts it into batches of raw elements (whole
+# blobs for .pbf), a pool of workers processes parses and shapes them, and
+# a writer thread per output file (one for SQLite) writes the rows. At most
+# workers * TASKS_PER_WORKER batches are being shaped and QUEUE_SIZE wait
+# per writer, so memory stays bounded however slow a stage is. Batches are
+# written in input order, so every file comes out as in a serial run.
+def process_map_pipelined(file_in, sink, out, workers, fields=gc.OUTPUT_FIELDS,
+                          batch_size=BATCH_SIZE, stats=None, **shape_options):
+    shape_options = dict(shape_options)
+    rule_files = shape_options.pop('rule_files', ())
+    writers = _open_writers(sink, out, fields, shape_options.get('rows'))
+    pool = multiprocessing.Pool(workers, _init_worker, (rule_files,))
+    running = collections.deque()
+    try:
+        with inputs.open_osm(file_in) as file_:
+            if shape_options.get('parser') == 'pbf':
+                batches = _pbf_batches(file_, batch_size)
+            else:
+                batches = _xml_batches(file_, batch_size)
+            for batch in batches:
+                running.append(pool.apply_async(_shape_batch,
+                                                ((batch, shape_options, stats is not None),)))
+                if len(running) >= workers * TASKS_PER_WORKER:
+                    _dispatch(running.popleft().get(), writers, stats)
+            while running:
+                _dispatch(running.popleft().get(), writers, stats)
+    finally:
+        pool.terminate()
+        pool.join()
+        errors = []
+        for writer in writers.values():
+            try:
+                writer.close()
+            except Exception as e:
+                errors.append(e)
+            if stats is not None:
+                stats.timers['write'] += writer.seconds
+        if errors:
+            raise errors[0]
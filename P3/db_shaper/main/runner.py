@@ -0,0 +1,136 @@
+import time
+
+import cerberus
+
+from main import expat_shaper
+from main import global_constants as gc
+from main import instrument
+from main import pbf
+from main import shaper_functions as sf
+from main.helper import functions as hf
+from main.helper.compiled_validator import CompiledValidator
+from main.normalizer import TagNormalizer
+
+VALIDATE_BATCH = 1000
+
+
+def _iterparse_shaped(osm_file, tags, tuples=False):
+    shape = sf.StreamingShaper(tuples)
+    for element, relation in hf.get_element_members(osm_file, tags=tags):
+        elem = shape(element, relation)
+        if elem:
+            yield elem
+
+
+def _iterparse_tuples(osm_file, tags):
+    return _iterparse_shaped(osm_file, tags, tuples=True)
+
+
+def _expat_tuples(osm_file, tags):
+    return expat_shaper.iter_shaped(osm_file, tags, tuples=True)
+
+
+def _as_tuples(elem, fields=gc.OUTPUT_FIELDS):
+    return {name: tuple(rows[field] for field in fields[name]) if isinstance(rows, dict) else
+            [tuple(row[field] for field in fields[name]) for row in rows]
+            for name, rows in elem.items()}
+
+
+def _as_dicts(elem, fields=gc.OUTPUT_FIELDS):
+    return {name: dict(zip(fields[name], rows)) if isinstance(rows, tuple) else
+            [dict(zip(fields[name], row)) for row in rows]
+            for name, rows in elem.items()}
+
+
+def _pbf_tuples(osm_file, tags):
+    for elem in pbf.iter_shaped(osm_file, tags):
+        yield _as_tuples(elem)
+
+
+# Parser backends: each takes (osm_file, tags) and yields shaped elements.
+PARSERS = {'iterparse': _iterparse_shaped,
+           'expat': expat_shaper.iter_shaped,
+           'pbf': pbf.iter_shaped}
+# The same backends yielding tuple rows in gc.*_FIELDS order.
+TUPLE_PARSERS = {'iterparse': _iterparse_tuples,
+                 'expat': _expat_tuples,
+                 'pbf': _pbf_tuples}
+ROW_FORMATS = {'dict': PARSERS, 'tuple': TUPLE_PARSERS}
+VALIDATORS = {'compiled': CompiledValidator,
+              'cerberus': cerberus.Validator}
+
+
+# Same elements as ROW_FORMATS[rows][parser], with the time spent parsing
+# and shaping added to stats. Only iterparse parses and shapes in separate
+# steps; the other backends are timed as 'parse_shape'.
+def _timed_elements(osm_file, tags, parser, rows, stats):
+    if parser != 'iterparse':
+        for elem in stats.timed('parse_shape', ROW_FORMATS[rows][parser](osm_file, tags)):
+            yield elem
+        return
+    shape = sf.StreamingShaper(rows == 'tuple')
+    timers = stats.timers
+    for element, relation in stats.timed('parse', hf.get_element_members(osm_file, tags=tags)):
+        start = time.perf_counter()
+        elem = shape(element, relation)
+        timers['shape'] += time.perf_counter() - start
+        if elem:
+            yield elem
+
+
+def _validate_and_write(batch, sink, validator, rows, stats=None):
+    start = time.perf_counter()
+    hf.validate_elements(batch if rows == 'dict' else [_as_dicts(elem) for elem in batch],
+                         validator)
+    if stats is not None:
+        stats.timers['validate'] += time.perf_counter() - start
+    for elem in batch:
+        sink.write(elem)
+    del batch[:]
+
+
+# Parses osm_file, shapes every element of tags and hands the result to sink.
+# osm_file may be a path or any binary file object. When validating,
+# elements are checked and written VALIDATE_BATCH at a time. rule_files are
+# extra json rule sets for the tag value normalizer. rows='tuple' shapes
+# into tuple rows, for the sinks in sinks.TUPLE_SINKS. With an
+# instrument.Stats, every stage is timed and counted into it. An
+# audit.TagAudit sees every raw tag of the pass.
+def shape_stream(osm_file, sink, validate=False, tags=('node', 'way', 'relation'),
+                 parser='iterparse', validator='compiled', rule_files=(), rows='dict', stats=None,
+                 tag_audit=None):
+    if tag_audit is not None:
+        sf.set_audit(tag_audit)
+        try:
+            return shape_stream(osm_file, sink, validate, tags, parser, validator, rule_files,
+                                rows, stats)
+        finally:
+            sf.set_audit(None)
+    if rule_files:
+        normalizer = sf.NORMALIZER
+        sf.set_normalizer(TagNormalizer.from_files(rule_files))
+        try:
+            return shape_stream(osm_file, sink, validate, tags, parser, validator, (), rows, stats)
+        finally:
+            sf.set_normalizer(normalizer)
+    validator_ = VALIDATORS[validator]()
+    if stats is None:
+        elements = ROW_FORMATS[rows][parser](osm_file, tags)
+    else:
+        elements = _timed_elements(osm_file, tags, parser, rows, stats)
+        sink = instrument.InstrumentedSink(sink, stats)
+    batch = []
+    count = 0
+    for elem in elements:
+        if validate is True:
+            batch.append(elem)
+            if len(batch) >= VALIDATE_BATCH:
+                _validate_and_write(batch, sink, validator_, rows, stats)
+        else:
+            sink.write(elem)
+        # Batches of relation members are not elements (see sf.StreamingShaper).
+        if len(elem) > 1:
+            count += 1
+    if batch:
+        _validate_and_write(batch, sink, validator_, rows, stats)
+    return count
@@ -1,57 +1,169 @@
-import re
-
-from main import global_constants as gc
-
-COLON_RE = re.compile(r'([a-z]|_)+:([a-z]|_)+')
-PROBLEMATIC_RE = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
-
-
-def _corrector(name):
-    replaced_incorrect = []
-    for elem in name.split(' '):
-        if elem in gc.CORRECTOR_MAPPING.keys():
-            replaced_incorrect.append(gc.CORRECTOR_MAPPING[elem])
-        else:
-            replaced_incorrect.append(elem)
-    return ' '.join(replaced_incorrect)
-
-
-def _tags_list_builder(list_, element, default_tag_type):
-    for tag in element.iter('tag'):
-        tag_has_prob_chars = PROBLEMATIC_RE.search(tag.attrib['k'])
-        tag_has_colons = COLON_RE.match(tag.attrib['k'])
-        if not tag_has_prob_chars:
-            tmp_dict = {'id': element.attrib['id'],
-                        'value': _corrector(tag.attrib['v'])}
-            if tag_has_colons:
-                split = tag.attrib['k'].split(':')
-                tmp_dict['key'] = ':'.join(split[1:])
-                tmp_dict['type'] = split[0]
-            else:
-                tmp_dict['key'] = tag.attrib['k']
-                tmp_dict['type'] = default_tag_type
-            list_.append(tmp_dict)
-
-
-def shape_element(elem, node_attr_fields=gc.NODE_FIELDS, way_attr_fields=gc.WAY_FIELDS,
-                  default_tag_type='regular'):
-    node_attribs = {}
-    way_attribs = {}
-    way_nodes = []
-    tags = []
-
-    if elem.tag == 'node':
-        for field in node_attr_fields:
-            node_attribs[field] = elem.attrib[field]
-        _tags_list_builder(tags, elem, default_tag_type)
-        return {'node': node_attribs, 'node_tags': tags}
-    elif elem.tag == 'way':
-        for field in way_attr_fields:
-            way_attribs[field] = elem.attrib[field]
-        count = 0
-        for nd in elem.iter('nd'):
-            tmp_dict = {'id': elem.attrib['id'], 'node_id': nd.attrib['ref'], 'position': count}
-            way_nodes.append(tmp_dict)
-            count += 1
-        _tags_list_builder(tags, elem, default_tag_type)
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+import operator
+import re
+
+from main import global_constants as gc
+from main.normalizer import TagNormalizer
+
+COLON_RE = re.compile(r'([a-z]|_)+:([a-z]|_)+')
+PROBLEMATIC_RE = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+NORMALIZER = TagNormalizer(gc.CORRECTOR_MAPPING)
+# Relation members passed on per batch when streaming (see StreamingShaper).
+MEMBER_BATCH = 10000
+# audit.TagAudit that sees every raw tag, or None.
+AUDIT = None
+
+
+# Swaps the normalizer used by _corrector, e.g. for one built with extra
+# rule sets (see TagNormalizer.from_files).
+def set_normalizer(normalizer):
+    global NORMALIZER
+    NORMALIZER = normalizer
+
+
+# Installs an audit.TagAudit (None removes it); shape_tag and shape_tag_tuple
+# then pass it every tag before shaping, so the audit needs no second parse.
+def set_audit(audit):
+    global AUDIT
+    AUDIT = audit
+
+
+def _corrector(name):
+    return NORMALIZER.normalize(name)
+
+
+# Returns the row for a single <tag k=key v=value>, or None if the key
+# contains problematic characters.
+def shape_tag(elem_id, key, value, default_tag_type='regular'):
+    if AUDIT is not None:
+        AUDIT.add(key, value)
+    if PROBLEMATIC_RE.search(key):
+        return None
+    tmp_dict = {'id': elem_id, 'value': _corrector(value)}
+    if COLON_RE.match(key):
+        split = key.split(':')
+        tmp_dict['key'] = ':'.join(split[1:])
+        tmp_dict['type'] = split[0]
+    else:
+        tmp_dict['key'] = key
+        tmp_dict['type'] = default_tag_type
+    return tmp_dict
+
+
+# Tuple form of shape_tag, in gc.NODE_TAGS_FIELDS / gc.WAY_TAGS_FIELDS
+# order: (id, key, value, type).
+def shape_tag_tuple(elem_id, key, value, default_tag_type='regular'):
+    if AUDIT is not None:
+        AUDIT.add(key, value)
+    if PROBLEMATIC_RE.search(key):
+        return None
+    if COLON_RE.match(key):
+        tag_type, _, key = key.partition(':')
+        return elem_id, key, _corrector(value), tag_type
+    return elem_id, key, _corrector(value), default_tag_type
+
+
+def _tags_list_builder(list_, element, default_tag_type):
+    for tag in element.iter('tag'):
+        tmp_dict = shape_tag(element.attrib['id'], tag.attrib['k'], tag.attrib['v'],
+                             default_tag_type)
+        if tmp_dict:
+            list_.append(tmp_dict)
+
+
+def shape_member(relation_id, member, position):
+    attrib = member.attrib
+    return {'id': relation_id, 'member_id': attrib['ref'], 'member_type': attrib['type'],
+            'role': attrib.get('role', ''), 'position': position}
+
+
+# Tuple form of shape_member, in gc.RELATION_MEMBERS_FIELDS order.
+def shape_member_tuple(relation_id, member, position):
+    attrib = member.attrib
+    return relation_id, attrib['ref'], attrib['type'], attrib.get('role', ''), position
+
+
+def shape_element(elem, node_attr_fields=gc.NODE_FIELDS, way_attr_fields=gc.WAY_FIELDS,
+                  default_tag_type='regular', relation_attr_fields=gc.RELATION_FIELDS):
+    node_attribs = {}
+    way_attribs = {}
+    way_nodes = []
+    tags = []
+
+    if elem.tag == 'node':
+        for field in node_attr_fields:
+            node_attribs[field] = elem.attrib[field]
+        _tags_list_builder(tags, elem, default_tag_type)
+        return {'node': node_attribs, 'node_tags': tags}
+    elif elem.tag == 'way':
+        for field in way_attr_fields:
+            way_attribs[field] = elem.attrib[field]
+        count = 0
+        for nd in elem.iter('nd'):
+            tmp_dict = {'id': elem.attrib['id'], 'node_id': nd.attrib['ref'], 'position': count}
+            way_nodes.append(tmp_dict)
+            count += 1
+        _tags_list_builder(tags, elem, default_tag_type)
+        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+    elif elem.tag == 'relation':
+        relation_id = elem.attrib['id']
+        members = [shape_member(relation_id, member, position)
+                   for position, member in enumerate(elem.iter('member'))]
+        _tags_list_builder(tags, elem, default_tag_type)
+        return {'relation': {field: elem.attrib[field] for field in relation_attr_fields},
+                'relation_members': members, 'relation_tags': tags}
+
+
+# Same outputs as shape_element, but every row is a tuple in the order of
+# node_attr_fields / way_attr_fields and the gc.*_FIELDS lists, ready for
+# csv.writer or executemany without building a dict per row.
+def shape_element_tuples(elem, node_attr_fields=gc.NODE_FIELDS, way_attr_fields=gc.WAY_FIELDS,
+                         default_tag_type='regular', relation_attr_fields=gc.RELATION_FIELDS):
+    if elem.tag not in ('node', 'way', 'relation'):
+        return None
+    attrib = elem.attrib
+    elem_id = attrib['id']
+    tags = []
+    for tag in elem.iter('tag'):
+        row = shape_tag_tuple(elem_id, tag.attrib['k'], tag.attrib['v'], default_tag_type)
+        if row:
+            tags.append(row)
+    if elem.tag == 'node':
+        return {'node': operator.itemgetter(*node_attr_fields)(attrib), 'node_tags': tags}
+    if elem.tag == 'relation':
+        members = [shape_member_tuple(elem_id, member, position)
+                   for position, member in enumerate(elem.iter('member'))]
+        return {'relation': operator.itemgetter(*relation_attr_fields)(attrib),
+                'relation_members': members, 'relation_tags': tags}
+    way_nodes = [(elem_id, nd.attrib['ref'], position)
+                 for position, nd in enumerate(elem.iter('nd'))]
+    return {'way': operator.itemgetter(*way_attr_fields)(attrib), 'way_nodes': way_nodes,
+            'way_tags': tags}
+
+
+# Shapes the (element, relation) pairs of hf.get_element_members. Members
+# are shaped as they come and passed on MEMBER_BATCH rows at a time, as
+# {'relation_members': rows}; the rest of them go out with their relation.
+# Returns None while a batch fills up, like shape_element for elements it
+# does not shape.
+class StreamingShaper(object):
+    def __init__(self, tuples=False, member_batch=MEMBER_BATCH):
+        self.shape = shape_element_tuples if tuples else shape_element
+        self.shape_member = shape_member_tuple if tuples else shape_member
+        self.member_batch = member_batch
+        self.members = []
+        self.position = 0
+
+    def __call__(self, element, relation=None):
+        if relation is not None:
+            self.members.append(self.shape_member(relation.attrib['id'], element, self.position))
+            self.position += 1
+            if len(self.members) >= self.member_batch:
+                members, self.members = self.members, []
+                return {'relation_members': members}
+            return None
+        elem = self.shape(element)
+        if element.tag == 'relation':
+            elem['relation_members'] = self.members + elem['relation_members']
+            self.members = []
+            self.position = 0
+        return elem
@@ -0,0 +1,209 @@
+import csv
+import io
+import os
+import sqlite3
+
+from main import global_constants as gc
+from main.helper import functions as hf
+from main.helper import schema as s
+
+SQL_TYPES = {'integer': 'INTEGER', 'float': 'REAL', 'string': 'TEXT'}
+# SQLite's own text -> REAL conversion is not correctly rounded, so REAL
+# columns are converted in Python; INTEGER and TEXT values go in as is.
+SQL_COERCERS = {'REAL': float}
+# Safe only because a failed load is simply rerun from scratch.
+BULK_PRAGMAS = ['PRAGMA journal_mode = OFF',
+                'PRAGMA synchronous = OFF',
+                'PRAGMA locking_mode = EXCLUSIVE',
+                'PRAGMA temp_store = MEMORY',
+                'PRAGMA cache_size = -262144']
+BATCH_SIZE = 10000
+WRITE_BUFFER = 1 << 20
+TRANSACTION_SIZE = 1000000
+
+
+# Writes shaped elements to one csv file per output ('node', 'node_tags',
+# 'way', 'way_nodes', 'way_tags', 'relation', ...). paths maps each output
+# name to its file; with append=True rows are added after existing ones.
+class CsvSink(object):
+    def __init__(self, paths, fields=gc.OUTPUT_FIELDS, write_header=True, append=False):
+        self.files = {}
+        self.writers = {}
+        for name, path in paths.items():
+            self.files[name] = io.open(path, 'a' if append else 'w', encoding='utf8')
+            self.writers[name] = hf.UnicodeDictWriter(self.files[name], fields[name])
+            if write_header and not append:
+                self.writers[name].writeheader()
+
+    def write(self, elem):
+        for name, rows in elem.items():
+            if isinstance(rows, dict):
+                self.writers[name].writerow(rows)
+            else:
+                self.writers[name].writerows(rows)
+
+    # Makes everything written so far durable, e.g. for a checkpoint.
+    def flush(self):
+        for file_ in self.files.values():
+            file_.flush()
+            os.fsync(file_.fileno())
+
+    def close(self):
+        for file_ in self.files.values():
+            file_.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# CsvSink for tuple rows (see sf.shape_element_tuples): rows go straight to
+# csv.writer, through WRITE_BUFFER sized file buffers.
+class CsvTupleSink(CsvSink):
+    def __init__(self, paths, fields=gc.OUTPUT_FIELDS, write_header=True, append=False,
+                 buffer_size=WRITE_BUFFER):
+        self.files = {}
+        self.writers = {}
+        for name, path in paths.items():
+            self.files[name] = io.open(path, 'a' if append else 'w', encoding='utf8',
+                                       buffering=buffer_size)
+            self.writers[name] = csv.writer(self.files[name])
+            if write_header and not append:
+                self.writers[name].writerow(fields[name])
+
+    def write(self, elem):
+        for name, rows in elem.items():
+            if isinstance(rows, tuple):
+                self.writers[name].writerow(rows)
+            else:
+                self.writers[name].writerows(rows)
+
+
+def _column_types(name, schema=s.schema):
+    entry = schema[name]
+    if entry['type'] == 'list':
+        entry = entry['schema']
+    return {field: SQL_TYPES[rule['type']] for field, rule in entry['schema'].items()}
+
+
+def create_table_sql(name, fields=gc.OUTPUT_FIELDS, tables=gc.TABLE_NAMES):
+    types = _column_types(name)
+    columns = []
+    for field in fields[name]:
+        column = '"{0}" {1}'.format(field, types[field])
+        if gc.PRIMARY_KEYS.get(name) == field:
+            column += ' PRIMARY KEY'
+        columns.append(column)
+    return 'CREATE TABLE {0} ({1})'.format(tables[name], ', '.join(columns))
+
+
+# Streams shaped elements into a SQLite database (tables from
+# gc.TABLE_NAMES). Rows are buffered per table and inserted with
+# executemany inside large transactions; secondary indexes are built once,
+# when the sink is closed. With create_tables=False rows are added to the
+# existing tables instead of fresh ones.
+class SqliteSink(object):
+    def __init__(self, db_path, fields=gc.OUTPUT_FIELDS, tables=gc.TABLE_NAMES,
+                 batch_size=BATCH_SIZE, transaction_size=TRANSACTION_SIZE, build_indexes=True,
+                 create_tables=True, pragmas=BULK_PRAGMAS):
+        self.fields = fields
+        self.tables = tables
+        self.batch_size = batch_size
+        self.transaction_size = transaction_size
+        self.build_indexes = build_indexes
+        self.conn = sqlite3.connect(db_path, isolation_level=None)
+        for pragma in pragmas:
+            self.conn.execute(pragma)
+        if create_tables:
+            for name in fields:
+                self.conn.execute('DROP TABLE IF EXISTS {0}'.format(tables[name]))
+                self.conn.execute(create_table_sql(name, fields, tables))
+        self.inserts = {name: 'INSERT INTO {0} VALUES ({1})'.format(
+                            tables[name], ', '.join('?' * len(fields[name])))
+                        for name in fields}
+        self.batches = {name: [] for name in fields}
+        self.coercers = {}
+        self.positional_coercers = {}
+        for name in fields:
+            types = _column_types(name)
+            self.coercers[name] = [(field, SQL_COERCERS.get(types[field])) for field in fields[name]]
+            self.positional_coercers[name] = [(n, coerce) for n, (_, coerce)
+                                              in enumerate(self.coercers[name]) if coerce]
+        self.uncommitted = 0
+        self.conn.execute('BEGIN')
+
+    # Rows may be dicts or tuples in field order.
+    def _to_tuple(self, name, row):
+        if isinstance(row, tuple):
+            if not self.positional_coercers[name]:
+                return row
+            row = list(row)
+            for n, coerce in self.positional_coercers[name]:
+                row[n] = coerce(row[n])
+            return tuple(row)
+        return tuple([coerce(row[field]) if coerce else row[field]
+                      for field, coerce in self.coercers[name]])
+
+    def write(self, elem):
+        for name, rows in elem.items():
+            batch = self.batches[name]
+            if isinstance(rows, list):
+                batch.extend(self._to_tuple(name, row) for row in rows)
+            else:
+                batch.append(self._to_tuple(name, rows))
+            if len(batch) >= self.batch_size:
+                self._flush(name)
+
+    def _flush(self, name):
+        batch = self.batches[name]
+        self.conn.executemany(self.inserts[name], batch)
+        self.uncommitted += len(batch)
+        del batch[:]
+        if self.uncommitted >= self.transaction_size:
+            self.conn.execute('COMMIT')
+            self.conn.execute('BEGIN')
+            self.uncommitted = 0
+
+    # Appends every table of another database written by a SqliteSink,
+    # e.g. one shard of a parallel run.
+    def load_from(self, db_path):
+        for name in self.fields:
+            self._flush(name)
+        self.conn.execute('COMMIT')
+        self.conn.execute('ATTACH DATABASE ? AS shard', (db_path,))
+        self.conn.execute('BEGIN')
+        for name in self.fields:
+            self.conn.execute('INSERT INTO main.{0} SELECT * FROM shard.{0}'.format(self.tables[name]))
+        self.conn.execute('COMMIT')
+        self.conn.execute('DETACH DATABASE shard')
+        self.conn.execute('BEGIN')
+        self.uncommitted = 0
+
+    def _create_indexes(self):
+        for name, columns in gc.TABLE_INDEXES.items():
+            if name in self.fields:
+                for column in columns:
+                    self.conn.execute('CREATE INDEX IF NOT EXISTS {0}_{1}_idx ON {0} ("{1}")'.format(
+                        self.tables[name], column))
+
+    def close(self):
+        for name in self.fields:
+            self._flush(name)
+        self.conn.execute('COMMIT')
+        if self.build_indexes:
+            self._create_indexes()
+            self.conn.execute('ANALYZE')
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+SINKS = {'csv': CsvSink, 'sqlite': SqliteSink}
+# Sinks taking the tuple rows of runner.shape_stream(rows='tuple').
+TUPLE_SINKS = {'csv': CsvTupleSink, 'sqlite': SqliteSink}
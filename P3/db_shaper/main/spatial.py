@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+import os
+
+import numpy as np
+
+META_FILE = 'grid.json'
+IDS_FILE = 'ids.npy'
+COORDS_FILE = 'coords.npy'
+OFFSETS_FILE = 'cell_offsets.npy'
+TAGGED_IDS_FILE = 'tagged_ids.npy'
+TAG_OFFSETS_FILE = 'tag_offsets.npy'
+TAGS_FILE = 'tags.jsonl'
+# Degrees per grid cell (about 1.1 km of latitude).
+CELL_SIZE = 0.01
+
+
+def _read_node_columns(nodes_path):
+    ids, lats, lons = [], [], []
+    with io.open(nodes_path, encoding='utf8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        id_col, lat_col, lon_col = header.index('id'), header.index('lat'), header.index('lon')
+        for row in reader:
+            ids.append(int(row[id_col]))
+            lats.append(float(row[lat_col]))
+            lons.append(float(row[lon_col]))
+    return (np.array(ids, dtype=np.int64),
+            np.column_stack((np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64))))
+
+
+# Writes the tags of every tagged node as one json line of [key, value, type]
+# triples, and returns the node ids and byte offsets of those lines.
+def _write_tags(node_tags_path, tags_path):
+    tags = {}
+    with io.open(node_tags_path, encoding='utf8', newline='') as f:
+        for row in csv.DictReader(f):
+            tags.setdefault(int(row['id']), []).append([row['key'], row['value'], row['type']])
+    tagged_ids = np.array(sorted(tags), dtype=np.int64)
+    offsets = np.zeros(len(tagged_ids) + 1, dtype=np.int64)
+    with open(tags_path, 'wb') as out:
+        for n, node_id in enumerate(tagged_ids):
+            out.write(json.dumps(tags[int(node_id)], ensure_ascii=False).encode('utf8') + b'\n')
+            offsets[n + 1] = out.tell()
+    return tagged_ids, offsets
+
+
+def _cells(coords, meta):
+    rows = np.floor((coords[:, 0] - meta['min_lat']) / meta['cell_size']).astype(np.int64)
+    cols = np.floor((coords[:, 1] - meta['min_lon']) / meta['cell_size']).astype(np.int64)
+    return (np.clip(rows, 0, meta['rows'] - 1) * meta['cols'] +
+            np.clip(cols, 0, meta['cols'] - 1))
+
+
+# Builds a uniform grid index over the shaped nodes.csv (and nodes_tags.csv)
+# in index_dir. Nodes are stored sorted by grid cell, so each row of cells in
+# a bbox is one contiguous slice of the arrays.
+def build_grid_index(nodes_path, node_tags_path, index_dir, cell_size=CELL_SIZE):
+    ids, coords = _read_node_columns(nodes_path)
+    if len(ids):
+        min_lat, min_lon = coords.min(axis=0)
+        max_lat, max_lon = coords.max(axis=0)
+    else:
+        min_lat = min_lon = max_lat = max_lon = 0.0
+    meta = {'cell_size': cell_size, 'min_lat': float(min_lat), 'min_lon': float(min_lon),
+            'rows': int((max_lat - min_lat) // cell_size) + 1,
+            'cols': int((max_lon - min_lon) // cell_size) + 1,
+            'nodes': len(ids)}
+    cells = _cells(coords, meta)
+    order = np.argsort(cells, kind='stable')
+    offsets = np.searchsorted(cells[order], np.arange(meta['rows'] * meta['cols'] + 1))
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, IDS_FILE), ids[order])
+    np.save(os.path.join(index_dir, COORDS_FILE), coords[order])
+    np.save(os.path.join(index_dir, OFFSETS_FILE), offsets.astype(np.int64))
+    tagged_ids, tag_offsets = _write_tags(node_tags_path, os.path.join(index_dir, TAGS_FILE))
+    np.save(os.path.join(index_dir, TAGGED_IDS_FILE), tagged_ids)
+    np.save(os.path.join(index_dir, TAG_OFFSETS_FILE), tag_offsets)
+    with open(os.path.join(index_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    return GridIndex(index_dir)
+
+
+# Memory-mapped grid index written by build_grid_index. Only the cells a
+# bbox touches and the tag lines of the nodes found are read from disk.
+class GridIndex(object):
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.ids = np.load(os.path.join(index_dir, IDS_FILE), mmap_mode='r')
+        self.coords = np.load(os.path.join(index_dir, COORDS_FILE), mmap_mode='r')
+        self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode='r')
+        self.tagged_ids = np.load(os.path.join(index_dir, TAGGED_IDS_FILE), mmap_mode='r')
+        self.tag_offsets = np.load(os.path.join(index_dir, TAG_OFFSETS_FILE), mmap_mode='r')
+        self.tags_path = os.path.join(index_dir, TAGS_FILE)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _clamped_cell(self, value, origin, count):
+        return min(max(int((value - origin) // self.meta['cell_size']), 0), count - 1)
+
+    # Returns the ids and (lat, lon) of the nodes inside the bbox, edges
+    # included.
+    def query_ids(self, min_lat, min_lon, max_lat, max_lon):
+        meta = self.meta
+        if not len(self.ids) or min_lat > max_lat or min_lon > max_lon:
+            return np.empty(0, dtype=np.int64), np.empty((0, 2))
+        row0 = self._clamped_cell(min_lat, meta['min_lat'], meta['rows'])
+        row1 = self._clamped_cell(max_lat, meta['min_lat'], meta['rows'])
+        col0 = self._clamped_cell(min_lon, meta['min_lon'], meta['cols'])
+        col1 = self._clamped_cell(max_lon, meta['min_lon'], meta['cols'])
+        slices = [slice(self.offsets[row * meta['cols'] + col0],
+                        self.offsets[row * meta['cols'] + col1 + 1])
+                  for row in range(row0, row1 + 1)]
+        ids = np.concatenate([self.ids[s] for s in slices])
+        coords = np.concatenate([self.coords[s] for s in slices])
+        inside = ((coords[:, 0] >= min_lat) & (coords[:, 0] <= max_lat) &
+                  (coords[:, 1] >= min_lon) & (coords[:, 1] <= max_lon))
+        return ids[inside], coords[inside]
+
+    # Returns {node id: [[key, value, type], ...]} for the given node ids.
+    def tags(self, node_ids):
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        tags = {}
+        if not len(self.tagged_ids) or not len(node_ids):
+            return tags
+        pos = np.minimum(np.searchsorted(self.tagged_ids, node_ids), len(self.tagged_ids) - 1)
+        with open(self.tags_path, 'rb') as f:
+            for node_id, n in zip(node_ids, pos):
+                if self.tagged_ids[n] == node_id:
+                    f.seek(self.tag_offsets[n])
+                    tags[int(node_id)] = json.loads(
+                        f.read(self.tag_offsets[n + 1] - self.tag_offsets[n]).decode('utf8'))
+        return tags
+
+    # Returns a list of {'id', 'lat', 'lon', 'tags'} for the nodes in the bbox.
+    def query(self, min_lat, min_lon, max_lat, max_lon):
+        ids, coords = self.query_ids(min_lat, min_lon, max_lat, max_lon)
+        tags = self.tags(ids)
+        return [{'id': int(node_id), 'lat': float(lat), 'lon': float(lon),
+                 'tags': tags.get(int(node_id), [])}
+                for node_id, (lat, lon) in zip(ids, coords)]
@@ -1,156 +1,107 @@
-import csv
-import pymongo
-
-from collections import OrderedDict
-
-CSV_PATH = 'Q:\\Program Files\\Programming Applications\\' \
-           'Projects\\Udacity\\Data Analysis Nanodegree\\P4\\datasets-csv\\'
-CSV_NAME = 'champ_popularity.csv'
-QUERY = [
-    {'$unwind': '$participants'},
-    {'$group': {
-        '_id': '$participants.championId',
-        'total': {'$sum': 1},
-        'tierArray': {'$push': '$participants.highestAchievedSeasonTier'}
-    }},
-
-    {'$project': {
-        '_id': False,
-        'championId': '$_id',
-        'unranked count': {
-            '$size': {
-                '$filter': {
-                    'input': '$tierArray',
-                    'as': 'tier',
-                    'cond': {'$eq': ['$$tier', 'UNRANKED']}
-                }
-            }
-        },
-        'bronze count': {
-            '$size': {
-                '$filter': {
-                    'input': '$tierArray',
-                    'as': 'tier',
-                    'cond': {'$eq': ['$$tier', 'BRONZE']}
-                }
-            }
-        },
-        'silver count': {
-            '$size': {
-                '$filter': {
-                    'input': '$tierArray',
-                    'as': 'tier',
-                    'cond': {'$eq': ['$$tier', 'SILVER']}
-                }
-            }
-        },
-        'gold count': {
-            '$size': {
-                '$filter': {
-                    'input': '$tierArray',
-                    'as': 'tier',
-                    'cond': {'$eq': ['$$tier', 'GOLD']}
-                }
-            }
-        },
-        'platinum count': {
-            '$size': {
-                '$filter': {
-                    'input': '$tierArray',
-                    'as': 'tier',
-                    'cond': {'$eq': ['$$tier', 'PLATINUM']}
-                }
-            }
-        },
-        'diamond count': {
-            '$size': {
-                '$filter': {
-                    'input': '$tierArray',
-                    'as': 'tier',
-                    'cond': {'$eq': ['$$tier', 'DIAMOND']}
-                }
-            }
-        },
-        'master count': {
-            '$size': {
-                '$filter': {
-                    'input': '$tierArray',
-                    'as': 'tier',
-                    'cond': {'$eq': ['$$tier', 'MASTER']}
-                }
-            }
-        },
-        'challenger count': {
-            '$size': {
-                '$filter': {
-                    'input': '$tierArray',
-                    'as': 'tier',
-                    'cond': {'$eq': ['$$tier', 'CHALLENGER']}
-                }
-            }
-        },
-        'total': True
-    }}
-]
-PROJECTION = {
-    '_id': False,
-    'data': True
-}
-
-
-def _get_client():
-    try:
-        ret_client = pymongo.MongoClient('localhost', 27017)
-    except pymongo.errors.ConnectionFailure as e:
-        print(e)
-    else:
-        return ret_client
-
-
-# Makes a dictionary whose keys are championId and whose columns are
-# the respective champion's name.
-def _champ_mapping_maker(query_results):
-    ret_dict = {}
-    champ_doc = query_results[0]['data']
-    for key in champ_doc.keys():
-        ret_dict[int(champ_doc[key]['key'])] = champ_doc[key]['name']
-    return ret_dict
-
-
-def _tidier(agg_query, map_query):
-    ret_list = []
-    mongo_list = list(agg_query)
-    mapping = _champ_mapping_maker(map_query)
-    for dict_ in mongo_list:
-        tmp = [
-            ('champion name', mapping[dict_['championId']]),
-            ('unranked', dict_['unranked count']),
-            ('bronze', dict_['bronze count']),
-            ('silver', dict_['silver count']),
-            ('gold', dict_['gold count']),
-            ('platinum', dict_['platinum count']),
-            ('diamond', dict_['diamond count']),
-            ('master', dict_['master count']),
-            ('challenger', dict_['challenger count']),
-            ('total', dict_['total'])
-        ]
-        ret_list.append(OrderedDict(tmp))
-    return ret_list
-
-
-def format_to_csv(agg_query, map_query, csv_out=CSV_PATH+CSV_NAME):
-    to_csv = _tidier(agg_query, map_query)
-    keys = to_csv[0].keys()
-    with open(csv_out, 'w+', newline='', encoding='utf-8') as output_csv:
-        dict_writer = csv.DictWriter(output_csv, keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(to_csv)
-
-
-if __name__ == '__main__':
-    client = _get_client()
-    db = client.seed_lol
-    query0 = db.matches.aggregate(QUERY)
-    query1 = db.champions.find(projection=PROJECTION)
-    format_to_csv(agg_query=query0, map_query=query1)
-    client.close()
+import json
+import os
+
+from collections import OrderedDict
+from common import BATCH_SIZE, get_client, match_ids_stages, merge_sums_stage, pivot_count_stages, \
+    write_csv
+
+CSV_PATH = 'Q:\\Program Files\\Programming Applications\\' \
+           'Projects\\Udacity\\Data Analysis Nanodegree\\P4\\datasets-csv\\'
+CSV_NAME = 'champ_popularity.csv'
+CSV_FIELDS = ['champion name', 'unranked', 'bronze', 'silver', 'gold', 'platinum', 'diamond',
+              'master', 'challenger', 'total']
+# Tier column -> highestAchievedSeasonTier, in csv order.
+TIER_COUNTS = OrderedDict([
+    ('unranked count', 'UNRANKED'),
+    ('bronze count', 'BRONZE'),
+    ('silver count', 'SILVER'),
+    ('gold count', 'GOLD'),
+    ('platinum count', 'PLATINUM'),
+    ('diamond count', 'DIAMOND'),
+    ('master count', 'MASTER'),
+    ('challenger count', 'CHALLENGER')
+])
+# Only the two participant fields counted are kept before the $unwind, so
+# the unwound documents do not carry the whole match.
+QUERY = [
+    {'$project': {
+        '_id': False,
+        'participants.championId': True,
+        'participants.highestAchievedSeasonTier': True
+    }},
+    {'$unwind': '$participants'}
+] + pivot_count_stages('$participants.championId', '$participants.highestAchievedSeasonTier',
+                       TIER_COUNTS, 'championId')
+# Incremental refreshes keep each champion's counts in TOTALS (with the
+# championId as _id) and add the counts of new matches to them, so the
+# csv is rewritten from one document per champion.
+TOTALS = 'champ_popularity_totals'
+TOTALS_QUERY = QUERY[:-2] + [merge_sums_stage(TOTALS, list(TIER_COUNTS) + ['total'])]
+TOTALS_CSV_QUERY = QUERY[-2:]
+CHAMP_MAPPING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  '..', 'misc', 'champ_mapping.json')
+PROJECTION = {
+    '_id': False,
+    'data': True
+}
+
+
+def _db_champ_mapping(db):
+    champ_doc = db.champions.find_one(projection=PROJECTION)['data']
+    return {int(champ['key']): champ['name'] for champ in champ_doc.values()}
+
+
+# championId -> champion name, from the mapping cached in misc. A champion
+# the cache does not know yet (e.g. one added to champion.json since) is
+# looked up in the champions collection, which then replaces the cache in
+# memory; the file in misc is never written.
+class _ChampMapping(dict):
+    def __init__(self, db, mapping):
+        dict.__init__(self, mapping)
+        self.db = db
+        self.refreshed = False
+
+    def __missing__(self, champion_id):
+        if self.refreshed:
+            raise KeyError(champion_id)
+        self.refreshed = True
+        self.update(_db_champ_mapping(self.db))
+        return self[champion_id]
+
+
+def _champ_mapping_maker(db, mapping_path=CHAMP_MAPPING_PATH):
+    if not os.path.exists(mapping_path):
+        return _ChampMapping(db, _db_champ_mapping(db))
+    with open(mapping_path, encoding='utf-8') as f:
+        return _ChampMapping(db, {int(key): name for key, name in json.load(f).items()})
+
+
+def _tidier(agg_query, mapping):
+    for dict_ in agg_query:
+        yield ((mapping[dict_['championId']],) + tuple(dict_[field] for field in TIER_COUNTS) +
+               (dict_['total'],))
+
+
+def format_to_csv(agg_query, mapping, csv_out=CSV_PATH+CSV_NAME):
+    return write_csv(_tidier(agg_query, mapping), CSV_FIELDS, csv_out)
+
+
+def run(db, csv_out=CSV_PATH + CSV_NAME, batch_size=BATCH_SIZE):
+    query = db.matches.aggregate(QUERY, batchSize=batch_size)
+    return format_to_csv(agg_query=query, mapping=_champ_mapping_maker(db), csv_out=csv_out)
+
+
+# Adds the counts of the matches in match_ids to TOTALS and rewrites the
+# csv from it; fresh starts the counts over.
+def run_incremental(db, match_ids, fresh, csv_out=CSV_PATH + CSV_NAME, batch_size=BATCH_SIZE):
+    if fresh:
+        db[TOTALS].drop()
+    db.matches.aggregate(match_ids_stages(match_ids) + TOTALS_QUERY)
+    query = db[TOTALS].aggregate(TOTALS_CSV_QUERY, batchSize=batch_size)
+    return format_to_csv(agg_query=query, mapping=_champ_mapping_maker(db), csv_out=csv_out)
+
+
+if __name__ == '__main__':
+    client = get_client()
+    run(client.seed_lol)
+    client.close()
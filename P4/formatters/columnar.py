@@ -0,0 +1,301 @@
+import argparse
+import importlib.util
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+
+from array import array
+from collections import OrderedDict
+from common import write_csv
+from run_all import FORMATTER_DIR, FORMATTERS, load_formatter
+
+# Computes the six datasets-csv files straight from the seed json files,
+# without MongoDB: every match is read once, its participants, teams and
+# the events the outputs use go into columns, and each output is then a
+# vectorized group-by over those columns. The rows are the ones the Mongo
+# formatters write, in the same order: champ_popularity, firstBlood_times
+# and kda_performance sorted by their group key, as their pipelines $sort
+# them, and the other outputs in the order of the files, as a single
+# to_mongo.py worker loads them.
+TO_MONGO_PATH = os.path.join(FORMATTER_DIR, '..', 'json-to-mongo', 'to_mongo.py')
+KILL = 'CHAMPION_KILL'
+LEVEL_UP = 'SKILL_LEVEL_UP'
+# Summoner's Rift, the only map death_location covers.
+DEATH_MAP_ID = 11
+
+
+def _load_to_mongo():
+    spec = importlib.util.spec_from_file_location('to_mongo', TO_MONGO_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Numbers the distinct values of a string column in order of appearance.
+class _Codes(object):
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        ret = self.codes.get(value)
+        if ret is None:
+            ret = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return ret
+
+
+# Columns of all matches added, as growable arrays; arrays() turns them
+# into numpy arrays. Participants, teams and events refer to their match
+# by its position in matches.
+class MatchColumns(object):
+    def __init__(self):
+        self.tiers = _Codes()
+        self.level_up_types = _Codes()
+        self.match_id = array('q')
+        self.map_id = array('q')
+        self.participant = {name: array('q') for name in (
+            'match', 'participantId', 'championId', 'tier', 'summonerId', 'hasIdentity',
+            'kills', 'deaths', 'assists')}
+        self.team_match = array('q')
+        self.team_fields = OrderedDict()
+        self.kill = {name: array('q') for name in ('match', 'timestamp', 'x', 'y', 'hasPosition')}
+        self.level_up = {name: array('q') for name in (
+            'match', 'participantId', 'timestamp', 'skillSlot', 'levelUpType')}
+
+    def add(self, match):
+        index = len(self.match_id)
+        self.match_id.append(match['matchId'])
+        self.map_id.append(match['mapId'])
+        summoners = {identity['participantId']: identity['player']['summonerId']
+                     for identity in match['participantIdentities']}
+        participant = self.participant
+        for dict_ in match['participants']:
+            stats = dict_['stats']
+            participant['match'].append(index)
+            participant['participantId'].append(dict_['participantId'])
+            participant['championId'].append(dict_['championId'])
+            participant['tier'].append(self.tiers.code(dict_['highestAchievedSeasonTier']))
+            participant['summonerId'].append(summoners.get(dict_['participantId'], 0))
+            participant['hasIdentity'].append(dict_['participantId'] in summoners)
+            participant['kills'].append(stats['kills'])
+            participant['deaths'].append(stats['deaths'])
+            participant['assists'].append(stats['assists'])
+        for team in match['teams']:
+            self.team_match.append(index)
+            for field, value in team.items():
+                self.team_fields.setdefault(field, []).append(value)
+        kill, level_up = self.kill, self.level_up
+        for frame in match.get('timeline', {}).get('frames', ()):
+            for event in frame.get('events', ()):
+                event_type = event['eventType']
+                if event_type == KILL:
+                    kill['match'].append(index)
+                    kill['timestamp'].append(event['timestamp'])
+                    # A kill without a position gets empty x and y, as in the
+                    # Mongo formatter.
+                    position = event.get('position')
+                    kill['x'].append(position['x'] if position else 0)
+                    kill['y'].append(position['y'] if position else 0)
+                    kill['hasPosition'].append(position is not None)
+                elif event_type == LEVEL_UP:
+                    level_up['match'].append(index)
+                    level_up['participantId'].append(event.get('participantId', -1))
+                    level_up['timestamp'].append(event['timestamp'])
+                    level_up['skillSlot'].append(event['skillSlot'])
+                    level_up['levelUpType'].append(
+                        self.level_up_types.code(event['levelUpType']))
+
+    def arrays(self):
+        def to_numpy(columns):
+            return {name: np.frombuffer(column, dtype=np.int64) for name, column in columns.items()}
+        return {'match_id': np.frombuffer(self.match_id, dtype=np.int64),
+                'map_id': np.frombuffer(self.map_id, dtype=np.int64),
+                'participant': to_numpy(self.participant),
+                'team_match': np.frombuffer(self.team_match, dtype=np.int64),
+                'team_fields': self.team_fields,
+                'kill': to_numpy(self.kill),
+                'level_up': to_numpy(self.level_up),
+                'tiers': self.tiers.values,
+                'level_up_types': self.level_up_types.values}
+
+
+def read_matches(data_dir, n_files):
+    to_mongo = _load_to_mongo()
+    columns = MatchColumns()
+    for n in range(1, n_files + 1):
+        with open(os.path.join(data_dir, 'matches{0}.json'.format(n)), encoding='utf-8') as f:
+            for match in to_mongo.iter_array(f):
+                columns.add(match)
+    return columns.arrays()
+
+
+# Groups of keys in key order: the distinct keys, the index of each key's
+# first row and each row's group.
+def _groups(keys):
+    unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return unique, first, inverse.ravel()
+
+
+# column's values as a list, with None (an empty csv field) where has is 0.
+def _with_missing(column, has):
+    values = column.tolist()
+    for index in np.flatnonzero(has == 0).tolist():
+        values[index] = None
+    return values
+
+
+def _champ_popularity(cols, module, mapping):
+    participant = cols['participant']
+    champions, _, group = _groups(participant['championId'])
+    tiers = cols['tiers']
+    counts = np.zeros((len(champions), len(tiers) + 1), dtype=np.int64)
+    np.add.at(counts, (group, participant['tier']), 1)
+    tier_columns = [counts[:, tiers.index(tier)] if tier in tiers else counts[:, -1]
+                    for tier in module.TIER_COUNTS.values()]
+    return ([[mapping[champion] for champion in champions.tolist()]] +
+            [column.tolist() for column in tier_columns] +
+            [np.bincount(group, minlength=len(champions)).tolist()])
+
+
+def _death_location(cols, module):
+    kill = cols['kill']
+    keep = cols['map_id'][kill['match']] == DEATH_MAP_ID
+    return [_with_missing(kill['x'][keep], kill['hasPosition'][keep]),
+            _with_missing(kill['y'][keep], kill['hasPosition'][keep]),
+            (kill['timestamp'][keep] / 1000).tolist()]
+
+
+def _firstBlood_times(cols, module):
+    kill = cols['kill']
+    match_ids, _, group = _groups(cols['match_id'][kill['match']])
+    firsts = np.full(len(match_ids), np.iinfo(np.int64).max)
+    np.minimum.at(firsts, group, kill['timestamp'])
+    return [match_ids.tolist(), (firsts / 1000).tolist()]
+
+
+# Averages are taken like Mongo's $avg: the sum is exactly rounded (Mongo
+# sums doubles in double-double precision), then divided by the count.
+def _kda_performance(cols, module):
+    participant = cols['participant']
+    keep = participant['hasIdentity'].astype(bool)
+    kills, deaths, assists = (participant[name][keep] for name in ('kills', 'deaths', 'assists'))
+    summoners, first, group = _groups(participant['summonerId'][keep])
+    count = np.bincount(group, minlength=len(summoners))
+    total = kills + assists + deaths
+    performance = np.where(total == 0, 0.0, (kills + assists - deaths) / np.where(total, total, 1))
+    order = np.argsort(group, kind='stable')
+    bounds = np.flatnonzero(np.diff(group[order])) + 1
+    performance_sums = [math.fsum(part) for part in np.split(performance[order].tolist(), bounds)]
+    tiers = np.array(cols['tiers'], dtype=object)
+    return [summoners.tolist(),
+            tiers[participant['tier'][keep][first]].tolist(),
+            (np.bincount(group, kills, len(summoners)) / count).tolist(),
+            (np.bincount(group, deaths, len(summoners)) / count).tolist(),
+            (np.bincount(group, assists, len(summoners)) / count).tolist(),
+            (np.array(performance_sums) / count).tolist()]
+
+
+# Each level up is joined to its participant through the sorted
+# (match, participantId) keys; lvlAchieved is 1 plus its number among its
+# participant's level ups in the match.
+def _levelUp_times(cols, module):
+    participant, level_up = cols['participant'], cols['level_up']
+    width = max(participant['participantId'].max(initial=0),
+                level_up['participantId'].max(initial=0)) + 2
+    participant_keys = participant['match'] * width + participant['participantId']
+    sorted_rows = np.argsort(participant_keys, kind='stable')
+    sorted_keys = participant_keys[sorted_rows]
+    keys = level_up['match'] * width + level_up['participantId']
+    position = np.minimum(np.searchsorted(sorted_keys, keys), max(len(sorted_keys) - 1, 0))
+    keep = (level_up['participantId'] >= 0) & (sorted_keys[position] == keys)
+    rows = sorted_rows[position[keep]]
+    keys = keys[keep]
+    order = np.argsort(keys, kind='stable')
+    starts = np.r_[0, np.flatnonzero(np.diff(keys[order])) + 1]
+    number = np.empty(len(keys), dtype=np.int64)
+    number[order] = np.arange(len(keys)) - np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+    tiers = np.array(cols['tiers'], dtype=object)
+    level_up_types = np.array(cols['level_up_types'], dtype=object)
+    return [cols['match_id'][level_up['match'][keep]].tolist(),
+            level_up['participantId'][keep].tolist(),
+            tiers[participant['tier'][rows]].tolist(),
+            (level_up['timestamp'][keep] / 1000).tolist(),
+            (number + 2).tolist(),
+            participant['championId'][rows].tolist(),
+            level_up['skillSlot'][keep].tolist(),
+            level_up_types[level_up['levelUpType'][keep]].tolist()]
+
+
+def _match_teams(cols, module):
+    return ([cols['match_id'][cols['team_match']].tolist()] +
+            [cols['team_fields'][field] for field in module.TEAM_FIELDS])
+
+
+OUTPUTS = OrderedDict([
+    ('champ_popularity', _champ_popularity),
+    ('death_location', _death_location),
+    ('firstBlood_times', _firstBlood_times),
+    ('kda_performance', _kda_performance),
+    ('levelUp_times', _levelUp_times),
+    ('match_teams', _match_teams)
+])
+
+
+# The champion id -> name mapping champ_popularity uses, from its cache in
+# misc or else from the seed champion.json.
+def _champ_mapping(module, data_dir):
+    path = module.CHAMP_MAPPING_PATH
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return {int(key): name for key, name in json.load(f).items()}
+    with open(os.path.join(data_dir, 'champion.json'), encoding='utf-8') as f:
+        return {int(champ['key']): champ['name'] for champ in json.load(f)['data'].values()}
+
+
+# Writes the csv files of names (all by default) from matches1.json ...
+# matchesN.json in data_dir; returns {name: rows written}.
+def run_columnar(data_dir, n_files, names=None, csv_dir=None):
+    names = list(names or OUTPUTS)
+    start = time.perf_counter()
+    cols = read_matches(data_dir, n_files)
+    print('read {0} matches in {1:.1f} s'.format(len(cols['match_id']),
+                                                 time.perf_counter() - start))
+    rows = OrderedDict()
+    for name in names:
+        step = time.perf_counter()
+        module = load_formatter(name)
+        if name == 'champ_popularity':
+            columns = OUTPUTS[name](cols, module, _champ_mapping(module, data_dir))
+        else:
+            columns = OUTPUTS[name](cols, module)
+        if csv_dir is None:
+            csv_out = module.CSV_PATH + module.CSV_NAME
+        else:
+            csv_out = os.path.join(csv_dir, module.CSV_NAME)
+        rows[name] = write_csv(zip(*columns), module.CSV_FIELDS, csv_out)
+        print('{0}: {1} rows in {2:.1f} s'.format(name, rows[name], time.perf_counter() - step))
+    print('{0} outputs in {1:.1f} s'.format(len(names), time.perf_counter() - start))
+    return rows
+
+
+if __name__ == '__main__':
+    to_mongo = _load_to_mongo()
+    parser = argparse.ArgumentParser(
+        description='Compute the csv files in datasets-csv from the seed json files, '
+                    'without MongoDB.')
+    parser.add_argument('outputs', nargs='*', metavar='OUTPUT',
+                        help='outputs to compute, all by default: ' + ', '.join(FORMATTERS))
+    parser.add_argument('--data-dir', default=to_mongo.DATA_DIR)
+    parser.add_argument('--files', type=int, default=to_mongo.N_FILES, metavar='N',
+                        help='read matches1.json ... matchesN.json')
+    parser.add_argument('--csv-dir', help='write the csv files here instead of CSV_PATH')
+    args = parser.parse_args()
+    unknown = [name for name in args.outputs if name not in OUTPUTS]
+    if unknown:
+        parser.error('unknown outputs: ' + ', '.join(unknown))
+    run_columnar(args.data_dir, args.files, args.outputs, args.csv_dir)
+    sys.exit(0)
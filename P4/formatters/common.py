@@ -0,0 +1,80 @@
+import csv
+import pymongo
+
+# Connections the client may open at once, one per formatter run alongside.
+POOL_SIZE = 6
+# Documents per cursor batch; each batch is written out before the next
+# one is fetched.
+BATCH_SIZE = 1000
+
+
+def get_client(pool_size=POOL_SIZE):
+    try:
+        ret_client = pymongo.MongoClient('localhost', 27017, maxPoolSize=pool_size)
+    except pymongo.errors.ConnectionFailure as e:
+        print(e)
+    else:
+        return ret_client
+
+
+# Writes fields as the header, then the rows (tuples in that order) as they
+# come, so memory does not grow with the number of rows. With append, the
+# rows are added to the end of csv_out instead, under its header if it
+# already has one. Returns how many rows were written.
+def write_csv(rows, fields, csv_out, append=False):
+    count = 0
+    with open(csv_out, 'a' if append else 'w', newline='', encoding='utf-8') as output_csv:
+        writer = csv.writer(output_csv)
+        if output_csv.tell() == 0:
+            writer.writerow(fields)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+# Stages counting the documents per (row, column) pair in one pass, then
+# reshaping the counts into one document per row: row_name holds the row
+# value, each field of columns (field -> column value) its count, and
+# 'total' the row's count, with the rows sorted by value. Only one count
+# per pair is ever kept, so no stage holds more than rows * columns
+# documents.
+def pivot_count_stages(row, column, columns, row_name):
+    return [
+        {'$group': {
+            '_id': {'row': row, 'column': column},
+            'count': {'$sum': 1}
+        }},
+        {'$group': dict(
+            [('_id', '$_id.row')] +
+            [(field, {'$sum': {'$cond': [{'$eq': ['$_id.column', value]}, '$count', 0]}})
+             for field, value in columns.items()] +
+            [('total', {'$sum': '$count'})]
+        )},
+        {'$sort': {'_id': 1}},
+        {'$project': dict(
+            [('_id', False), (row_name, '$_id')] +
+            [(field, True) for field in columns] +
+            [('total', True)]
+        )}
+    ]
+
+
+# Stages limiting a pipeline on matches or events to the matches in
+# match_ids; none when match_ids is None, for all of them.
+def match_ids_stages(match_ids):
+    if match_ids is None:
+        return []
+    return [{'$match': {'matchId': {'$in': match_ids}}}]
+
+
+# Stage keeping running sums in collection into: each document's fields
+# are added to those of the document with the same _id there, or it is
+# inserted if there is none. Its other fields keep their first value.
+def merge_sums_stage(into, fields):
+    return {'$merge': {
+        'into': into,
+        'whenMatched': [{'$set': {field: {'$add': ['$' + field, '$$new.' + field]}
+                                  for field in fields}}],
+        'whenNotMatched': 'insert'
+    }}
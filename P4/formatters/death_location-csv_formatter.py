@@ -1,62 +1,122 @@
-import csv
-import pymongo
-
-from collections import OrderedDict
-
-CSV_PATH = 'Q:\\Program Files\\Programming Applications\\' \
-           'Projects\\Udacity\\Data Analysis Nanodegree\\P4\\datasets-csv\\'
-CSV_NAME = 'death_location.csv'
-# Note that we divide firstBlood_timestamp by 1000 so that
-# the timestamp values are in terms of seconds instead of milliseconds.
-# Also note that mapId 11 corresponds to Summoner's Rift.
-QUERY = [
-    {'$match': {'mapId': 11}},
-    {'$unwind': '$timeline.frames'},
-    {'$unwind': '$timeline.frames.events'},
-    {'$match': {'timeline.frames.events.eventType': 'CHAMPION_KILL'}},
-    {'$project': {
-        '_id': False,
-        'x': '$timeline.frames.events.position.x',
-        'y': '$timeline.frames.events.position.y',
-        'timestamp': {'$divide': ['$timeline.frames.events.timestamp', 1000]}
-    }}
-]
-
-
-def _get_client():
-    try:
-        ret_client = pymongo.MongoClient('localhost', 27017)
-    except pymongo.errors.ConnectionFailure as e:
-        print(e)
-    else:
-        return ret_client
-
-
-def _tidier(mongo_query):
-    ret_list = []
-    mongo_list = list(mongo_query)
-    for dict_ in mongo_list:
-        tmp = [
-            ('x', dict_['x']),
-            ('y', dict_['y']),
-            ('timestamp', dict_['timestamp'])
-        ]
-        ret_list.append(OrderedDict(tmp))
-    return ret_list
-
-
-def format_to_csv(query_results, csv_out=CSV_PATH+CSV_NAME):
-    to_csv = _tidier(query_results)
-    keys = to_csv[0].keys()
-    with open(csv_out, 'w+', newline='', encoding='utf-8') as output_csv:
-        dict_writer = csv.DictWriter(output_csv, keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(to_csv)
-
-
-if __name__ == '__main__':
-    client = _get_client()
-    db = client.seed_lol
-    query = db.matches.aggregate(QUERY)
-    format_to_csv(query_results=query)
-    client.close()
+import argparse
+import numpy as np
+
+from common import BATCH_SIZE, get_client, match_ids_stages, write_csv
+from events import ensure_events
+
+CSV_PATH = 'Q:\\Program Files\\Programming Applications\\' \
+           'Projects\\Udacity\\Data Analysis Nanodegree\\P4\\datasets-csv\\'
+CSV_NAME = 'death_location.csv'
+CSV_FIELDS = ['x', 'y', 'timestamp']
+# Note that we divide timestamp by 1000 so that the timestamp values
+# are in terms of seconds instead of milliseconds.
+# Also note that mapId 11 corresponds to Summoner's Rift.
+# The query runs on the flattened events collection (see events.py).
+QUERY = [
+    {'$match': {'eventType': 'CHAMPION_KILL', 'mapId': 11}},
+    {'$project': {
+        '_id': False,
+        'x': '$position.x',
+        'y': '$position.y',
+        'timestamp': {'$divide': ['$timestamp', 1000]}
+    }}
+]
+
+CUBE_NAME = 'death_location_cube.npz'
+# The cube counts the kills per x bin, y bin and time bucket, in place of
+# the rows: the x and y bins split Summoner's Rift's bounds evenly (125 is
+# the hexbin gridsize the plots use) and the time buckets are
+# TIME_BUCKET seconds long. Kills outside the bounds count in the edge bins.
+MAP_MIN = (-120, -120)
+MAP_MAX = (14870, 14980)
+X_BINS = 125
+Y_BINS = 125
+TIME_BUCKET = 60
+
+
+# Expression of the bin, out of bins between low and high, of field.
+def _bin(field, low, high, bins):
+    return {'$min': [bins - 1, {'$max': [0, {
+        '$floor': {'$divide': [{'$subtract': [field, low]}, (high - low) / bins]}
+    }]}]}
+
+
+# Counts the kills per (x bin, y bin, time bucket) on the server, so only
+# the non-empty cells come back. Kills without a position have no bin and
+# are left out.
+def cube_query(x_bins=X_BINS, y_bins=Y_BINS, time_bucket=TIME_BUCKET):
+    return [
+        QUERY[0],
+        {'$match': {'position': {'$exists': True}}},
+        {'$group': {
+            '_id': {
+                'x': _bin('$position.x', MAP_MIN[0], MAP_MAX[0], x_bins),
+                'y': _bin('$position.y', MAP_MIN[1], MAP_MAX[1], y_bins),
+                't': {'$floor': {'$divide': ['$timestamp', time_bucket * 1000]}}
+            },
+            'count': {'$sum': 1}
+        }}
+    ]
+
+
+def _tidier(mongo_query):
+    for dict_ in mongo_query:
+        yield dict_.get('x'), dict_.get('y'), dict_['timestamp']
+
+
+def format_to_csv(query_results, csv_out=CSV_PATH+CSV_NAME, append=False):
+    return write_csv(_tidier(query_results), CSV_FIELDS, csv_out, append)
+
+
+def run(db, csv_out=CSV_PATH + CSV_NAME, batch_size=BATCH_SIZE, ensure=True):
+    if ensure:
+        ensure_events(db)
+    query = db.events.aggregate(QUERY, batchSize=batch_size)
+    return format_to_csv(query_results=query, csv_out=csv_out)
+
+
+# Appends the kills of the matches in match_ids alone; fresh starts the csv
+# over instead.
+def run_incremental(db, match_ids, fresh, csv_out=CSV_PATH + CSV_NAME, batch_size=BATCH_SIZE,
+                    ensure=True):
+    if ensure:
+        ensure_events(db)
+    query = db.events.aggregate(match_ids_stages(match_ids) + QUERY,
+                                batchSize=batch_size)
+    return format_to_csv(query_results=query, csv_out=csv_out, append=not fresh)
+
+
+# Writes the cube as counts[x bin, y bin, time bucket] with its x_edges,
+# y_edges and t_edges (in seconds, up to the bucket of the last kill) to
+# a compressed npz file; returns the number of kills counted.
+def run_cube(db, cube_out=CSV_PATH + CUBE_NAME, x_bins=X_BINS, y_bins=Y_BINS,
+             time_bucket=TIME_BUCKET):
+    ensure_events(db)
+    cells = list(db.events.aggregate(cube_query(x_bins, y_bins, time_bucket)))
+    t_bins = int(max([cell['_id']['t'] for cell in cells], default=-1)) + 1
+    counts = np.zeros((x_bins, y_bins, t_bins), dtype=np.uint32)
+    for cell in cells:
+        counts[int(cell['_id']['x']), int(cell['_id']['y']), int(cell['_id']['t'])] = cell['count']
+    np.savez_compressed(cube_out, counts=counts,
+                        x_edges=np.linspace(MAP_MIN[0], MAP_MAX[0], x_bins + 1),
+                        y_edges=np.linspace(MAP_MIN[1], MAP_MAX[1], y_bins + 1),
+                        t_edges=np.arange(t_bins + 1) * float(time_bucket))
+    return int(counts.sum())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write death_location.csv, or the cube of '
+                                                 'death counts with --cube.')
+    parser.add_argument('--cube', action='store_true',
+                        help='write ' + CUBE_NAME + ' instead of the csv')
+    parser.add_argument('--x-bins', type=int, default=X_BINS)
+    parser.add_argument('--y-bins', type=int, default=Y_BINS)
+    parser.add_argument('--time-bucket', type=float, default=TIME_BUCKET, metavar='SECONDS')
+    args = parser.parse_args()
+    client = get_client()
+    if args.cube:
+        run_cube(client.seed_lol, x_bins=args.x_bins, y_bins=args.y_bins,
+                 time_bucket=args.time_bucket)
+    else:
+        run(client.seed_lol)
+    client.close()
@@ -0,0 +1,119 @@
+import pymongo
+
+from common import get_client
+from watermark import WATERMARKS, new_match_ids, record_watermark, reset_watermark
+
+# Flattens every timeline event of every match into its own document in
+# the events collection, for the formatters that only look at events, with
+# the indexes of its frame and of the event within it. The champion and
+# tier of the event's participant, if it has one, are copied in too, so
+# that no formatter has to join back to matches.
+QUERY = [
+    {'$project': {
+        '_id': False,
+        'matchId': True,
+        'mapId': True,
+        'timeline.frames.events': True,
+        'participants.participantId': True,
+        'participants.championId': True,
+        'participants.highestAchievedSeasonTier': True
+    }},
+    {'$unwind': {'path': '$timeline.frames', 'includeArrayIndex': 'frameIndex'}},
+    {'$unwind': {'path': '$timeline.frames.events', 'includeArrayIndex': 'eventIndex'}},
+    {'$project': {
+        'matchId': True,
+        'mapId': True,
+        'frameIndex': True,
+        'eventIndex': True,
+        'eventType': '$timeline.frames.events.eventType',
+        'participantId': '$timeline.frames.events.participantId',
+        'timestamp': '$timeline.frames.events.timestamp',
+        'position': '$timeline.frames.events.position',
+        'skillSlot': '$timeline.frames.events.skillSlot',
+        'levelUpType': '$timeline.frames.events.levelUpType',
+        'participant': {
+            '$arrayElemAt': [{
+                '$filter': {
+                    'input': '$participants',
+                    'as': 'participant',
+                    'cond': {'$eq': ['$$participant.participantId',
+                                     '$timeline.frames.events.participantId']}
+                }
+            }, 0]
+        }
+    }},
+    {'$addFields': {
+        'championId': '$participant.championId',
+        'highestAchievedSeasonTier': '$participant.highestAchievedSeasonTier'
+    }},
+    {'$project': {'participant': False}},
+    {'$out': 'events'}
+]
+INDEXES = ['eventType', 'matchId']
+# Identifies an event; unique, so that adding a match's events again
+# replaces them instead of adding them twice.
+EVENT_KEY = ['matchId', 'frameIndex', 'eventIndex']
+# The watermark (see watermark.py) of the matches whose events are all in
+# db.events. A match is only marked once its $merge has finished, so one
+# that failed part way is merged again by the next update.
+WATERMARK = 'events'
+
+
+def _create_indexes(db):
+    db.events.create_index([(key, pymongo.ASCENDING) for key in EVENT_KEY], unique=True)
+    for key in INDEXES:
+        db.events.create_index([(key, pymongo.ASCENDING)])
+
+
+# Rebuilds db.events from db.matches in one pass on the server. Given
+# match_ids, only the events of those matches are merged into it instead.
+def build_events(db, match_ids=None):
+    if match_ids is None:
+        match_ids = db.matches.distinct('matchId')
+        db.matches.aggregate(QUERY, allowDiskUse=True)
+        _create_indexes(db)
+        reset_watermark(db, WATERMARK)
+    else:
+        _create_indexes(db)
+        db.matches.aggregate([{'$match': {'matchId': {'$in': match_ids}}}] + QUERY[:-1] + [
+            {'$merge': {
+                'into': 'events',
+                'on': EVENT_KEY,
+                'whenMatched': 'replace',
+                'whenNotMatched': 'insert'
+            }}
+        ], allowDiskUse=True)
+    record_watermark(db, WATERMARK, match_ids)
+
+
+# Adds the events of the matches loaded since db.events was last brought
+# up to date and removes those of matches no longer in db.matches, so
+# loading one more matchesN.json does not rebuild it all.
+def update_events(db):
+    match_ids = set(db.matches.distinct('matchId'))
+    stale = list(set(db[WATERMARKS].distinct('matchId', {'output': WATERMARK})) - match_ids)
+    if stale:
+        db.events.delete_many({'matchId': {'$in': stale}})
+        db[WATERMARKS].delete_many({'output': WATERMARK, 'matchId': {'$in': stale}})
+    new = new_match_ids(db, WATERMARK)
+    if new:
+        build_events(db, new)
+
+
+# Builds db.events unless it is already there, else brings it up to date
+# with db.matches. It is built in full as well when its events lack their
+# eventIndex or no match is recorded as built, since update_events can only
+# add to a collection whose events have their key and whose matches are
+# recorded.
+def ensure_events(db):
+    if db.events.find_one({'eventIndex': {'$exists': True}}) is None or \
+            db[WATERMARKS].find_one({'output': WATERMARK}) is None:
+        build_events(db)
+    else:
+        update_events(db)
+
+
+if __name__ == '__main__':
+    client = get_client()
+    build_events(client.seed_lol)
+    client.close()
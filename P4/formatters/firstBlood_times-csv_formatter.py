@@ -1,48 +1,52 @@
-import csv
-import pymongo
-
-CSV_PATH = 'Q:\\Program Files\\Programming Applications\\' \
-           'Projects\\Udacity\\Data Analysis Nanodegree\\P4\\datasets-csv\\'
-CSV_NAME = 'firstBlood_times.csv'
-# Note that we divide firstBlood_timestamp by 1000 so that
-# the timestamp values are in terms of seconds instead of milliseconds.
-QUERY = [
-    {'$unwind': '$timeline.frames'},
-    {'$unwind': '$timeline.frames.events'},
-    {'$match': {'timeline.frames.events.eventType': 'CHAMPION_KILL'}},
-    {'$group': {
-        '_id': '$matchId',
-        'firstBlood_timestamp': {'$min': '$timeline.frames.events.timestamp'}
-    }},
-    {'$project': {
-        '_id': False,
-        'matchId': '$_id',
-        'firstBlood_timestamp': {'$divide': ['$firstBlood_timestamp', 1000]}
-    }}
-]
-
-
-def _get_client():
-    try:
-        ret_client = pymongo.MongoClient('localhost', 27017)
-    except pymongo.errors.ConnectionFailure as e:
-        print(e)
-    else:
-        return ret_client
-
-
-def format_to_csv(query_results, csv_out=CSV_PATH+CSV_NAME):
-    to_csv = list(query_results)
-    keys = to_csv[0].keys()
-    with open(csv_out, 'w+', newline='', encoding='utf-8') as output_csv:
-        dict_writer = csv.DictWriter(output_csv, keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(to_csv)
-
-
-if __name__ == '__main__':
-    client = _get_client()
-    db = client.seed_lol
-    query = db.matches.aggregate(QUERY)
-    format_to_csv(query_results=query)
-    client.close()
+from common import BATCH_SIZE, get_client, match_ids_stages, write_csv
+from events import ensure_events
+
+CSV_PATH = 'Q:\\Program Files\\Programming Applications\\' \
+           'Projects\\Udacity\\Data Analysis Nanodegree\\P4\\datasets-csv\\'
+CSV_NAME = 'firstBlood_times.csv'
+CSV_FIELDS = ['matchId', 'firstBlood_timestamp']
+# Note that we divide firstBlood_timestamp by 1000 so that
+# the timestamp values are in terms of seconds instead of milliseconds.
+# The query runs on the flattened events collection (see events.py).
+QUERY = [
+    {'$match': {'eventType': 'CHAMPION_KILL'}},
+    {'$group': {
+        '_id': '$matchId',
+        'firstBlood_timestamp': {'$min': '$timestamp'}
+    }},
+    {'$sort': {'_id': 1}},
+    {'$project': {
+        '_id': False,
+        'matchId': '$_id',
+        'firstBlood_timestamp': {'$divide': ['$firstBlood_timestamp', 1000]}
+    }}
+]
+
+
+def format_to_csv(query_results, csv_out=CSV_PATH+CSV_NAME, append=False):
+    rows = ((dict_['matchId'], dict_['firstBlood_timestamp']) for dict_ in query_results)
+    return write_csv(rows, CSV_FIELDS, csv_out, append)
+
+
+def run(db, csv_out=CSV_PATH + CSV_NAME, batch_size=BATCH_SIZE, ensure=True):
+    if ensure:
+        ensure_events(db)
+    query = db.events.aggregate(QUERY, batchSize=batch_size)
+    return format_to_csv(query_results=query, csv_out=csv_out)
+
+
+# Appends the first blood of each match in match_ids; fresh starts the csv
+# over instead.
+def run_incremental(db, match_ids, fresh, csv_out=CSV_PATH + CSV_NAME, batch_size=BATCH_SIZE,
+                    ensure=True):
+    if ensure:
+        ensure_events(db)
+    query = db.events.aggregate(match_ids_stages(match_ids) + QUERY,
+                                batchSize=batch_size)
+    return format_to_csv(query_results=query, csv_out=csv_out, append=not fresh)
+
+
+if __name__ == '__main__':
+    client = get_client()
+    run(client.seed_lol)
+    client.close()
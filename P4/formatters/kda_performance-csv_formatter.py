@@ -1,103 +1,142 @@
-import csv
-import pymongo
-
-from collections import OrderedDict
-
-CSV_PATH = 'Q:\\Program Files\\Programming Applications\\' \
-           'Projects\\Udacity\\Data Analysis Nanodegree\\P4\\datasets-csv\\'
-CSV_NAME = 'kda_performance.csv'
-QUERY = [
-    {'$unwind': '$participantIdentities'},
-    {'$unwind': '$participants'},
-    {'$redact': {
-        '$cond': [
-            {'$eq': ['$participantIdentities.participantId',
-                     '$participants.participantId']},
-            '$$KEEP',
-            '$$PRUNE'
-        ]
-    }},
-    {'$group': {
-        '_id': '$participantIdentities.player.summonerId',
-        'avg kills': {'$avg': '$participants.stats.kills'},
-        'avg deaths': {'$avg': '$participants.stats.deaths'},
-        'avg assists': {'$avg': '$participants.stats.assists'},
-        'avg performance': {
-            '$avg': {
-                '$cond': [
-                    {'$and': [{'$eq': ['$participants.stats.kills', 0]},
-                              {'$eq': ['$participants.stats.assists', 0]},
-                              {'$eq': ['$participants.stats.deaths', 0]}]},
-                    0,
-                    {'$divide': [
-                        {'$subtract': [
-                            {'$add': ['$participants.stats.kills',
-                                      '$participants.stats.assists']},
-                            '$participants.stats.deaths'
-                        ]},
-                        {'$add': [
-                            '$participants.stats.kills',
-                            '$participants.stats.assists',
-                            '$participants.stats.deaths'
-                        ]}
-                    ]}
-                ]
-            }
-        },
-        'highestAchievedSeasonTier': {
-            '$first': '$participants.highestAchievedSeasonTier'
-        }
-    }},
-    {'$project': {
-        '_id': False,
-        'summonerId': '$_id',
-        'participants.highestAchievedSeasonTier': True,
-        'avg kills': True,
-        'avg deaths': True,
-        'avg assists': True,
-        'avg performance': True,
-        'highestAchievedSeasonTier': True
-    }}
-]
-
-
-def _get_client():
-    try:
-        ret_client = pymongo.MongoClient('localhost', 27017)
-    except pymongo.errors.ConnectionFailure as e:
-        print(e)
-    else:
-        return ret_client
-
-
-def _tidier(mongo_query):
-    ret_list = []
-    mongo_list = list(mongo_query)
-    for dict_ in mongo_list:
-        tmp = [
-            ('summonerId', dict_['summonerId']),
-            ('highestAchievedSeasonTier', dict_['highestAchievedSeasonTier']),
-            ('avg kills', dict_['avg kills']),
-            ('avg deaths', dict_['avg deaths']),
-            ('avg assists', dict_['avg assists']),
-            ('avg performance', dict_['avg performance'])
-        ]
-        ret_list.append(OrderedDict(tmp))
-    return ret_list
-
-
-def format_to_csv(query_results, csv_out=CSV_PATH+CSV_NAME):
-    to_csv = _tidier(query_results)
-    keys = to_csv[0].keys()
-    with open(csv_out, 'w+', newline='', encoding='utf-8') as output_csv:
-        dict_writer = csv.DictWriter(output_csv, keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(to_csv)
-
-
-if __name__ == '__main__':
-    client = _get_client()
-    db = client.seed_lol
-    query = db.matches.aggregate(QUERY)
-    format_to_csv(query_results=query)
-    client.close()
+from common import BATCH_SIZE, get_client, match_ids_stages, merge_sums_stage, write_csv
+
+CSV_PATH = 'Q:\\Program Files\\Programming Applications\\' \
+           'Projects\\Udacity\\Data Analysis Nanodegree\\P4\\datasets-csv\\'
+CSV_NAME = 'kda_performance.csv'
+CSV_FIELDS = ['summonerId', 'highestAchievedSeasonTier', 'avg kills', 'avg deaths',
+              'avg assists', 'avg performance']
+# A game's performance: (kills + assists - deaths) / (kills + assists +
+# deaths), or 0 for a game without any.
+PERFORMANCE = {
+    '$cond': [
+        {'$and': [{'$eq': ['$participants.stats.kills', 0]},
+                  {'$eq': ['$participants.stats.assists', 0]},
+                  {'$eq': ['$participants.stats.deaths', 0]}]},
+        0,
+        {'$divide': [
+            {'$subtract': [
+                {'$add': ['$participants.stats.kills', '$participants.stats.assists']},
+                '$participants.stats.deaths'
+            ]},
+            {'$add': [
+                '$participants.stats.kills',
+                '$participants.stats.assists',
+                '$participants.stats.deaths'
+            ]}
+        ]}
+    ]
+}
+# Each participant is joined to its identity by position: identityIds and
+# summonerIds are the identities' participantIds and summonerIds in the
+# same order, so the participant's summonerId is at the index of its
+# participantId in identityIds. That unwinds 10 documents per match
+# instead of pairing all 10 x 10 and keeping 10. Participants without an
+# identity are left out, as before.
+JOIN_STAGES = [
+    {'$project': {
+        '_id': False,
+        'participants.participantId': True,
+        'participants.highestAchievedSeasonTier': True,
+        'participants.stats.kills': True,
+        'participants.stats.deaths': True,
+        'participants.stats.assists': True,
+        'identityIds': '$participantIdentities.participantId',
+        'summonerIds': {
+            '$map': {
+                'input': '$participantIdentities',
+                'as': 'identity',
+                'in': '$$identity.player.summonerId'
+            }
+        }
+    }},
+    {'$unwind': '$participants'},
+    {'$addFields': {
+        'identity': {'$indexOfArray': ['$identityIds', '$participants.participantId']}
+    }},
+    {'$match': {'identity': {'$gte': 0}}}
+]
+QUERY = JOIN_STAGES + [
+    {'$group': {
+        '_id': {'$arrayElemAt': ['$summonerIds', '$identity']},
+        'avg kills': {'$avg': '$participants.stats.kills'},
+        'avg deaths': {'$avg': '$participants.stats.deaths'},
+        'avg assists': {'$avg': '$participants.stats.assists'},
+        'avg performance': {'$avg': PERFORMANCE},
+        'highestAchievedSeasonTier': {
+            '$first': '$participants.highestAchievedSeasonTier'
+        }
+    }},
+    {'$sort': {'_id': 1}},
+    {'$project': {
+        '_id': False,
+        'summonerId': '$_id',
+        'avg kills': True,
+        'avg deaths': True,
+        'avg assists': True,
+        'avg performance': True,
+        'highestAchievedSeasonTier': True
+    }}
+]
+# Incremental refreshes keep each summoner's sums and number of games in
+# TOTALS (with the summonerId as _id) and add those of new matches to
+# them; the averages are taken from the sums when the csv is rewritten.
+# The tier is the one of the summoner's first game, as $first takes.
+TOTALS = 'kda_performance_totals'
+TOTALS_SUMS = ['kills', 'deaths', 'assists', 'performance', 'games']
+TOTALS_QUERY = JOIN_STAGES + [
+    {'$group': {
+        '_id': {'$arrayElemAt': ['$summonerIds', '$identity']},
+        'kills': {'$sum': '$participants.stats.kills'},
+        'deaths': {'$sum': '$participants.stats.deaths'},
+        'assists': {'$sum': '$participants.stats.assists'},
+        'performance': {'$sum': PERFORMANCE},
+        'games': {'$sum': 1},
+        'highestAchievedSeasonTier': {
+            '$first': '$participants.highestAchievedSeasonTier'
+        }
+    }},
+    merge_sums_stage(TOTALS, TOTALS_SUMS)
+]
+TOTALS_CSV_QUERY = [
+    {'$sort': {'_id': 1}},
+    {'$project': {
+        '_id': False,
+        'summonerId': '$_id',
+        'avg kills': {'$divide': ['$kills', '$games']},
+        'avg deaths': {'$divide': ['$deaths', '$games']},
+        'avg assists': {'$divide': ['$assists', '$games']},
+        'avg performance': {'$divide': ['$performance', '$games']},
+        'highestAchievedSeasonTier': True
+    }}
+]
+
+
+def _tidier(mongo_query):
+    for dict_ in mongo_query:
+        yield (dict_['summonerId'], dict_['highestAchievedSeasonTier'], dict_['avg kills'],
+               dict_['avg deaths'], dict_['avg assists'], dict_['avg performance'])
+
+
+def format_to_csv(query_results, csv_out=CSV_PATH+CSV_NAME):
+    return write_csv(_tidier(query_results), CSV_FIELDS, csv_out)
+
+
+def run(db, csv_out=CSV_PATH + CSV_NAME, batch_size=BATCH_SIZE):
+    query = db.matches.aggregate(QUERY, batchSize=batch_size)
+    return format_to_csv(query_results=query, csv_out=csv_out)
+
+
+# Adds the sums of the matches in match_ids to TOTALS and rewrites the csv
+# from it; fresh starts the sums over.
+def run_incremental(db, match_ids, fresh, csv_out=CSV_PATH + CSV_NAME, batch_size=BATCH_SIZE):
+    if fresh:
+        db[TOTALS].drop()
+    db.matches.aggregate(match_ids_stages(match_ids) + TOTALS_QUERY)
+    query = db[TOTALS].aggregate(TOTALS_CSV_QUERY, batchSize=batch_size)
+    return format_to_csv(query_results=query, csv_out=csv_out)
+
+
+if __name__ == '__main__':
+    client = get_client()
+    run(client.seed_lol)
+    client.close()
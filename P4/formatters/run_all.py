@@ -0,0 +1,123 @@
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import pymongo
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from common import get_client
+from events import build_events, ensure_events
+from watermark import refresh, reset_watermark
+
+FORMATTER_DIR = os.path.dirname(os.path.abspath(__file__))
+# Output name -> formatter script; every script has a run(db, csv_out)
+# that writes its csv and returns the number of rows, and a
+# run_incremental(db, match_ids, fresh, csv_out) that brings it up to date
+# with the matches in match_ids (all of them when None).
+FORMATTERS = OrderedDict((name, name + '-csv_formatter.py') for name in [
+    'champ_popularity',
+    'death_location',
+    'firstBlood_times',
+    'kda_performance',
+    'levelUp_times',
+    'match_teams'
+])
+# Outputs queried from the events collection (see events.py). Their run
+# and run_incremental take ensure=False to skip bringing the collection up
+# to date, which run_all does once for all of them beforehand.
+EVENT_OUTPUTS = ['death_location', 'firstBlood_times', 'levelUp_times']
+
+
+# The scripts' names are not valid module names, so they are loaded from
+# their files.
+def load_formatter(name):
+    spec = importlib.util.spec_from_file_location(name + '_formatter',
+                                                  os.path.join(FORMATTER_DIR, FORMATTERS[name]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Returns (name, status, rows, seconds). timeout bounds the formatter's
+# Mongo operations together, not the csv writing. incremental only runs it
+# on the matches loaded since its last refresh (see watermark.py).
+def _run_formatter(db, name, module, csv_out, timeout, incremental=False):
+    options = {'ensure': False} if name in EVENT_OUTPUTS else {}
+    rows = None
+    start = time.perf_counter()
+    try:
+        with pymongo.timeout(timeout):
+            if incremental:
+                rows = refresh(db, name, module, csv_out, **options)
+            else:
+                rows = module.run(db, csv_out, **options)
+                reset_watermark(db, name)
+        status = 'ok'
+    except pymongo.errors.PyMongoError as e:
+        status = 'timed out' if e.timeout else 'failed: {0}'.format(e)
+    except Exception as e:
+        status = 'failed: {0!r}'.format(e)
+    return name, status, rows, time.perf_counter() - start
+
+
+# Runs the formatters of names (all by default) side by side over db's
+# client, so the whole refresh takes about as long as the slowest one.
+# csv_dir replaces each formatter's CSV_PATH when given. The events
+# collection is built first if it is missing or rebuild_events is set.
+# incremental refreshes the csv files with the new matches only.
+def run_all(db, names=None, csv_dir=None, timeout=None, workers=None, rebuild_events=False,
+            incremental=False):
+    names = list(names or FORMATTERS)
+    modules = OrderedDict((name, load_formatter(name)) for name in names)
+    results = []
+    start = time.perf_counter()
+    if any(name in EVENT_OUTPUTS for name in names):
+        if rebuild_events:
+            build_events(db)
+        else:
+            ensure_events(db)
+        print('events: ready in {0:.1f} s'.format(time.perf_counter() - start))
+    with ThreadPoolExecutor(workers or len(names)) as executor:
+        futures = []
+        for name, module in modules.items():
+            if csv_dir is None:
+                csv_out = module.CSV_PATH + module.CSV_NAME
+            else:
+                csv_out = os.path.join(csv_dir, module.CSV_NAME)
+            futures.append(executor.submit(_run_formatter, db, name, module, csv_out, timeout,
+                                           incremental))
+        for future in as_completed(futures):
+            name, status, rows, seconds = result = future.result()
+            if status == 'ok':
+                print('{0}: {1} rows in {2:.1f} s'.format(name, rows, seconds))
+            else:
+                print('{0}: {1} after {2:.1f} s'.format(name, status, seconds))
+            results.append(result)
+    print('{0} formatters in {1:.1f} s, {2:.1f} s summed'.format(
+        len(results), time.perf_counter() - start, sum(result[3] for result in results)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate the csv files in datasets-csv.')
+    parser.add_argument('outputs', nargs='*', metavar='OUTPUT',
+                        help='outputs to regenerate, all by default: ' + ', '.join(FORMATTERS))
+    parser.add_argument('--csv-dir', help='write the csv files here instead of CSV_PATH')
+    parser.add_argument('--timeout', type=float,
+                        help='seconds each formatter may spend querying Mongo')
+    parser.add_argument('--workers', type=int, help='formatters run at once, all by default')
+    parser.add_argument('--rebuild-events', action='store_true',
+                        help='rebuild the events collection from matches first')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only add the matches loaded since the last incremental run')
+    args = parser.parse_args()
+    unknown = [name for name in args.outputs if name not in FORMATTERS]
+    if unknown:
+        parser.error('unknown outputs: ' + ', '.join(unknown))
+    client = get_client(args.workers or len(args.outputs or FORMATTERS))
+    results = run_all(client.seed_lol, args.outputs, args.csv_dir, args.timeout, args.workers,
+                      args.rebuild_events, args.incremental)
+    client.close()
+    sys.exit(any(result[1] != 'ok' for result in results))
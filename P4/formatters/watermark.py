@@ -0,0 +1,52 @@
+import pymongo
+
+# The matchIds each output's incremental refreshes have already covered,
+# one document per (output, matchId), so that the next refresh only runs
+# the output's formatter on the matches loaded since. A full run of the
+# formatter resets its watermark, and the next refresh starts over.
+# events.py keeps the matches whose events are built here too.
+WATERMARKS = 'watermarks'
+DUPLICATE_KEY = 11000
+
+
+def new_match_ids(db, name):
+    done = set(db[WATERMARKS].distinct('matchId', {'output': name}))
+    return sorted(match_id for match_id in db.matches.distinct('matchId') if match_id not in done)
+
+
+# Matches another run has recorded already are skipped.
+def record_watermark(db, name, match_ids):
+    db[WATERMARKS].create_index([('output', pymongo.ASCENDING), ('matchId', pymongo.ASCENDING)],
+                                unique=True)
+    if not match_ids:
+        return
+    try:
+        db[WATERMARKS].insert_many([{'output': name, 'matchId': match_id}
+                                    for match_id in match_ids], ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        if any(error['code'] != DUPLICATE_KEY for error in e.details['writeErrors']):
+            raise
+
+
+def reset_watermark(db, name):
+    db[WATERMARKS].delete_many({'output': name})
+
+
+# Runs module.run_incremental, with options, on the matches name has not
+# covered yet and moves its watermark past them; returns the rows written.
+# A fresh refresh covers every match, so it passes None rather than a
+# list of all the matchIds, which could outgrow a query. A refresh that
+# fails part way may have appended rows or added sums, so it resets the
+# watermark and the next refresh starts over.
+def refresh(db, name, module, csv_out, **options):
+    match_ids = new_match_ids(db, name)
+    if not match_ids:
+        return 0
+    fresh = db[WATERMARKS].find_one({'output': name}) is None
+    try:
+        rows = module.run_incremental(db, None if fresh else match_ids, fresh, csv_out, **options)
+        record_watermark(db, name, match_ids)
+    except Exception:
+        reset_watermark(db, name)
+        raise
+    return rows
@@ -1,35 +1,193 @@
-import json
-import pymongo
-
-DATA_DIR = 'Q:\\Program Files\\Programming Applications\\Projects\\Udacity\\' \
-           'Data Analysis Nanodegree\\P4\\json-to-mongo\\json files'
-
-
-def _get_client():
-    try:
-        ret_client = pymongo.MongoClient('localhost', 27017)
-    except pymongo.errors.ConnectionFailure as e:
-        print(e)
-    else:
-        return ret_client
-
-
-def matches_to_mongo(data_dir=DATA_DIR):
-    for n in range(1, 11):
-        with open(data_dir + 'matches{0}.json'.format(n)) as f:
-            data = json.load(f)
-            db.matches.insert_many(data['matches'])
-
-
-def champs_to_mongo(data_dir=DATA_DIR):
-    with open(data_dir + 'champion.json') as f:
-        data = json.load(f)
-        db.champions.insert(data)
-
-
-if __name__ == '__main__':
-    client = _get_client()
-    db = client.seed_lol
-    matches_to_mongo()
-    champs_to_mongo()
-    client.close()
+import argparse
+import functools
+import json
+import os
+import re
+import time
+import pymongo
+
+from concurrent.futures import ThreadPoolExecutor
+
+DATA_DIR = 'Q:\\Program Files\\Programming Applications\\Projects\\Udacity\\' \
+           'Data Analysis Nanodegree\\P4\\json-to-mongo\\json files'
+N_FILES = 10
+# Matches per insert_many; a match with its timeline is about 1 MB in memory.
+BATCH_SIZE = 20
+# Files ingested at once, each by its own thread over the client's pool.
+WORKERS = 4
+READ_SIZE = 1 << 20
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE_RE = re.compile(r'\s*')
+_NUMBER_TAIL_RE = re.compile(r'[\d.eE+-]*\Z')
+
+
+def _get_client(mock=False, pool_size=WORKERS):
+    if mock:
+        import mongomock
+        return mongomock.MongoClient()
+    try:
+        ret_client = pymongo.MongoClient('localhost', 27017, maxPoolSize=pool_size)
+    except pymongo.errors.ConnectionFailure as e:
+        print(e)
+    else:
+        return ret_client
+
+
+# Reads json values one at a time from a text file, keeping only the
+# unread part of the input in memory.
+class _JsonReader(object):
+    def __init__(self, f, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    # Reads at least as much again as is buffered, so that a value spanning
+    # many reads is still decoded in linear time.
+    def _fill(self):
+        if self.eof:
+            return False
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        data = self.f.read(max(self.read_size, len(self.buffer)))
+        if not data:
+            self.eof = True
+            return False
+        self.buffer += data
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE_RE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError('unexpected end of json input')
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('expected one of {0!r} in json input, found {1!r}'.format(
+                chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                ret, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may go on in the next read.
+            if isinstance(ret, (int, float)) and \
+                    _NUMBER_TAIL_RE.match(self.buffer, end) and self._fill():
+                continue
+            self.pos = end
+            return ret
+
+
+# Yields the elements of the top-level object's key array one by one,
+# without loading the whole file.
+def iter_array(f, key='matches', read_size=READ_SIZE):
+    reader = _JsonReader(f, read_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name != key:
+            reader.value()
+        else:
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        if reader.expect(',}') == '}':
+            return
+
+
+def _batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Unordered, so one bad document (e.g. a duplicate _id) does not stop the
+# rest of the batch; returns how many were inserted.
+def _insert_batch(collection, batch):
+    try:
+        return len(collection.insert_many(batch, ordered=False).inserted_ids)
+    except pymongo.errors.BulkWriteError as e:
+        print('{0} of {1} documents not inserted: {2}'.format(
+            len(e.details['writeErrors']), len(batch), e.details['writeErrors'][0]['errmsg']))
+        return e.details['nInserted']
+
+
+def _report(name, docs, seconds):
+    print('{0}: {1} docs in {2:.1f} s ({3:.0f} docs/s)'.format(
+        name, docs, seconds, docs / seconds if seconds else 0))
+
+
+def file_to_mongo(collection, path, batch_size=BATCH_SIZE, key='matches'):
+    start = time.perf_counter()
+    docs = 0
+    with open(path, encoding='utf-8') as f:
+        for batch in _batches(iter_array(f, key), batch_size):
+            docs += _insert_batch(collection, batch)
+    _report(os.path.basename(path), docs, time.perf_counter() - start)
+    return docs
+
+
+# Streams matches1.json ... matchesN.json into db.matches, workers files
+# at a time. Only batch_size matches per file are held in memory.
+def matches_to_mongo(db, data_dir=DATA_DIR, n_files=N_FILES, workers=WORKERS,
+                     batch_size=BATCH_SIZE):
+    paths = [os.path.join(data_dir, 'matches{0}.json'.format(n)) for n in range(1, n_files + 1)]
+    # The formatters' incremental refresh and events collection look up
+    # which matches are new by matchId.
+    db.matches.create_index([('matchId', pymongo.ASCENDING)])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        docs = sum(executor.map(functools.partial(file_to_mongo, db.matches,
+                                                  batch_size=batch_size), paths))
+    _report('matches', docs, time.perf_counter() - start)
+    return docs
+
+
+def champs_to_mongo(db, data_dir=DATA_DIR):
+    with open(os.path.join(data_dir, 'champion.json'), encoding='utf-8') as f:
+        data = json.load(f)
+        db.champions.insert_one(data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the seed match data into MongoDB.')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--files', type=int, default=N_FILES, metavar='N',
+                        help='load matches1.json ... matchesN.json')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='files loaded at once')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='matches per insert')
+    parser.add_argument('--mock', action='store_true',
+                        help='load into an in-process mongomock database instead')
+    args = parser.parse_args()
+    client = _get_client(args.mock, args.workers)
+    db = client.seed_lol
+    matches_to_mongo(db, args.data_dir, args.files, args.workers, args.batch_size)
+    champs_to_mongo(db, args.data_dir)
+    client.close()